@@ -145,6 +145,33 @@ const CreatePost = () => {
         };
     }, []);
 
+    const commitRating = async (uid: string, ratingUpdates: any) => {
+        for (let attempt = 1; attempt <= 3; attempt++) {
+            try {
+                const res = await fetch("https://capstone-team-generated-group30-project.onrender.com/commit-rating", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({
+                        user_id: uid,
+                        rating_id: ratingUpdates.ratingId,
+                    }),
+                });
+
+                if (res.ok) {
+                    return true;
+                }
+                console.log("Commit rating failed:", res.status);
+                // 4xx (e.g. an expired rating) won't succeed on a retry
+                if (res.status < 500) {
+                    return false;
+                }
+            } catch (e) {
+                console.error("Commit rating error:", e);
+            }
+        }
+        return false;
+    };
+
     const fetchUnsplashImage = async (cityName: string, country: string) => {
         try {
             const url =
@@ -276,9 +303,10 @@ const CreatePost = () => {
             // Prepare updates
             const updates: any = { posts: arrayUnion(postId) }; // Helper for appending to array
 
-            // Apply personalElos and comparisonCount updates from rating
-            if (pendingRatingUpdates.personalElos) {
-                for (const [cityId, elo] of Object.entries(pendingRatingUpdates.personalElos)) {
+            // Apply personalElos (only the ones the rating changed) and comparisonCount updates from rating
+            const personalEloUpdates = pendingRatingUpdates.personalEloUpdates ?? pendingRatingUpdates.personalElos;
+            if (personalEloUpdates) {
+                for (const [cityId, elo] of Object.entries(personalEloUpdates)) {
                     updates[`personalElos.${cityId}`] = elo;
                 }
             }
@@ -289,15 +317,10 @@ const CreatePost = () => {
 
             await updateDoc(userRef, updates);
 
-            // Update global Elos
-            if (pendingRatingUpdates.globalElos) {
-                for (const [cityId, elo] of Object.entries(pendingRatingUpdates.globalElos)) {
-                    const cityRef = doc(FIREBASE_DB, "allCities", cityId);
-                    await updateDoc(cityRef, {
-                        global_Elo: elo,
-                        comparison_count: increment(pendingRatingUpdates.comparisonIncrement),
-                    });
-                }
+            // Commit the rating: the backend kept its global Elo changes under ratingId and
+            // applies them once (a retried commit changes nothing)
+            if (pendingRatingUpdates.ratingId) {
+                await commitRating(uid, pendingRatingUpdates);
             }
 
             // Cleanup local state
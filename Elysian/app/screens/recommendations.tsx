@@ -67,6 +67,8 @@ const Recommendations = () => {
   const doubleTap = useRef<number | null>(null);
   const [currentCity, setCurrentCity] = useState<Recommendation | null>(null);
   const currentCityRef = useRef<Recommendation | null>(null);
+  // Swipes of this screen, sent with /next_city so any backend worker can exclude them
+  const recentSwipesRef = useRef<{ city_id: string; action: string }[]>([]);
   const [unsplashImageUrl, setUnsplashImageUrl] = useState<string | null>(null);
   const [currentCityAttr, setCurrentCityAttr] = useState<string | null>(null);
   const glassAvailable = isLiquidGlassAvailable();
@@ -252,7 +254,7 @@ const Recommendations = () => {
         },
         { merge: true }
       );
-      // await sendSwipe(user.uid, cityId, true); // Update backend with the swipe
+      await sendSwipe(user.uid, cityId, true); // Update backend with the swipe
 
       const nextCity = await fetchNextCity(user.uid);
       const extra = await fetchCityInfo(nextCity.city_name, nextCity.country);
@@ -284,7 +286,7 @@ const Recommendations = () => {
     try {
       const userDocRef = doc(FIREBASE_DB, "userDislikes", user.uid);
       await setDoc(userDocRef, { [`${cityId}`]: city }, { merge: true });
-      // await sendSwipe(user.uid, cityId, false); // Update backend with the swipe
+      await sendSwipe(user.uid, cityId, false); // Update backend with the swipe
       const nextCity = await fetchNextCity(user.uid);
       const extra = await fetchCityInfo(nextCity.city_name, nextCity.country);
 
@@ -342,6 +344,29 @@ const Recommendations = () => {
     };
   }
 
+  // Tell the backend about a swipe so its cached likes/dislikes stay current.
+  async function sendSwipe(userId: string, cityId: string, liked: boolean) {
+    const action = liked ? "like" : "dislike";
+    recentSwipesRef.current = [...recentSwipesRef.current, { city_id: cityId, action }].slice(-100);
+    try {
+      await fetch(
+        "https://capstone-team-generated-group30-project.onrender.com/swipe",
+        {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            user_id: userId,
+            city_id: cityId,
+            action,
+          }),
+        }
+      );
+    } catch (error) {
+      // Not fatal: the backend reloads likes/dislikes from Firestore when its cache expires.
+      console.error("Failed to send swipe:", error);
+    }
+  }
+
   async function fetchNextCity(userId: string) {
     // You need to supply the same profile answers you used to generate recs.
     // If you stored them in Firestore, read them here; for now assume you have them.
@@ -355,6 +380,7 @@ const Recommendations = () => {
         body: JSON.stringify({
           user_id: userId,
           ...profile,
+          recent_swipes: recentSwipesRef.current,
         }),
       }
     );
@@ -0,0 +1,447 @@
+"""
+File: activities_service.py
+Function: Generates things-to-do lists for a city with Gemini, with caching.
+
+Each city's activities are generated once and cached in two levels: an in-process
+LRU and a SQLite file shared by all workers that survives restarts. The cache key
+is a hash of the normalized city and country, PROMPT_VERSION and the model name,
+so changing the prompt (bump PROMPT_VERSION) or the model never serves old lists.
+Entries live for ACTIVITY_CACHE_TTL; prewarm.py refreshes them before they expire.
+Concurrent misses for the same city share one Gemini call, and Gemini is
+configured and the model built once per process (configure()). The *_async
+versions are used by asgi_app.py and share the same caches.
+
+stream_activities() streams a generation: ActivityStreamParser (activity_stream.py)
+picks each complete activity object out of Gemini's streamed JSON so it can be
+sent to the app right away (NDJSON from /api/activities/stream), while the cached
+list is still parsed from the full reply exactly like the non-streaming path.
+
+Gemini calls go through upstream.gemini (deadline, bulkhead, circuit breaker);
+while Gemini is failing the last cached list is served even if it has expired.
+Only Gemini and parse errors (GENERATION_ERRORS) fall back to that list; any other
+exception is a bug and is raised. The Gemini SDK is imported by configure().
+
+Precompute the whole catalog from the command line:
+    python activities_service.py --precompute [--workers 4] [--force]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import json
+import threading
+from activity_stream import ActivityStreamParser
+from ttl_cache import LRUTTLCache
+from disk_cache import DiskCache
+from single_flight import AsyncSingleFlight, SingleFlight
+import upstream
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Optional API endpoint (e.g. "http://127.0.0.1:8766" for a local stand-in server)
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT", "")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "models/gemini-3-flash-preview")
+MAX_ACTIVITIES = 16
+PROMPT_VERSION = "1"   # Bump whenever build_prompt() or GENERATION_CONFIG changes
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 3000,
+    "response_mime_type": "application/json"
+}
+
+# Cache settings
+ACTIVITY_CACHE_TTL = int(os.environ.get("ACTIVITY_CACHE_TTL", str(7 * 24 * 3600)))   # 7 days
+ACTIVITY_MEMORY_CACHE_SIZE = int(os.environ.get("ACTIVITY_MEMORY_CACHE_SIZE", "1024"))
+ACTIVITY_CACHE_PATH = os.environ.get("ACTIVITY_CACHE_PATH", "activity_cache.db")
+
+memory_cache = LRUTTLCache(maxsize=ACTIVITY_MEMORY_CACHE_SIZE, ttl=ACTIVITY_CACHE_TTL)
+disk_cache = DiskCache(ACTIVITY_CACHE_PATH)
+in_flight = SingleFlight()
+async_in_flight = AsyncSingleFlight()
+generated = 0
+
+_model = None
+_model_lock = threading.Lock()
+
+# What a failed generation raises: rejected, timed out or failed calls, and replies that
+# aren't the expected JSON (json.JSONDecodeError and a blocked reply's .text are ValueErrors)
+GENERATION_ERRORS = upstream.UNAVAILABLE_ERRORS + (ValueError,)
+
+
+def cache_key(city, country):
+    # "  Paris " / "paris" share one entry; a new prompt version or model gets new entries
+    parts = [" ".join(city.lower().split()), " ".join(country.lower().split()), PROMPT_VERSION, GEMINI_MODEL]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def build_prompt(city, country):
+    return f"""
+            Return ONLY valid JSON.
+
+            Generate 16 activities for:
+            City: {city}
+            Country: {country}
+
+            Each activity must be assigned EXACTLY one category from this set:
+            ["restaurants", "outdoor", "arts", "entertainment"]
+
+            Rules:
+            - Activity names must be short (2-6 words)
+            - No numbering
+            - No emojis
+            - No duplicates
+            - Output format EXACTLY:
+
+            {{
+                "activities": [
+                    {{ "name": "Activity name", "category": "arts" }}
+                ]
+            }}
+        """
+
+
+def configure():
+    '''
+    Function that configures Gemini and builds the model once; later calls return the same model.
+    Called at server startup, and lazily by the CLI and prewarm job.
+    '''
+    global _model
+    with _model_lock:
+        if _model is None:
+            import google.generativeai as genai
+            if not GEMINI_API_KEY:
+                print("WARNING: GEMINI_API_KEY not set")
+            elif GEMINI_API_ENDPOINT:
+                genai.configure(
+                    api_key=GEMINI_API_KEY,
+                    transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT}
+                )
+            else:
+                genai.configure(api_key=GEMINI_API_KEY)
+            _model = genai.GenerativeModel(GEMINI_MODEL)
+        return _model
+
+
+def parse_activities(text):
+    '''
+    Function that turns Gemini's JSON reply into at most MAX_ACTIVITIES activities.
+    '''
+    data = json.loads(text)
+    activities = data.get("activities", [])
+
+    # Activities = [dicts]
+    return activities[:MAX_ACTIVITIES]
+
+
+def request_options(timeout):
+    return {"timeout": timeout} if timeout else None
+
+
+def generate_activities(city, country, timeout=None):
+    '''
+    Function that asks Gemini for the city's activities (a list of {"name", "category"}).
+    Raises if the call fails, takes longer than timeout seconds or the reply isn't valid JSON.
+    '''
+    global generated
+    model = _model or configure()
+
+    response = model.generate_content(
+        build_prompt(city, country),
+        generation_config=GENERATION_CONFIG,
+        request_options=request_options(timeout)
+    )
+    generated += 1
+    return parse_activities(response.text)
+
+
+async def generate_activities_async(city, country, timeout=None):
+    '''
+    Function for generate_activities that awaits Gemini instead of blocking a thread (asgi_app.py).
+    '''
+    global generated
+    model = _model or configure()
+
+    response = await model.generate_content_async(
+        build_prompt(city, country),
+        generation_config=GENERATION_CONFIG,
+        request_options=request_options(timeout)
+    )
+    generated += 1
+    return parse_activities(response.text)
+
+
+def _store(key, activities):
+    disk_cache.set(key, activities, ACTIVITY_CACHE_TTL)
+    memory_cache.set(key, activities)
+
+
+def _generate(key, city, country, timeout=None):
+    activities = upstream.gemini.call(generate_activities, city, country, timeout=timeout)
+    _store(key, activities)
+    return activities
+
+
+def _load(key, city, country):
+    # Runs once per key at a time (see SingleFlight): disk cache first, then Gemini.
+    found, activities = disk_cache.get(key)
+    if not found:
+        return _generate(key, city, country, timeout=upstream.ACTIVITY_REQUEST_TIMEOUT)
+    memory_cache.set(key, activities)
+    return activities
+
+
+def _stale(key):
+    # Last cached list (even if expired) for when Gemini is failing or its circuit is open
+    found, activities = disk_cache.get_stale(key)
+    if found:
+        upstream.gemini.record_fallback()
+        return activities
+    return None
+
+
+def refresh_activities(city, country):
+    '''
+    Function that generates the city's activities again and stores them in both caches.
+    Raises if Gemini fails, leaving the cached entry as it was.
+    '''
+    key = cache_key(city, country)
+    return in_flight.do(key, lambda: _generate(key, city, country))
+
+
+def get_activities(city, country):
+    '''
+    Function that returns the city's activities from the cache, generating them on a miss.
+    '''
+    key = cache_key(city, country)
+    activities = memory_cache.get(key)
+    if activities is not None:
+        return activities
+    try:
+        return in_flight.do(key, lambda: _load(key, city, country))
+    except GENERATION_ERRORS:
+        activities = _stale(key)
+        if activities is None:
+            raise
+        return activities
+
+
+async def _load_async(key, city, country):
+    # SQLite reads and writes block, so they run in a thread instead of on the event loop.
+    found, activities = await asyncio.to_thread(disk_cache.get, key)
+    if not found:
+        activities = await upstream.gemini.call_async(
+            generate_activities_async, city, country, timeout=upstream.ACTIVITY_REQUEST_TIMEOUT
+        )
+        await asyncio.to_thread(_store, key, activities)
+    else:
+        memory_cache.set(key, activities)
+    return activities
+
+
+async def get_activities_async(city, country):
+    '''
+    Function for get_activities on the event loop; shares both caches with it.
+    '''
+    key = cache_key(city, country)
+    activities = memory_cache.get(key)
+    if activities is not None:
+        return activities
+    try:
+        return await async_in_flight.do(key, lambda: _load_async(key, city, country))
+    except GENERATION_ERRORS:
+        activities = await asyncio.to_thread(_stale, key)
+        if activities is None:
+            raise
+        return activities
+
+
+def _chunk_text(chunk):
+    # The last streamed chunk can carry only the finish reason and no text.
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def _end_stream_call(token, e):
+    if token is None:
+        return
+    if isinstance(e, Exception):
+        upstream.gemini.end(token, e)
+    else:
+        upstream.gemini.release(token)
+
+
+def _cached(key):
+    activities = memory_cache.get(key)
+    if activities is None:
+        found, activities = disk_cache.get(key)
+        if found:
+            memory_cache.set(key, activities)
+    return activities
+
+
+def _generate_stream(key, city, country, call):
+    # Runs on the single-flight thread, so it streams from Gemini at Gemini's pace and holds
+    # the bulkhead slot only for the generation, however slowly the clients read.
+    global generated
+    parser = ActivityStreamParser(limit=MAX_ACTIVITIES)
+    token = None
+    try:
+        token = upstream.gemini.begin()
+        model = _model or configure()
+        response = model.generate_content(
+            build_prompt(city, country),
+            generation_config=GENERATION_CONFIG,
+            request_options=request_options(upstream.ACTIVITY_REQUEST_TIMEOUT),
+            stream=True
+        )
+        for chunk in response:
+            for activity in parser.feed(_chunk_text(chunk)):
+                call.publish(activity)
+        # Parse the whole reply exactly like the non-streaming path, so the cached list matches it.
+        activities = parse_activities(parser.text)
+    except BaseException as e:
+        _end_stream_call(token, e)
+        raise
+    upstream.gemini.end(token)
+    generated += 1
+    _store(key, activities)
+    return activities
+
+
+def stream_activities(city, country):
+    '''
+    Generator for the streaming version of get_activities. Yields {"activity": {...}}
+    for each activity as soon as Gemini has produced it, then {"ok": True, "activities": [...]},
+    which is the same body /api/activities returns and the list that gets cached.
+    The generation runs on its own thread and every request for the city reads what it
+    published, so a slow or disconnected client never holds up the others.
+    '''
+    key = cache_key(city, country)
+    activities = _cached(key)
+    sent = 0
+
+    if activities is None:
+        call, _ = in_flight.start(key, lambda call: _generate_stream(key, city, country, call))
+        try:
+            for activity in call.stream():
+                yield {"activity": activity}
+                sent += 1
+            activities = call.wait()
+        except GENERATION_ERRORS:
+            # Gemini failed or its circuit is open: send the last cached list instead,
+            # unless part of a new list has already been sent
+            activities = _stale(key) if sent == 0 else None
+            if activities is None:
+                raise
+
+    for activity in activities[sent:]:
+        yield {"activity": activity}
+    yield {"ok": True, "activities": activities}
+
+
+async def _generate_stream_async(key, city, country, call):
+    # Runs as the single-flight task, so it streams from Gemini at Gemini's pace and holds
+    # the bulkhead slot only for the generation, however slowly the clients read.
+    global generated
+    parser = ActivityStreamParser(limit=MAX_ACTIVITIES)
+    token = None
+    try:
+        token = upstream.gemini.begin()
+        model = _model or configure()
+        response = await model.generate_content_async(
+            build_prompt(city, country),
+            generation_config=GENERATION_CONFIG,
+            request_options=request_options(upstream.ACTIVITY_REQUEST_TIMEOUT),
+            stream=True
+        )
+        async for chunk in response:
+            for activity in parser.feed(_chunk_text(chunk)):
+                call.publish(activity)
+        activities = parse_activities(parser.text)
+    except BaseException as e:
+        _end_stream_call(token, e)
+        raise
+    upstream.gemini.end(token)
+    generated += 1
+    await asyncio.to_thread(_store, key, activities)
+    return activities
+
+
+async def stream_activities_async(city, country):
+    '''
+    Async generator version of stream_activities (asgi_app.py). Every request for the
+    city, including the one that started the generation, reads the activities the
+    single-flight task publishes, so a slow or disconnected client never holds up the others.
+    '''
+    key = cache_key(city, country)
+    activities = await asyncio.to_thread(_cached, key)
+    sent = 0
+
+    if activities is None:
+        call, _ = async_in_flight.join(key, lambda call: _generate_stream_async(key, city, country, call))
+        try:
+            async for activity in call.stream():
+                yield {"activity": activity}
+                sent += 1
+            activities = await call.wait()
+        except GENERATION_ERRORS:
+            activities = await asyncio.to_thread(_stale, key) if sent == 0 else None
+            if activities is None:
+                raise
+
+    for activity in activities[sent:]:
+        yield {"activity": activity}
+    yield {"ok": True, "activities": activities}
+
+
+def expires_at(city, country):
+    '''
+    Function that returns when the city's cached activities expire (None if not cached).
+    '''
+    return disk_cache.expires_at(cache_key(city, country))
+
+
+def stats():
+    '''
+    Function that returns cache counters for /metrics.
+    '''
+    return {
+        "memoryCache": memory_cache.stats(),
+        "diskCache": disk_cache.stats(),
+        "singleFlight": in_flight.stats(),
+        "asyncSingleFlight": async_in_flight.stats(),
+        "generated": generated
+    }
+
+
+def main():
+    from prewarm import ACTIVITY_RATE, PREWARM_REFRESH_MARGIN, PREWARM_WORKERS, Prewarmer, RateLimiter, catalog_cities
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precompute", action="store_true", help="Generate activities for every city in cities.csv")
+    parser.add_argument("--workers", type=int, default=PREWARM_WORKERS, help="Concurrent Gemini calls")
+    parser.add_argument("--rate", type=float, default=ACTIVITY_RATE, help="Gemini calls per second")
+    parser.add_argument("--force", action="store_true", help="Regenerate cities that are already cached")
+    args = parser.parse_args()
+    if not args.precompute:
+        parser.error("nothing to do (use --precompute)")
+
+    configure()
+    disk_cache.cleanup()
+    # Same bounded, rate-limited pass as the prewarm job; --force treats every entry as expiring
+    prewarmer = Prewarmer(
+        catalog_cities(),
+        {"activities": (expires_at, refresh_activities, RateLimiter(args.rate))},
+        workers=args.workers,
+        refresh_margin=float("inf") if args.force else PREWARM_REFRESH_MARGIN
+    )
+    status = prewarmer.run_pass("activities")
+    print(status)
+    raise SystemExit(1 if status["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+File: activity_stream.py
+Function: Picks activity objects out of Gemini's JSON reply while it streams in.
+
+Kept apart from activities_service.py so it has no Gemini dependency. The parser
+only ever returns whole objects: an object cut off by a truncated reply is never
+returned, and parsing the full text (activities_service.parse_activities) then
+fails, so the stream ends with an error line.
+"""
+
+import json
+
+
+class ActivityStreamParser:
+    '''
+    Class that reads Gemini's JSON reply as it streams in and returns each object of
+    the "activities" array as soon as its closing brace arrives. Only the new text is
+    scanned on each feed(), tracking string/escape state and nesting depth. At most
+    limit objects are returned (no cap if None).
+    '''
+
+    def __init__(self, limit=None):
+        self.text = ""
+        self.limit = limit
+        self.count = 0
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._array_depth = None   # Depth inside the "activities" array
+        self._item_start = None
+
+    def feed(self, chunk):
+        '''
+        Function that adds streamed text and returns the activities it completed.
+        '''
+        self.text += chunk
+        text = self.text
+        items = []
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:i + 1]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "{" or ch == "[":
+                if ch == "[" and self._depth == 1 and self._last_string == '"activities"':
+                    self._array_depth = 2
+                elif ch == "{" and self._depth == self._array_depth:
+                    self._item_start = i
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth:
+                    if self.limit is None or self.count < self.limit:
+                        items.append(json.loads(text[self._item_start:i + 1]))
+                        self.count += 1
+                    self._item_start = None
+                elif ch == "]" and self._depth == 1:
+                    self._array_depth = None
+        self._pos = len(text)
+        return items
@@ -0,0 +1,211 @@
+"""
+File: ann_index.py
+Function: Approximate nearest-neighbour (IVF) index for picking candidate cities.
+
+Scoring every row is fine for the 196 cities of the catalog, but not for tens of
+thousands of neighborhoods and points of interest. The dynamic score of a city is
+a dot product with one query vector (see ScoringEngine.query_vector), so the best
+cities are a maximum inner product search:
+
+- Offline, k-means splits the index vectors into `nlist` lists (coarse quantizer)
+  and the vectors are stored list by list as float16, so each list is one
+  contiguous slice.
+- Per request, the `nprobe` lists whose centroids score highest are scanned and
+  the best `candidates` rows are kept. app.py then re-scores only those with the
+  exact ALPHA/BETA/GAMMA scores.
+
+nprobe (ANN_NPROBE) and candidates (ANN_CANDIDATES) trade recall for latency;
+bench_ann.py measures recall@k against brute force. The index is saved as a
+directory of .npy files (memory-mapped like the rest of artifact_bundle.py):
+    python ann_index.py [--nlist 256] [--out city_ann]
+or as part of a bundle with `python artifact_bundle.py build --ann`.
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))   # Lists scanned per query
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", "100"))   # Rows kept for exact re-scoring
+ANN_INDEX_PATH = "city_ann"   # Next to city_vectors.npy when there is no artifact bundle
+
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE_PER_LIST = 256   # k-means trains on at most this many points per list
+ASSIGN_CHUNK = 8192   # Rows per distance block, bounds memory to chunk x nlist
+
+PARAMS_FILE = "params.json"
+ARRAYS = ("centroids", "offsets", "ids", "vectors")
+
+
+def default_nlist(num_rows):
+    # About 4 * sqrt(n) lists, so a list holds ~sqrt(n) / 4 rows
+    return int(max(1, min(num_rows, round(4 * np.sqrt(num_rows)))))
+
+
+def _assign(vectors, centroids):
+    '''
+    Function that returns the nearest (L2) centroid of every row, in blocks.
+    '''
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        # ||x - c||^2 without the ||x||^2 term, which is the same for every centroid
+        distances = centroid_sq - 2 * (block @ centroids.T)
+        labels[start:start + len(block)] = np.argmin(distances, axis=1)
+    return labels
+
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    '''
+    Function that runs Lloyd's k-means on a sample of the rows and returns the centroids.
+    Empty lists are re-seeded with random rows.
+    '''
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.stack([np.bincount(labels, weights=sample[:, d], minlength=nlist) for d in range(sample.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    '''
+    Class for an inverted-file index: centroids, plus the rows of every list stored
+    contiguously (ids[offsets[l]:offsets[l + 1]] are the rows of list l).
+    '''
+
+    def __init__(self, centroids, offsets, ids, vectors, nprobe=ANN_NPROBE, candidates=ANN_CANDIDATES):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.candidates = candidates
+
+    @classmethod
+    def build(cls, vectors, nlist=None, iterations=KMEANS_ITERATIONS, seed=0):
+        '''
+        Function that trains the coarse quantizer and groups the rows by list.
+        '''
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = min(nlist or default_nlist(len(vectors)), len(vectors))
+        centroids = kmeans(vectors, nlist, iterations, seed)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=nlist))
+        return cls(
+            centroids,
+            offsets,
+            order.astype(np.int32),
+            vectors[order].astype(np.float16)
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(**arrays)
+
+    def save(self, path):
+        '''
+        Function that writes the index as a directory of .npy files.
+        Returns the names of the written files.
+        '''
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for name in ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+            files.append(f"{name}.npy")
+        with open(os.path.join(path, PARAMS_FILE), "w") as f:
+            json.dump({"nlist": self.nlist, "numRows": len(self), "dim": self.dim}, f, indent=2)
+        files.append(PARAMS_FILE)
+        return files
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def dim(self):
+        return int(self.centroids.shape[1])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def probe(self, query, nprobe=None):
+        '''
+        Function that returns the lists whose centroids score highest for the query.
+        '''
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            return np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.arange(self.nlist)
+
+    def search(self, query, k=None, nprobe=None, exclude=()):
+        '''
+        Function that returns the rows with the highest approximate scores (dot
+        product with the float16 vectors) among the probed lists, best first,
+        skipping the excluded rows. May return fewer than k rows.
+        '''
+        k = k or self.candidates
+        query = np.asarray(query, dtype=np.float32)
+        lists = self.probe(query, nprobe)
+        ids = np.concatenate([self.ids[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+        vectors = np.concatenate([self.vectors[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+        scores = vectors.astype(np.float32) @ query
+
+        if len(exclude):
+            scores[np.isin(ids, np.asarray(exclude, dtype=ids.dtype))] = -np.inf
+        available = int(np.count_nonzero(scores > -np.inf))
+        k = min(k, available)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.flatnonzero(scores > -np.inf)
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return ids[best].astype(np.int64)
+
+    def stats(self):
+        return {"numRows": len(self), "nlist": self.nlist, "nprobe": self.nprobe, "candidates": self.candidates}
+
+
+def load_index(path=ANN_INDEX_PATH):
+    '''
+    Function that loads an index directory, or returns None if there is none.
+    '''
+    if not os.path.isfile(os.path.join(path, "centroids.npy")):
+        return None
+    return IVFIndex.load(path)
+
+
+def main():
+    from artifact_bundle import normalize_rows
+    from scoring import ann_vectors
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", default="city_vectors.npy")
+    parser.add_argument("--nlist", type=int, help="Number of lists (default: about 4 * sqrt(num cities))")
+    parser.add_argument("--out", default=ANN_INDEX_PATH)
+    args = parser.parse_args()
+
+    vectors = np.load(args.vectors).astype(np.float32)
+    index = IVFIndex.build(ann_vectors(vectors, normalize_rows(vectors)), nlist=args.nlist)
+    index.save(args.out)
+    print(f"Built {args.out}: {len(index)} rows in {index.nlist} lists")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,20 +8,29 @@ likes and dislikes stored in Firebase. It also includes a helper endpoint
 to fetch a city image for the app.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import numpy as np
-import pandas as pd
-import tensorflow as tf
 import joblib
-from numpy.linalg import norm
+import unsplash_service
 from unsplash_service import fetch_city_image
+from scoring import ScoringEngine, top_k
+from candidate_queue import MAX_NEXT_CITIES, CursorStore, next_cities_params
+from interpreter_pool import InterpreterPool
+from ttl_cache import LRUTTLCache
+from profile_encoder import CompiledProfileEncoder
+from feedback_store import FeedbackStore, fetch_user_feedback, write_swipe
+from leaderboard import Leaderboard
+from artifact_bundle import BundleWatcher
 import os
 import json
+import time
+import hashlib
+import threading
 import rate_cities
 from firebase_config import db
-import google.generativeai as genai
-
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+import activities_service
+import upstream
+from prewarm import build_prewarmer
 
 app = Flask(__name__)
 
@@ -33,28 +42,30 @@ le_origin = joblib.load("le_origin.pkl")
 le_fav = joblib.load("le_fav.pkl")
 mlbs = joblib.load("mlbs.pkl")   # dict of MultiLabelBinarizers
 
+# Compile the fitted encoders into plain lookup tables once at startup.
+profile_encoder = CompiledProfileEncoder(le_origin, le_fav, mlbs)
+
 # ---------------------------------------------------------
 # Load city data + precomputed embeddings
 # ---------------------------------------------------------
-cities_df = pd.read_csv("../../Datasets/cities.csv")
-city_vectors = np.load("city_vectors.npy")   # shape: (num_cities, embedding_dim)
-
-# Map city_id -> index in cities_df / city_vectors
-city_id_to_idx = {
-    row["city_id"]: idx
-    for idx, row in cities_df.iterrows()
-}
+# The active artifact bundle is memory-mapped, so every worker shares one copy of the
+# embeddings and city metadata (see artifact_bundle.py). Without a bundle the legacy
+# city_vectors.npy and cities.csv are loaded instead. What requests use of it is
+# `city_state` (see CityState below).
+city_bundles = BundleWatcher()
 
 
 # ---------------------------------------------------------
 # Load user-only TFLite model
 # ---------------------------------------------------------
-interpreter = tf.lite.Interpreter(model_path="user_encoder.tflite")
-interpreter.allocate_tensors()
+USER_ENCODER_PATH = "user_encoder.tflite"
 
-input_details = interpreter.get_input_details()
+# A pool of interpreters so concurrent requests never share one interpreter's tensors.
+interpreter_pool = InterpreterPool(USER_ENCODER_PATH)
 
-output_details = interpreter.get_output_details()
+input_details = interpreter_pool.input_details
+
+output_details = interpreter_pool.output_details
 
 U_MULTI_IDX = 0
 U_ORIGIN_IDX = 1
@@ -65,152 +76,376 @@ U_FAV_IDX = 2
 # Helper: Encode user profile into model-ready inputs
 # ---------------------------------------------------------
 def encode_user_inputs(data):
-    # Encode origin country using the pickled encoded origin country file.
-    origin_enc = float(le_origin.transform([data["origin_country"]])[0])
-
-    # Encode favorite country visited using the pickled encoded favorite country file.
-    fav_enc = float(le_fav.transform([data["favorite_country_visited"]])[0])
-
-    # Encode multi-hot vector.
-    multi_hot_parts = []
-    # Go through each question that is multi-select.
-    for feature in ["vacation_types", "seasons", "budget", "place_type"]:
-        values = data.get(feature, [])
-        mlb = mlbs[feature] # Encode the feature based on the MultiLabelBinarizer file.
-        encoded = mlb.transform([values])[0]
-        multi_hot_parts.append(encoded) # Add this to the encoded multi hot questions.
-
-    multi_hot = np.concatenate(multi_hot_parts).astype(np.float32) # Change as a np, which is what the model expects.
-    # print("User multi-hot length:", len(multi_hot))
-
-
-    return origin_enc, fav_enc, multi_hot
+    # Lookup-table version of le_origin/le_fav/mlbs .transform (bit-identical, see profile_encoder.py).
+    # Returns the encoded origin country, the encoded favorite country visited and the multi-hot vector.
+    return profile_encoder.encode(data)
 
 
 # ---------------------------------------------------------
 # Helper: Run user encoder TFLite model
 # ---------------------------------------------------------
-def get_user_embedding(origin_enc, fav_enc, multi_hot):
+def get_user_embedding(origin_enc, fav_enc, multi_hot, pool=None):
+    # `pool` is the interpreter pool the caller read once (see reload_user_encoder).
+    pool = pool or interpreter_pool
+    input_details = pool.input_details
     # Set the input details that the user tower needs.
     #ASK: Isn't the order different in the model code vs how we pass it in here?
     # There was an error when we did it another way, so we changed it to use this order but it doesn't make sense.
-    interpreter.set_tensor(input_details[U_MULTI_IDX]["index"], np.array([multi_hot], dtype=np.float32)) # Set the multi hot input.
-    interpreter.set_tensor(input_details[U_ORIGIN_IDX]["index"], np.array([[origin_enc]], dtype=np.float32)) # Set the origin country input.
-    interpreter.set_tensor(input_details[U_FAV_IDX]["index"], np.array([[fav_enc]], dtype=np.float32)) # Set the favorite country input.
-
-    # Given the encoded user inputs, invoke the model to get the embedded user inputs.
-    interpreter.invoke()
+    # The pool lends one interpreter for the whole set/invoke/get sequence so other threads can't clobber its tensors.
+    user_vecs = pool.run({
+        input_details[U_MULTI_IDX]["index"]: np.array([multi_hot], dtype=np.float32), # Set the multi hot input.
+        input_details[U_ORIGIN_IDX]["index"]: np.array([[origin_enc]], dtype=np.float32), # Set the origin country input.
+        input_details[U_FAV_IDX]["index"]: np.array([[fav_enc]], dtype=np.float32) # Set the favorite country input.
+    })
 
     # Output is the user embedding vector
-    user_vec = interpreter.get_tensor(output_details[0]["index"])[0]
+    user_vec = user_vecs[0]
     return user_vec
 
 # ---------------------------------------------------------
-# Firebase helpers: likes/dislikes
+# Cache of raw (pre-feedback) user embeddings keyed by profile fingerprint
 # ---------------------------------------------------------
-def get_user_feedback(user_id):
-    fav_doc = db.collection("userFavorites").document(user_id).get() # Get the favorite cities of the user.
-    dislike_doc = db.collection("userDislikes").document(user_id).get() # Get the disliked cities of the user.
+embedding_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096")),
+    ttl=int(os.environ.get("EMBEDDING_CACHE_TTL", "3600"))
+)
+
+MODEL_CHECK_INTERVAL = 30   # Seconds between checks for a new user_encoder.tflite
+_model_checked_at = time.time()
+_model_check_lock = threading.Lock()   # Guards _model_checked_at
+_model_lock = threading.Lock()   # One reload at a time
+
+def profile_fingerprint(origin_enc, fav_enc, multi_hot):
+    # Identical questionnaire answers encode to identical inputs, so hash the encoded profile.
+    digest = hashlib.sha1()
+    digest.update(np.array([origin_enc, fav_enc], dtype=np.float32).tobytes())
+    digest.update(np.asarray(multi_hot, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+def reload_user_encoder():
+    # Swap in a fresh interpreter pool for the model file. Requests read `interpreter_pool` once
+    # and use that pool's own input details, and embeddings are cached under the pool's model
+    # version, so a request running during the swap never mixes the two models.
+    global interpreter_pool, input_details, output_details
+    with _model_lock:
+        if os.path.getmtime(USER_ENCODER_PATH) == interpreter_pool.version:
+            return # Another thread already reloaded it.
+        pool = InterpreterPool(USER_ENCODER_PATH)
+        interpreter_pool = pool
+        input_details = pool.input_details
+        output_details = pool.output_details
+    embedding_cache.clear() # Entries of the old version can't be hit anymore; free them.
+
+def check_user_encoder():
+    # Reload the model (and invalidate the cache) if the file changed on disk.
+    # One request per interval looks at the file; the others keep using the current pool.
+    global _model_checked_at
+    with _model_check_lock:
+        now = time.time()
+        if now - _model_checked_at < MODEL_CHECK_INTERVAL:
+            return
+        _model_checked_at = now
+    if os.path.getmtime(USER_ENCODER_PATH) != interpreter_pool.version:
+        reload_user_encoder()
+
+def get_cached_user_embedding(origin_enc, fav_enc, multi_hot):
+    check_user_encoder()
+    pool = interpreter_pool
+    key = (pool.version, profile_fingerprint(origin_enc, fav_enc, multi_hot))
+    user_vec = embedding_cache.get(key)
+    if user_vec is None:
+        user_vec = get_user_embedding(origin_enc, fav_enc, multi_hot, pool) # Only run inference on a miss.
+        embedding_cache.set(key, user_vec)
+    # Return a copy since adjust_user_embedding updates the vector in place.
+    return user_vec.copy()
 
-    liked = list(fav_doc.to_dict().keys()) if fav_doc.exists else [] # Save as a dictionary.
-    disliked = list(dislike_doc.to_dict().keys()) if dislike_doc.exists else [] # Save as a dictionary.
+# ---------------------------------------------------------
+# Helper: Run user encoder TFLite model on many profiles at once
+# ---------------------------------------------------------
+def get_user_embeddings_batch(origin_batch, fav_batch, multi_batch, pool=None):
+    # Inputs are the (N, 1), (N, 1) and (N, multi_hot_size) float32 arrays from encode_batch.
+    # The pool runs them on an interpreter sized for N rows (see interpreter_pool.py), so all N
+    # embeddings come out of a single invoke.
+    pool = pool or interpreter_pool
+    input_details = pool.input_details
+    return pool.run({
+        input_details[U_MULTI_IDX]["index"]: multi_batch,
+        input_details[U_ORIGIN_IDX]["index"]: origin_batch,
+        input_details[U_FAV_IDX]["index"]: fav_batch
+    })
+
+def embed_profiles(profiles):
+    # Encode every profile, then embed them all in one batch. Returns an (N, embedding_dim) array.
+    # Picks up a new model file like /next_city does.
+    check_user_encoder()
+    origin_batch, fav_batch, multi_batch = profile_encoder.encode_batch(profiles)
+    return get_user_embeddings_batch(origin_batch, fav_batch, multi_batch, interpreter_pool)
 
-    return liked, disliked
+# ---------------------------------------------------------
+# Firebase helpers: likes/dislikes
+# ---------------------------------------------------------
+def get_user_feedback(user_id):
+    # Get the favorite and disliked cities of the user in a single batched read
+    # (with a short deadline, behind the Firestore circuit breaker).
+    return upstream.firestore.call(fetch_user_feedback, db, user_id, timeout=upstream.FEEDBACK_READ_TIMEOUT)
 
-def adjust_user_embedding(user_vec, liked_idx, disliked_idx, lr=0.1):
-    if liked_idx:
-        liked_vecs = city_vectors[liked_idx] # Get the city vector of the liked city.
-        user_vec += lr * np.mean(liked_vecs, axis=0) # Add the mean of the liked city to the user vector to give more weight to similar cities.
+def adjust_user_embedding(user_vec, liked_mean, disliked_mean, lr=0.1):
+    # liked_mean / disliked_mean are the mean vectors of the liked / disliked cities (None if there are none).
+    if liked_mean is not None:
+        user_vec += lr * liked_mean # Add the mean of the liked city to the user vector to give more weight to similar cities.
 
-    if disliked_idx:
-        disliked_vecs = city_vectors[disliked_idx] # Get the city vector of the disliked city.
-        user_vec -= lr * np.mean(disliked_vecs, axis=0) # Subtract the mean of the disliked city to the user vector to give less weight to similar cities.
+    if disliked_mean is not None:
+        user_vec -= lr * disliked_mean # Subtract the mean of the disliked city to the user vector to give less weight to similar cities.
 
     # Normalize to keep vector stable
     user_vec = user_vec / (np.linalg.norm(user_vec) + 1e-8)
     return user_vec
 
-
-def to_indices(city_ids):
-    return [city_id_to_idx[cid] for cid in city_ids if cid in city_id_to_idx]
-
 # ---------------------------------------------------------
 # Similarity + ranking
 # ---------------------------------------------------------
-def cosine(a, b):
-    return np.dot(a, b) / (norm(a) * norm(b) + 1e-8)
-
-
-def similarity_to_group(city_vec, group_idx):
-    if not group_idx:
-        return 0.0
-    # Get the cosine similarity of a city vector compared to the group.
-    sims = [cosine(city_vec, city_vectors[i]) for i in group_idx]
-    return float(np.mean(sims))
-
-
 ALPHA = 1.0
 BETA = 0.7
 GAMMA = 0.7
 
-def get_dynamic_scores(user_vec, liked_idx, disliked_idx):
-    base_scores = city_vectors @ user_vec  # From the modified user vector, get the similarity scores as the base score.
-
-    final_scores = []
-    for i, city_vec in enumerate(city_vectors):
-        # Get the cosine similarity of a single city vector and the group of liked city vectors.
-        sim_liked = similarity_to_group(city_vec, liked_idx)
-        # Get the cosine similarity of a single city vector and the group of disliked city vectors.
-        sim_disliked = similarity_to_group(city_vec, disliked_idx)
-        # Now, recompute the scores to keep the base score weight, but also the liked and disliked weights.
-        score = (
-            ALPHA * base_scores[i] +
-            BETA * sim_liked -
-            GAMMA * sim_disliked
-        )
-        final_scores.append(score) # Keep a list of all the scores
-
-    return np.array(final_scores)
-
-def next_city(user_vec, liked_idx, disliked_idx):
-    # Gets the new scores based on the new liked/disliked cities.
-    scores = get_dynamic_scores(user_vec, liked_idx, disliked_idx)
-
-    # Exclude already swiped cities
-    seen = set(liked_idx + disliked_idx)
-    for idx in seen:
-        scores[idx] = -1e9  # effectively remove
-
-    next_idx = int(np.argmax(scores)) # The next city is the one with the highest score.
-    row = cities_df.iloc[next_idx] # Get the corresponding row of that city.
+class CityState:
+    '''
+    Class that holds everything built from one artifact bundle: the bundle (city rows and
+    city_id -> index), its scoring engine and its IVF index. It never changes; a new
+    bundle gets a new CityState, swapped in with one assignment. A request reads
+    `city_state` once (current_city_state) and passes it along, so it never mixes the
+    indices of two bundles.
+    '''
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.version = bundle.version
+        # Row-normalized city vectors are built once here so scoring is a few matrix products per request.
+        self.engine = ScoringEngine(bundle.vectors, alpha=ALPHA, beta=BETA, gamma=GAMMA, normed=bundle.normed)
+        # IVF index for picking candidates on large catalogs (None: score every city, see ann_index.py)
+        self.ann = bundle.ann
+
+city_state = CityState(city_bundles.bundle)
+
+# Running per-user sums of liked/disliked city vectors. Loaded from Firebase the first time,
+# then kept up to date by /swipe so a request does O(d) feedback work instead of O(swipes x d).
+# Each aggregate is built from (and tagged with) one bundle.
+feedback_store = FeedbackStore(
+    get_user_feedback,
+    version=city_state.version,
+    maxsize=int(os.environ.get("FEEDBACK_CACHE_SIZE", "10000")),
+    max_staleness=int(os.environ.get("FEEDBACK_MAX_STALENESS", "300"))
+)
+
+def get_dynamic_scores(state, user_vec, liked_mean_norm, disliked_mean_norm):
+    # Keep the base score weight from the modified user vector, and add the mean cosine similarity
+    # to the liked cities and subtract the mean cosine similarity to the disliked cities.
+    return state.engine.scores_from_means(user_vec, liked_mean_norm, disliked_mean_norm)
+
+def city_payload(state, idx, score):
+    row = state.bundle.city(idx) # Get the corresponding row of that city.
 
     return {
         "city_id": row["city_id"],
         "city_name": row["city_name"],
         "country": row["country"],
-        "score": float(scores[next_idx]) # TASK: Decide if score is needed to be saved in Firebase.
+        "score": float(score) # TASK: Decide if score is needed to be saved in Firebase.
     } # Return the city recommendation in format.
 
+def next_city(state, scores, seen_idx):
+    # Exclude already swiped cities
+    scores[seen_idx] = -1e9  # effectively remove
+
+    next_idx = int(np.argmax(scores)) # The next city is the one with the highest score.
+    return city_payload(state, next_idx, scores[next_idx])
+
+def next_cities(scores, seen_idx, k):
+    # Same scores as next_city, but keep the k best unseen cities in one pass.
+    return top_k(scores, k, seen_idx)
+
+def reload_city_bundle(new_bundle):
+    # Swap in a newly activated artifact bundle with one assignment. Aggregates and cursors
+    # are tagged with their bundle version, so old ones are never used with the new bundle;
+    # they are dropped here to free them.
+    global city_state
+    city_state = CityState(new_bundle)
+    feedback_store.switch(new_bundle.version)
+    cursor_store.clear()
+    leaderboard.set_continents(new_bundle.continent_of())
+
+def check_city_bundle():
+    # Switch to a new bundle (without restarting) once `python artifact_bundle.py activate` ran.
+    new_bundle = city_bundles.check()
+    if new_bundle is not None:
+        reload_city_bundle(new_bundle)
+
+def current_city_state():
+    # The state one request uses from start to end.
+    check_city_bundle()
+    return city_state
+
+def user_query(data, state):
+    user_id = data["user_id"]  # Get the user id given from the data.
+
+    # Same encoding as /recommend
+    origin_enc, fav_enc, multi_hot = encode_user_inputs(data) # First encode the data.
+    user_vec = get_cached_user_embedding(origin_enc, fav_enc, multi_hot) # Then, embedd the encoded vector (cached per profile).
+    # Get the running liked/disliked aggregates of the user (only read from Firebase when not cached),
+    # with the app's recent swipes applied in case /swipe went to another worker.
+    aggregate = feedback_store.get(user_id, state.bundle, data.get("recent_swipes", ()))
+    liked_mean, disliked_mean, liked_mean_norm, disliked_mean_norm, seen_idx = aggregate.snapshot()
+    # Now, change the initial user vector taken from the model to adjust based on the city swipes.
+    user_vec = adjust_user_embedding(user_vec, liked_mean, disliked_mean)
+    return user_vec, liked_mean_norm, disliked_mean_norm, seen_idx
+
+def rank_user(data, state):
+    user_vec, liked_mean_norm, disliked_mean_norm, seen_idx = user_query(data, state)
+    # Gets the new scores based on the liked/disliked cities.
+    scores = get_dynamic_scores(state, user_vec, liked_mean_norm, disliked_mean_norm)
+    return scores, seen_idx
+
+def rank_candidates(data, k, state):
+    # Best k unseen cities as (index, score) pairs, using the IVF index: only the cities in the
+    # probed lists are scanned, and the best candidates get the exact ALPHA/BETA/GAMMA score.
+    user_vec, liked_mean_norm, disliked_mean_norm, seen_idx = user_query(data, state)
+    query = state.engine.query_vector(user_vec, liked_mean_norm, disliked_mean_norm)
+    candidates = state.ann.search(query, k=max(k, state.ann.candidates), exclude=seen_idx)
+    scores = state.engine.scores_at(candidates, user_vec, liked_mean_norm, disliked_mean_norm)
+    return [(int(candidates[i]), float(scores[i])) for i in top_k(scores, k)]
+
+def rank_queue(data, k, state):
+    # Best k unseen cities as (index, score) pairs, from the IVF index if there is one.
+    if state.ann is not None:
+        return rank_candidates(data, k, state)
+    scores, seen_idx = rank_user(data, state)
+    return [(idx, float(scores[idx])) for idx in next_cities(scores, seen_idx, k)]
+
+def next_city_for(data):
+    state = current_city_state()
+    if state.ann is not None:
+        ranked = rank_candidates(data, 1, state)
+        if ranked:
+            return city_payload(state, *ranked[0])
+    # Without an index (or once every candidate was swiped) score every city.
+    scores, seen_idx = rank_user(data, state)
+    return next_city(state, scores, seen_idx)
+
 @app.route("/next_city", methods=["POST"])
 def api_next_city():
     try:
         data = request.get_json() # The data given is the user profile.
-        user_id = data["user_id"]  # Get the user id given from the data.
-
-        # Same encoding as /recommend
-        origin_enc, fav_enc, multi_hot = encode_user_inputs(data) # First encode the data.
-        user_vec = get_user_embedding(origin_enc, fav_enc, multi_hot) # Then, embedd the encoded vector.
-        # Get the dictionaries of the user favorite and disliked cities from Firebase.
-        liked_ids, disliked_ids = get_user_feedback(user_id)
-        # Get the corresponding indices of the favorited and disliked cities.
-        liked_idx = to_indices(liked_ids)
-        disliked_idx = to_indices(disliked_ids)
-        # Now, change the initial user vector taken from the model to adjust based on the city swipes.
-        user_vec = adjust_user_embedding(user_vec, liked_idx, disliked_idx)
-        # After the user vector is adjusted, get the next best city.
-        city = next_city(user_vec, liked_idx, disliked_idx)
+        # After the user vector is adjusted and scored, get the next best city.
+        city = next_city_for(data)
         return jsonify({"city": city}) # Give a JSON as a POST of the next city.
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---------------------------------------------------------
+# Swipes: keep the cached feedback aggregates current
+# ---------------------------------------------------------
+@app.route("/swipe", methods=["POST"])
+def api_swipe():
+    try:
+        data = request.get_json() # user_id, city_id and action (like, dislike, unlike or undislike).
+        # With "write": true the backend also records the swipe in Firestore (write-through),
+        # otherwise the app has already written it and this only updates the cache.
+        if data.get("write"):
+            write_swipe(db, data["user_id"], data["city_id"], data["action"], data.get("city"))
+        feedback_store.record(data["user_id"], data["city_id"], data["action"])
+        return jsonify({"ok": True})
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except upstream.UNAVAILABLE_ERRORS as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---------------------------------------------------------
+# Top-k queue: several cities per request + a cursor to prefetch more
+# ---------------------------------------------------------
+cursor_store = CursorStore()
+
+@app.route("/next_cities", methods=["POST"])
+def api_next_cities():
+    try:
+        data = request.get_json() # The data given is the user profile, plus optional k/cursor/rerank_after.
+        user_id = data["user_id"]
+        k, rerank_after = next_cities_params(data)
+        cursor = data.get("cursor")
+
+        state = current_city_state()
+
+        # Serve from the existing ranking if the cursor is still good (no inference or Firestore reads).
+        # Cursors live in this worker's memory: one made by another worker (or before a restart)
+        # is unknown here, so take() returns None and the request is simply ranked again below.
+        if cursor:
+            if data.get("refresh"):
+                cursor_store.discard(cursor)
+            else:
+                queued = cursor_store.take(cursor, user_id, k, version=state.version)
+                if queued:
+                    cities = [city_payload(state, idx, score) for idx, score in queued]
+                    return jsonify({"cities": cities, "cursor": cursor, "rerank_after": rerank_after})
+
+        # Otherwise rank once, deep enough to serve `rerank_after` cities from this cursor.
+        queue = rank_queue(data, rerank_after, state)
+        cursor = cursor_store.create(user_id, queue, rerank_after, served=min(k, len(queue)), version=state.version)
+
+        cities = [city_payload(state, idx, score) for idx, score in queue[:k]]
+        return jsonify({"cities": cities, "cursor": cursor, "rerank_after": rerank_after})
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---------------------------------------------------------
+# Batched embeddings (nightly refresh / load spikes)
+# ---------------------------------------------------------
+MAX_EMBED_BATCH = 256
+
+def embed_batch_params(data):
+    # profiles and top_k (clamped to 0..MAX_NEXT_CITIES) of an /embed/batch request;
+    # a ValueError (400) if they aren't usable.
+    profiles = data.get("profiles") # List of user profiles (same fields as /next_city).
+    if not isinstance(profiles, list):
+        raise ValueError("profiles must be a list")
+    if len(profiles) > MAX_EMBED_BATCH:
+        raise ValueError(f"At most {MAX_EMBED_BATCH} profiles per batch")
+    try:
+        k = int(data.get("top_k", 0))
+    except (TypeError, ValueError):
+        raise ValueError("top_k must be an integer")
+    return profiles, max(0, min(k, MAX_NEXT_CITIES))
+
+@app.route("/embed/batch", methods=["POST"])
+def api_embed_batch():
+    try:
+        data = request.get_json()
+        profiles, k = embed_batch_params(data)
+        if not profiles:
+            return jsonify({"embeddings": []})
+
+        embeddings = embed_profiles(profiles)
+        response = {"embeddings": embeddings.tolist()}
+
+        # Optionally score every user against every city with one matrix multiply.
+        if k > 0:
+            state = current_city_state()
+            scores = state.engine.base_scores_batch(embeddings) # shape: (num_users, num_cities)
+            response["cities"] = [
+                [city_payload(state, idx, row[idx]) for idx in top_k(row, k)]
+                for row in scores
+            ]
+        return jsonify(response)
+
+    except (KeyError, ValueError) as e:
+        # A profile without a required field, or a bad profiles/top_k
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -233,6 +468,23 @@ def city_image():
 
     return jsonify({"ok": True, "data": img})
 
+# Leaderboard of cities by global Elo, kept in sync with the city catalog below
+leaderboard = Leaderboard(continent_of=city_state.bundle.continent_of())
+rate_cities.city_catalog.add_listener(leaderboard.apply)
+
+# Load every city once for the rating flow and keep it fresh with a snapshot listener,
+# and start flushing buffered global Elo changes in the background.
+rate_cities.city_catalog.start()
+rate_cities.global_elo_buffer.start()
+
+# A rating never falls back to cached data: if Firestore can't be used it fails with 503
+# (and the app can retry), instead of writing back Elos computed from an old ranking.
+def upstream_unavailable(error):
+    return jsonify({"status": "error", "message": f"Service unavailable: {error}"}), 503
+
+for unavailable_error in upstream.UNAVAILABLE_ERRORS:
+    app.register_error_handler(unavailable_error, upstream_unavailable)
+
 @app.post("/rate-city")
 def rate_city():
     data = request.json
@@ -240,7 +492,22 @@ def rate_city():
     response = rate_cities.start_rating(
         user_id = data["user_id"],
         city_id = data["city_id"],
-        feedback = data["feedback"]
+        feedback = data["feedback"],
+        prefetch = data.get("prefetch", False),
+        mode = data.get("mode")
+    )
+
+    return jsonify(response)
+
+@app.post("/rate-cities/bulk")
+def rate_cities_bulk():
+    data = request.json
+
+    # cities: [{"city_id": ..., "feedback": "LIKE" | "NEUTRAL" | "DISLIKE"}, ...]
+    response = rate_cities.start_bulk_rating(
+        user_id = data["user_id"],
+        cities = data.get("cities", []),
+        prefetch = data.get("prefetch", False)
     )
 
     return jsonify(response)
@@ -251,77 +518,128 @@ def compare_cities():
 
     response = rate_cities.submit_comparison(
         user_id = data["user_id"],
-        preferred = data["preferred"]
+        preferred = data["preferred"],
+        prefetch = data.get("prefetch", False)
     )
 
     return jsonify(response)
 
+@app.post("/commit-rating")
+def commit_rating():
+    data = request.json
+
+    # Called by the app when the post is uploaded, with the rating id of the finished
+    # rating; the Elo changes themselves were kept on the server when the rating finished.
+    if not data.get("rating_id") or not data.get("user_id"):
+        return jsonify({"status": "error", "message": "Missing rating_id or user_id"}), 400
+
+    response = rate_cities.commit_rating(
+        rating_id = data["rating_id"],
+        user_id = data["user_id"]
+    )
+
+    status = 400 if response["status"] == "error" else 200
+    return jsonify(response), status
+
+# ---------------------------------------------------------
+# Leaderboard: top cities by global Elo
+# ---------------------------------------------------------
+MAX_LEADERBOARD = 200
+
+@app.get("/leaderboard")
+def get_leaderboard():
+    # Optional filters: country / continent; city_id also returns that city's rank
+    limit = min(max(request.args.get("limit", default=10, type=int), 1), MAX_LEADERBOARD)
+    country = request.args.get("country")
+    continent = request.args.get("continent")
+    city_id = request.args.get("city_id")
+
+    cities, total = leaderboard.top(limit, country=country, continent=continent)
+    response = {"cities": cities, "total": total}
+
+    if city_id:
+        city = leaderboard.rank_of(city_id, country=country, continent=continent)
+        if city is None:
+            return jsonify({"error": "City not found in this leaderboard"}), 404
+        response["city"] = city
+
+    return jsonify(response)
+
 
 # ---------------------------------------------------------
 # Gemini: Generate city activities
 # ---------------------------------------------------------
 @app.route("/api/activities", methods=["POST"])
 def generate_activities():
-    if GEMINI_API_KEY:
-        genai.configure(api_key=GEMINI_API_KEY)
-    else:
-        print("WARNING: GEMINI_API_KEY not set")
+    data = request.get_json()
     try:
-        # if not GEMINI_API_KEY:
-        #     return jsonify({"ok": False, "error": "Missing GEMINI_API_KEY"}), 500
-
-        data = request.get_json()
         city = data["city"]
         country = data["country"]
+    except (KeyError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
 
-        prompt = f"""
-            Return ONLY valid JSON.
-
-            Generate 16 activities for:
-            City: {city}
-            Country: {country}
-
-            Each activity must be assigned EXACTLY one category from this set:
-            ["restaurants", "outdoor", "arts", "entertainment"]
-
-            Rules:
-            - Activity names must be short (2-6 words)
-            - No numbering
-            - No emojis
-            - No duplicates
-            - Output format EXACTLY:
-
-            {{
-                "activities": [
-                    {{ "name": "Activity name", "category": "arts" }}
-                ]
-            }}
-        """
-
-
-        model = genai.GenerativeModel("models/gemini-3-flash-preview")
-
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "temperature": 0.7,
-                "max_output_tokens": 3000,
-                "response_mime_type": "application/json"
-            }
-        )
-        print("REsponse: ", response)
-        data = json.loads(response.text)
-        print("Data", data)
-        activities = data.get("activities", [])
-
-        # Activities = [dicts]
-        activities = activities[:16]
+    try:
+        # Cached per city (see activities_service.py); Gemini is only called on a miss
+        activities = activities_service.get_activities(city, country)
 
         return jsonify({"ok": True, "activities": activities})
     except Exception as e:
         print("Gemini error:", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/activities/stream", methods=["POST"])
+def stream_activities():
+    data = request.get_json()
+    try:
+        city = data["city"]
+        country = data["country"]
+    except (KeyError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    # NDJSON: one {"activity": ...} line per activity as soon as Gemini has written it, then
+    # a last line with the same body /api/activities returns ({"error": ...} if it failed).
+    def lines():
+        try:
+            for event in activities_service.stream_activities(city, country):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print("Gemini error:", e)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    # X-Accel-Buffering stops a proxy in front of gunicorn from holding lines back
+    return Response(lines(), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+# Configure Gemini and build the model once, not per request
+activities_service.configure()
+
+# Optionally keep the image and activity caches warm for every city in the background.
+# Every worker starts the loop, but a pass runs in one worker at a time (see prewarm.py).
+prewarmer = None
+if os.environ.get("PREWARM") == "1":
+    prewarmer = build_prewarmer()
+    prewarmer.start()
+
+# ---------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------
+def metrics_snapshot():
+    return {
+        "interpreterPool": interpreter_pool.stats(),
+        "cityBundle": city_bundles.stats(),
+        "embeddingCache": embedding_cache.stats(),
+        "feedbackCache": feedback_store.stats(),
+        "globalElo": rate_cities.global_elo_buffer.stats(),
+        "rankingCache": rate_cities.ranking_store.stats(),
+        "imageCache": unsplash_service.stats(),
+        "activityCache": activities_service.stats(),
+        "prewarm": prewarmer.status() if prewarmer else None,
+        "upstream": upstream.stats()
+    }
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(metrics_snapshot())
+
 @app.route("/")
 def home():
     return jsonify({"status": "Travel recommender backend running"})
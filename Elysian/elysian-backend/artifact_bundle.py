@@ -0,0 +1,365 @@
+"""
+File: artifact_bundle.py
+Function: Versioned, memory-mapped bundle of the city embeddings and city metadata.
+
+Every worker used to load city_vectors.npy and cities.csv into its own heap (and
+build its own normalized copy and id -> index dict), so memory grew with the
+number of workers. A bundle is a directory of .npy files that workers open with
+np.load(mmap_mode="r"): the pages live in the OS page cache once, and every
+worker on the machine maps the same physical copy.
+
+    artifacts/
+        CURRENT                 <- name of the active version
+        v20260101T120000/
+            manifest.json       <- version, shapes, sha256 of every file
+            vectors.npy         <- (num_cities, dim) float32 embeddings
+            normed.npy          <- row-normalized embeddings (see scoring.py)
+            cities.npy          <- structured array: city_id, city_name, country, continent
+            index_keys.npy      <- city ids, sorted
+            index_values.npy    <- row of each sorted id (city_id -> index)
+            ann/                <- optional IVF index for large catalogs (see ann_index.py)
+
+A version directory is written under a temporary name and renamed into place
+when complete, and activating a version replaces CURRENT with os.replace, so
+readers only ever see a whole bundle. Workers check CURRENT every
+BUNDLE_CHECK_INTERVAL seconds and switch to a new version without a restart
+(see BundleWatcher). Without an artifacts directory the legacy
+city_vectors.npy and cities.csv are loaded as before.
+
+Build and activate a bundle from the legacy files:
+    python artifact_bundle.py build --activate
+    python artifact_bundle.py list
+    python artifact_bundle.py activate <version>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Mapping
+import numpy as np
+from ann_index import ANN_INDEX_PATH, IVFIndex, load_index
+from scoring import ann_vectors
+
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "artifacts")
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+BUNDLE_CHECK_INTERVAL = 30   # Seconds between checks for a new active version
+
+LEGACY_VECTORS_PATH = "city_vectors.npy"
+CITIES_PATH = "../../Datasets/cities.csv"
+ANN_DIR = "ann"
+
+META_FIELDS = ("city_id", "city_name", "country", "continent")
+ARRAYS = ("vectors", "normed", "cities", "index_keys", "index_values")
+
+
+def normalize_rows(vectors):
+    # Same normalization as ScoringEngine: zero rows stay zero so their cosine is 0.
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def city_table(cities_df):
+    '''
+    Function that packs the city metadata columns into a fixed-width structured
+    array (no Python objects, so it can be memory-mapped).
+    '''
+    columns = [cities_df[field].astype(str).to_numpy() for field in META_FIELDS]
+    dtype = [(field, f"U{max(1, max((len(v) for v in column), default=1))}")
+             for field, column in zip(META_FIELDS, columns)]
+    table = np.empty(len(cities_df), dtype=dtype)
+    for field, column in zip(META_FIELDS, columns):
+        table[field] = column
+    return table
+
+
+class CityIndex(Mapping):
+    '''
+    Class for a read-only city_id -> row mapping over two (memory-mapped) arrays:
+    the sorted ids and the row of each. Lookups are a binary search.
+    '''
+
+    def __init__(self, ids, rows):
+        self.ids = ids
+        self.rows = rows
+
+    def _find(self, city_id):
+        i = int(np.searchsorted(self.ids, city_id))
+        return i if i < len(self.ids) and self.ids[i] == city_id else None
+
+    def __getitem__(self, city_id):
+        i = self._find(city_id)
+        if i is None:
+            raise KeyError(city_id)
+        return int(self.rows[i])
+
+    def __contains__(self, city_id):
+        return self._find(city_id) is not None
+
+    def __iter__(self):
+        return (str(city_id) for city_id in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class ArtifactBundle:
+    '''
+    Class for one version of the city artifacts (arrays may be memory-mapped).
+    '''
+
+    def __init__(self, version, vectors, normed, cities, index_keys, index_values, path=None, manifest=None, ann=None):
+        self.version = version
+        self.path = path
+        self.manifest = manifest or {}
+        self.vectors = vectors
+        self.normed = normed
+        self.cities = cities
+        self.index = CityIndex(index_keys, index_values)
+        self.ann = ann   # IVFIndex over ann_vectors(vectors, normed), or None
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Function that maps a bundle directory read-only; nothing is copied into the heap.
+        '''
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+        ann = load_index(os.path.join(path, ANN_DIR))
+        return cls(manifest["version"], path=path, manifest=manifest, ann=ann, **arrays)
+
+    @classmethod
+    def from_frames(cls, vectors, cities_df, version="legacy"):
+        '''
+        Function that builds an in-memory bundle from the embeddings and the cities table.
+        '''
+        if len(vectors) != len(cities_df):
+            raise ValueError(f"{len(vectors)} vectors for {len(cities_df)} cities")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        cities = city_table(cities_df)
+        order = np.argsort(cities["city_id"], kind="stable")
+        return cls(
+            version,
+            vectors=vectors,
+            normed=normalize_rows(vectors),
+            cities=cities,
+            index_keys=cities["city_id"][order],
+            index_values=order.astype(np.int32)
+        )
+
+    @classmethod
+    def from_legacy(cls, vectors_path=LEGACY_VECTORS_PATH, cities_path=CITIES_PATH, ann_path=ANN_INDEX_PATH):
+        import pandas as pd
+        bundle = cls.from_frames(np.load(vectors_path), pd.read_csv(cities_path))
+        ann = load_index(ann_path)
+        if ann is not None and len(ann) != len(bundle):
+            print(f"Ignoring {ann_path}: built for {len(ann)} cities, not {len(bundle)}")
+            ann = None
+        bundle.ann = ann
+        return bundle
+
+    def build_ann(self, nlist=None):
+        '''
+        Function that builds the IVF index of this bundle's cities.
+        '''
+        self.ann = IVFIndex.build(ann_vectors(self.vectors, self.normed), nlist=nlist)
+        return self.ann
+
+    def city(self, idx):
+        '''
+        Function that returns the metadata of the city in row idx as a dict of str.
+        '''
+        row = self.cities[idx]
+        return {field: str(row[field]) for field in META_FIELDS}
+
+    def continent_of(self):
+        return dict(zip(self.cities["city_id"].tolist(), self.cities["continent"].tolist()))
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_bundle(bundle, root=ARTIFACT_DIR, version=None):
+    '''
+    Function that writes a bundle as a new version directory and returns its version.
+    The files are written to a temporary directory that is renamed into place at the end.
+    '''
+    version = version or time.strftime("v%Y%m%dT%H%M%S")
+    final = os.path.join(root, version)
+    if os.path.exists(final):
+        raise FileExistsError(f"Version {version} already exists")
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f".{version}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    arrays = {
+        "vectors": bundle.vectors,
+        "normed": bundle.normed,
+        "cities": bundle.cities,
+        "index_keys": bundle.index.ids,
+        "index_values": bundle.index.rows
+    }
+    files = {}
+    for name, array in arrays.items():
+        path = os.path.join(tmp, f"{name}.npy")
+        np.save(path, np.ascontiguousarray(array))
+        files[f"{name}.npy"] = _sha256(path)
+    if bundle.ann is not None:
+        for name in bundle.ann.save(os.path.join(tmp, ANN_DIR)):
+            files[f"{ANN_DIR}/{name}"] = _sha256(os.path.join(tmp, ANN_DIR, name))
+
+    manifest = {
+        "version": version,
+        "createdAt": time.time(),
+        "numCities": len(bundle.vectors),
+        "dim": int(bundle.vectors.shape[1]),
+        "annLists": bundle.ann.nlist if bundle.ann is not None else None,
+        "files": files
+    }
+    with open(os.path.join(tmp, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp, final)
+    return version
+
+
+def verify_bundle(path):
+    '''
+    Function that checks every file of a bundle against the sha256 in its manifest.
+    '''
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    for name, digest in manifest["files"].items():
+        if _sha256(os.path.join(path, name)) != digest:
+            raise ValueError(f"{name} in {path} does not match its manifest")
+    return manifest
+
+
+def activate(version, root=ARTIFACT_DIR):
+    '''
+    Function that makes a version the active one by atomically replacing CURRENT.
+    '''
+    verify_bundle(os.path.join(root, version))
+    tmp = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def current_version(root=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_current(root=ARTIFACT_DIR):
+    '''
+    Function that opens the active bundle, or loads the legacy files if there is none.
+    '''
+    version = current_version(root)
+    if version is None:
+        return ArtifactBundle.from_legacy()
+    return ArtifactBundle.open(os.path.join(root, version))
+
+
+class BundleWatcher:
+    '''
+    Class that holds the active bundle and switches to a newly activated version.
+    check() looks at CURRENT at most every `check_interval` seconds and returns
+    the new bundle when the version changed (None otherwise).
+    '''
+
+    def __init__(self, root=ARTIFACT_DIR, check_interval=BUNDLE_CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self.bundle = open_current(root)
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.swaps = 0
+
+    def check(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return None
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return None
+            self._checked_at = now
+            version = current_version(self.root)
+            if version is None or version == self.bundle.version:
+                return None
+            try:
+                bundle = ArtifactBundle.open(os.path.join(self.root, version))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not open artifact bundle {version}: {e}")
+                return None
+            self.bundle = bundle
+            self.swaps += 1
+            return bundle
+
+    def stats(self):
+        return {
+            "version": self.bundle.version,
+            "numCities": len(self.bundle),
+            "swaps": self.swaps,
+            "ann": self.bundle.ann.stats() if self.bundle.ann is not None else None
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=ARTIFACT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build a new version from the embeddings and cities.csv")
+    build.add_argument("--vectors", default=LEGACY_VECTORS_PATH)
+    build.add_argument("--cities", default=CITIES_PATH)
+    build.add_argument("--version")
+    build.add_argument("--activate", action="store_true", help="Make the new version the active one")
+    build.add_argument("--ann", action="store_true", help="Also build the IVF index (see ann_index.py)")
+    build.add_argument("--nlist", type=int, help="Number of IVF lists (default: about 4 * sqrt(num cities))")
+
+    commands.add_parser("list", help="List versions")
+    activate_cmd = commands.add_parser("activate", help="Make a version the active one")
+    activate_cmd.add_argument("version")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        bundle = ArtifactBundle.from_legacy(args.vectors, args.cities)
+        if args.ann:
+            bundle.build_ann(args.nlist)
+        version = write_bundle(bundle, args.root, args.version)
+        print(f"Built {version} ({len(bundle)} cities)")
+        if args.activate:
+            activate(version, args.root)
+            print(f"Activated {version}")
+    elif args.command == "list":
+        active = current_version(args.root)
+        if os.path.isdir(args.root):
+            for name in sorted(os.listdir(args.root)):
+                if os.path.isfile(os.path.join(args.root, name, MANIFEST_FILE)):
+                    print(("* " if name == active else "  ") + name)
+    else:
+        activate(args.version, args.root)
+        print(f"Activated {args.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+File: asgi_app.py
+Function: Runs the backend as an asyncio (ASGI) app with the same routes as app.py.
+
+A Flask worker thread is blocked for the whole upstream call (Unsplash, Gemini,
+Firestore). Here those calls are awaited instead: Unsplash goes over one pooled
+httpx.AsyncClient, Gemini over generate_content_async and Firestore reads over
+the async client, with independent reads (favorites and dislikes) in parallel.
+CPU work (TFLite inference, scoring, the rating flow) runs in a bounded thread
+pool of ASGI_CPU_WORKERS, so one process can hold thousands of in-flight
+upstream calls without oversubscribing the CPU.
+
+Models, caches and stores are the ones app.py loads, so both modes share their
+code and return the same JSON.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5003
+or  python asgi_app.py
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import app as flask_app
+import activities_service
+import rate_cities
+import unsplash_service
+import upstream
+from firebase_config import async_db
+from feedback_store import fetch_user_feedback_async, write_swipe_async
+
+ASGI_CPU_WORKERS = int(os.environ.get("ASGI_CPU_WORKERS", str(os.cpu_count() or 4)))
+# Keep-alive connections to Unsplash shared by every request in the process
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+
+# Created when the server starts (see lifespan)
+cpu_executor = None
+http_client = None
+
+
+async def run_cpu(fn, *args):
+    # Inference and scoring go to the bounded pool so the event loop keeps serving I/O.
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
+
+
+def load_feedback(user_id):
+    return upstream.firestore.call_async(
+        fetch_user_feedback_async, async_db, user_id, timeout=upstream.FEEDBACK_READ_TIMEOUT
+    )
+
+
+# ---------------------------------------------------------
+# Recommendations
+# ---------------------------------------------------------
+async def api_next_city(request):
+    try:
+        data = await request.json() # The data given is the user profile.
+        # Read the user's favorites and dislikes without blocking (cached after the first read),
+        # then embed and score in the CPU pool.
+        await flask_app.feedback_store.get_async(data["user_id"], load_feedback, flask_app.current_city_state().bundle)
+        city = await run_cpu(flask_app.next_city_for, data)
+        return JSONResponse({"city": city})
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def api_swipe(request):
+    try:
+        data = await request.json() # user_id, city_id and action (like, dislike, unlike or undislike).
+        if data.get("write"):
+            await write_swipe_async(async_db, data["user_id"], data["city_id"], data["action"], data.get("city"))
+        flask_app.feedback_store.record(data["user_id"], data["city_id"], data["action"])
+        return JSONResponse({"ok": True})
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except upstream.UNAVAILABLE_ERRORS as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+def rank_next_cities(data, k, rerank_after, state):
+    user_id = data["user_id"]
+    queue = flask_app.rank_queue(data, rerank_after, state)
+    cursor = flask_app.cursor_store.create(user_id, queue, rerank_after, served=min(k, len(queue)), version=state.version)
+    cities = [flask_app.city_payload(state, idx, score) for idx, score in queue[:k]]
+    return {"cities": cities, "cursor": cursor, "rerank_after": rerank_after}
+
+async def api_next_cities(request):
+    try:
+        data = await request.json() # The data given is the user profile, plus optional k/cursor/rerank_after.
+        user_id = data["user_id"]
+        k, rerank_after = flask_app.next_cities_params(data)
+        cursor = data.get("cursor")
+
+        state = flask_app.current_city_state()
+
+        # Serving from an existing cursor is a few dict lookups, so it stays on the event loop.
+        if cursor:
+            if data.get("refresh"):
+                flask_app.cursor_store.discard(cursor)
+            else:
+                queued = flask_app.cursor_store.take(cursor, user_id, k, version=state.version)
+                if queued:
+                    cities = [flask_app.city_payload(state, idx, score) for idx, score in queued]
+                    return JSONResponse({"cities": cities, "cursor": cursor, "rerank_after": rerank_after})
+
+        await flask_app.feedback_store.get_async(user_id, load_feedback, state.bundle)
+        return JSONResponse(await run_cpu(rank_next_cities, data, k, rerank_after, state))
+
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+def embed_batch(profiles, k):
+    embeddings = flask_app.embed_profiles(profiles)
+    response = {"embeddings": embeddings.tolist()}
+
+    if k > 0:
+        state = flask_app.current_city_state()
+        scores = state.engine.base_scores_batch(embeddings) # shape: (num_users, num_cities)
+        response["cities"] = [
+            [flask_app.city_payload(state, idx, row[idx]) for idx in flask_app.top_k(row, k)]
+            for row in scores
+        ]
+    return response
+
+async def api_embed_batch(request):
+    try:
+        data = await request.json()
+        profiles, k = flask_app.embed_batch_params(data)
+        if not profiles:
+            return JSONResponse({"embeddings": []})
+
+        return JSONResponse(await run_cpu(embed_batch, profiles, k))
+
+    except (KeyError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+# ---------------------------------------------------------
+# Gateway endpoint: city content (image/description)
+# ---------------------------------------------------------
+async def city_image(request):
+    city = (request.query_params.get("city") or "").strip()
+    country = (request.query_params.get("country") or "").strip()
+
+    if not city:
+        return JSONResponse({"ok": False, "message": "Missing required param: city"}, status_code=400)
+
+    query = f"{city} {country}".strip()
+    img = await unsplash_service.fetch_city_image_async(query, http_client)
+
+    if not img:
+        return JSONResponse({"ok": False, "message": "No image found (or missing UNSPLASH_ACCESS_KEY)"}, status_code=404)
+
+    return JSONResponse({"ok": True, "data": img})
+
+# ---------------------------------------------------------
+# Rating flow
+# ---------------------------------------------------------
+async def rate_city(request):
+    data = await request.json()
+
+    # Read the user's ranking without blocking; the rest of start_rating is in-memory work.
+    ranking = await rate_cities.ranking_store.get_async(data["user_id"], async_db, fresh=True)
+    response = await run_cpu(
+        lambda: rate_cities.start_rating(
+            user_id = data["user_id"],
+            city_id = data["city_id"],
+            feedback = data["feedback"],
+            prefetch = data.get("prefetch", False),
+            mode = data.get("mode"),
+            ranking = ranking
+        )
+    )
+
+    return JSONResponse(response)
+
+async def rate_cities_bulk(request):
+    data = await request.json()
+
+    ranking = await rate_cities.ranking_store.get_async(data["user_id"], async_db, fresh=True)
+    response = await run_cpu(
+        lambda: rate_cities.start_bulk_rating(
+            user_id = data["user_id"],
+            cities = data.get("cities", []),
+            prefetch = data.get("prefetch", False),
+            ranking = ranking
+        )
+    )
+
+    return JSONResponse(response)
+
+async def compare_cities(request):
+    data = await request.json()
+
+    response = await run_cpu(
+        lambda: rate_cities.submit_comparison(
+            user_id = data["user_id"],
+            preferred = data["preferred"],
+            prefetch = data.get("prefetch", False)
+        )
+    )
+
+    return JSONResponse(response)
+
+async def commit_rating(request):
+    data = await request.json()
+    if not data.get("rating_id") or not data.get("user_id"):
+        return JSONResponse({"status": "error", "message": "Missing rating_id or user_id"}, status_code=400)
+
+    await rate_cities.ranking_store.get_async(data["user_id"], async_db)
+    # Saving rankedCities is a Firestore write, so this uses the I/O thread pool, not the CPU pool.
+    response = await run_in_threadpool(
+        rate_cities.commit_rating,
+        rating_id = data["rating_id"],
+        user_id = data["user_id"]
+    )
+
+    status = 400 if response["status"] == "error" else 200
+    return JSONResponse(response, status_code=status)
+
+# ---------------------------------------------------------
+# Leaderboard: top cities by global Elo
+# ---------------------------------------------------------
+async def get_leaderboard(request):
+    params = request.query_params
+    try:
+        limit = int(params.get("limit", 10))
+    except ValueError:
+        limit = 10
+    limit = min(max(limit, 1), flask_app.MAX_LEADERBOARD)
+    country = params.get("country")
+    continent = params.get("continent")
+    city_id = params.get("city_id")
+
+    leaderboard = flask_app.leaderboard
+    cities, total = leaderboard.top(limit, country=country, continent=continent)
+    response = {"cities": cities, "total": total}
+
+    if city_id:
+        city = leaderboard.rank_of(city_id, country=country, continent=continent)
+        if city is None:
+            return JSONResponse({"error": "City not found in this leaderboard"}, status_code=404)
+        response["city"] = city
+
+    return JSONResponse(response)
+
+# ---------------------------------------------------------
+# Gemini: Generate city activities
+# ---------------------------------------------------------
+async def generate_activities(request):
+    data = await request.json()
+    try:
+        city = data["city"]
+        country = data["country"]
+    except (KeyError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        activities = await activities_service.get_activities_async(city, country)
+
+        return JSONResponse({"ok": True, "activities": activities})
+    except Exception as e:
+        print("Gemini error:", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def stream_activities(request):
+    data = await request.json()
+    try:
+        city = data["city"]
+        country = data["country"]
+    except (KeyError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Same NDJSON lines as app.py's /api/activities/stream
+    async def lines():
+        try:
+            async for event in activities_service.stream_activities_async(city, country):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print("Gemini error:", e)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+# ---------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------
+async def metrics(request):
+    snapshot = flask_app.metrics_snapshot()
+    snapshot["cpuExecutor"] = {"workers": ASGI_CPU_WORKERS, "queued": cpu_executor._work_queue.qsize()}
+    return JSONResponse(snapshot)
+
+async def home(request):
+    return JSONResponse({"status": "Travel recommender backend running"})
+
+async def upstream_unavailable(request, error):
+    # Same as app.py: the rating routes fail with 503 instead of using stale data
+    return JSONResponse({"status": "error", "message": f"Service unavailable: {error}"}, status_code=503)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global cpu_executor, http_client
+    cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix="cpu")
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS)
+    )
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        cpu_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route("/next_city", api_next_city, methods=["POST"]),
+        Route("/swipe", api_swipe, methods=["POST"]),
+        Route("/next_cities", api_next_cities, methods=["POST"]),
+        Route("/embed/batch", api_embed_batch, methods=["POST"]),
+        Route("/api/city-image", city_image, methods=["GET"]),
+        Route("/rate-city", rate_city, methods=["POST"]),
+        Route("/rate-cities/bulk", rate_cities_bulk, methods=["POST"]),
+        Route("/compare-cities", compare_cities, methods=["POST"]),
+        Route("/commit-rating", commit_rating, methods=["POST"]),
+        Route("/leaderboard", get_leaderboard, methods=["GET"]),
+        Route("/api/activities", generate_activities, methods=["POST"]),
+        Route("/api/activities/stream", stream_activities, methods=["POST"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/", home, methods=["GET"]),
+    ],
+    exception_handlers={error: upstream_unavailable for error in upstream.UNAVAILABLE_ERRORS},
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5003)
@@ -0,0 +1,105 @@
+"""
+File: bench_ann.py
+Function: Benchmarks the IVF candidate index against brute-force scoring.
+
+The catalog only has 196 cities, so larger catalogs are simulated: every row is
+a random city vector plus noise (neighborhoods and points of interest sit close
+to their city). For random users with random liked/disliked cities, the script
+compares the top k of the full ScoringEngine scores with ANN candidates +
+exact re-scoring (as /next_city does), and reports recall@k and latency for
+a range of nprobe values.
+
+Usage:
+    python bench_ann.py [--sizes 196 20000 100000] [--k 10] [--candidates 100]
+"""
+
+import argparse
+import time
+import numpy as np
+from ann_index import IVFIndex
+from scoring import ScoringEngine, ann_vectors, top_k
+
+ALPHA = 1.0
+BETA = 0.7
+GAMMA = 0.7
+
+NPROBES = [1, 2, 4, 8, 16, 32]
+QUERIES = 200
+NOISE = 0.3   # Noise around the parent city, relative to the per-dimension std
+
+
+def synthetic_catalog(city_vectors, size, rng):
+    '''
+    Function that returns `size` rows around the real city vectors (the real ones first).
+    '''
+    if size <= len(city_vectors):
+        return city_vectors[:size].copy()
+    parents = rng.integers(0, len(city_vectors), size - len(city_vectors))
+    noise = rng.normal(scale=NOISE * city_vectors.std(axis=0), size=(len(parents), city_vectors.shape[1]))
+    return np.vstack([city_vectors, city_vectors[parents] + noise]).astype(np.float32)
+
+
+def random_queries(engine, rng):
+    '''
+    Function that returns (user_vec, liked_mean, disliked_mean, seen_idx) for random users.
+    '''
+    num_rows, dim = engine.city_vectors.shape
+    queries = []
+    for _ in range(QUERIES):
+        # A user looks like some city, with a few swipes
+        user_vec = engine.city_vectors[rng.integers(num_rows)] + rng.normal(scale=0.5, size=dim).astype(np.float32)
+        swiped = rng.choice(num_rows, size=min(num_rows, int(rng.integers(0, 20))), replace=False).tolist()
+        liked_idx, disliked_idx = swiped[::2], swiped[1::2]
+        queries.append((user_vec, engine.group_mean(liked_idx), engine.group_mean(disliked_idx), swiped))
+    return queries
+
+
+def ann_top_k(engine, index, query, k, nprobe, candidates):
+    # Same steps as app.rank_candidates
+    user_vec, liked_mean, disliked_mean, seen_idx = query
+    rows = index.search(engine.query_vector(user_vec, liked_mean, disliked_mean),
+                        k=max(k, candidates), nprobe=nprobe, exclude=seen_idx)
+    scores = engine.scores_at(rows, user_vec, liked_mean, disliked_mean)
+    return [int(rows[i]) for i in top_k(scores, k)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[196, 20000, 100000])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=100)
+    args = parser.parse_args()
+
+    city_vectors = np.load("city_vectors.npy").astype(np.float32)
+    rng = np.random.default_rng(42)
+
+    for size in args.sizes:
+        vectors = synthetic_catalog(city_vectors, size, rng)
+        engine = ScoringEngine(vectors, alpha=ALPHA, beta=BETA, gamma=GAMMA)
+        start = time.perf_counter()
+        index = IVFIndex.build(ann_vectors(vectors, engine.normed))
+        build_s = time.perf_counter() - start
+        queries = random_queries(engine, rng)
+
+        # Brute force: score every row, then top k
+        start = time.perf_counter()
+        exact = [top_k(engine.scores_from_means(q[0], q[1], q[2]), args.k, q[3]) for q in queries]
+        brute_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+        print(f"\n{size} rows, {index.nlist} lists (built in {build_s:.1f}s), brute force {brute_ms:.3f} ms/query")
+        print(f"{'nprobe':>8} {'scanned':>9} {'recall@' + str(args.k):>10} {'ms/query':>9} {'speedup':>8}")
+        for nprobe in NPROBES:
+            if nprobe > index.nlist:
+                break
+            start = time.perf_counter()
+            found = [ann_top_k(engine, index, q, args.k, nprobe, args.candidates) for q in queries]
+            ann_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+            recall = np.mean([len(set(a) & set(e)) / max(1, len(e)) for a, e in zip(found, exact)])
+            sizes = np.diff(index.offsets)
+            scanned = np.mean([sizes[index.probe(engine.query_vector(q[0], q[1], q[2]), nprobe)].sum() for q in queries])
+            print(f"{nprobe:>8} {scanned / size:>8.1%} {recall:>10.3f} {ann_ms:>9.3f} {brute_ms / ann_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+File: bench_scoring.py
+Function: Benchmarks the vectorized scoring engine against the old per-city loop.
+
+For a growing number of liked/disliked swipes, this script times the original
+get_dynamic_scores loop (one cosine call per city per swipe) and the
+ScoringEngine, and checks that both give the same scores (tests/test_scoring.py
+checks the same on a small fixture).
+
+Usage:
+    python bench_scoring.py
+"""
+
+import time
+import numpy as np
+from numpy.linalg import norm
+from scoring import ScoringEngine
+
+ALPHA = 1.0
+BETA = 0.7
+GAMMA = 0.7
+
+SWIPE_COUNTS = [0, 10, 50, 100, 196]
+REPEATS = 5
+
+
+# ---------------------------------------------------------
+# Original per-city loop (kept here as the reference)
+# ---------------------------------------------------------
+def cosine(a, b):
+    return np.dot(a, b) / (norm(a) * norm(b) + 1e-8)
+
+
+def similarity_to_group(city_vectors, city_vec, group_idx):
+    if not group_idx:
+        return 0.0
+    sims = [cosine(city_vec, city_vectors[i]) for i in group_idx]
+    return float(np.mean(sims))
+
+
+def loop_scores(city_vectors, user_vec, liked_idx, disliked_idx):
+    base_scores = city_vectors @ user_vec
+    final_scores = []
+    for i, city_vec in enumerate(city_vectors):
+        sim_liked = similarity_to_group(city_vectors, city_vec, liked_idx)
+        sim_disliked = similarity_to_group(city_vectors, city_vec, disliked_idx)
+        final_scores.append(ALPHA * base_scores[i] + BETA * sim_liked - GAMMA * sim_disliked)
+    return np.array(final_scores)
+
+
+def time_call(fn):
+    '''
+    Function that returns the best wall time in milliseconds over REPEATS runs.
+    '''
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    city_vectors = np.load("city_vectors.npy")
+    engine = ScoringEngine(city_vectors, alpha=ALPHA, beta=BETA, gamma=GAMMA)
+    rng = np.random.default_rng(42)
+    user_vec = rng.normal(size=city_vectors.shape[1]).astype(np.float32)
+
+    print(f"{'swipes':>8} {'loop ms':>10} {'engine ms':>10} {'speedup':>9} {'max diff':>10}")
+    for swipes in SWIPE_COUNTS:
+        # Split the swipes roughly evenly between likes and dislikes.
+        swiped = rng.choice(len(city_vectors), size=min(swipes, len(city_vectors)), replace=False).tolist()
+        liked_idx = swiped[::2]
+        disliked_idx = swiped[1::2]
+
+        expected = loop_scores(city_vectors, user_vec, liked_idx, disliked_idx)
+        actual = engine.scores(user_vec, liked_idx, disliked_idx)
+        max_diff = float(np.max(np.abs(expected - actual)))
+
+        loop_ms = time_call(lambda: loop_scores(city_vectors, user_vec, liked_idx, disliked_idx))
+        engine_ms = time_call(lambda: engine.scores(user_vec, liked_idx, disliked_idx))
+
+        print(f"{swipes:>8} {loop_ms:>10.2f} {engine_ms:>10.3f} {loop_ms / engine_ms:>8.0f}x {max_diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+File: bulk_rating.py
+Function: Places many new cities into a user's ranking with as few comparisons as possible.
+
+Rating 20-50 imported trips one session at a time means k separate sessions. Instead,
+the new cities are placed in one session:
+1. Split by feedback (LIKE above NEUTRAL above DISLIKE, like the single-city
+   flow assumes) and each group is sorted with Ford-Johnson merge insertion,
+   which needs close to the minimum number of comparisons for sorting.
+2. Merged into the existing ranking by placing the middle new city first, then
+   each half only between the slots already found (and within its feedback
+   bound), so the search ranges keep shrinking.
+
+Placing k unordered cities among n needs at least log2((n + k)! / n!)
+comparisons (about k * log2(n) when k is much smaller than n), and this stays
+within a few percent of that bound (tests/test_bulk_rating.py). One binary search
+session per city asks about as many, so a bulk rating does not ask fewer
+questions. What it saves is k sessions, and the Elo updates come back in one result.
+
+The feedback groups are a hard constraint, as in the single-city flow: a new
+LIKE city always ends above a new NEUTRAL one, whatever the user answers, since
+the two are never compared. The user's answers order cities within a group and
+place each one among the existing cities inside its feedback bound.
+
+Comparisons need the user, so the algorithm is replayed from the answers given so
+far: an answered pair is looked up, and the first unanswered pair raises
+NeedComparison with the pair to ask. Replaying is deterministic, so the session
+only has to store the list of answers.
+"""
+
+
+class NeedComparison(Exception):
+    '''
+    Raised when the algorithm needs an answer the user has not given yet.
+    '''
+
+    def __init__(self, first, second):
+        super().__init__(f"Need comparison between {first} and {second}")
+        self.first = first
+        self.second = second
+
+
+class ReplayComparator:
+    '''
+    Class that answers "is a better than b?" from recorded answers.
+    `answers` is a list of [first, second, winner].
+    '''
+
+    def __init__(self, answers):
+        self._winners = {}
+        for first, second, winner in answers:
+            self._winners[(first, second)] = winner
+            self._winners[(second, first)] = winner
+
+    def better(self, a, b):
+        winner = self._winners.get((a, b))
+        if winner is None:
+            raise NeedComparison(a, b)
+        return winner == a
+
+
+def _jacobsthal_order(count):
+    '''
+    Function that returns the order (1-based indices 2..count) in which Ford-Johnson
+    inserts the pending elements: groups ending at Jacobsthal numbers 3, 5, 11, 21, ...
+    each inserted from its highest index down.
+    '''
+    order = []
+    previous, current = 1, 3
+    while previous < count:
+        top = min(current, count)
+        order.extend(range(top, previous, -1))
+        previous, current = current, current + 2 * previous
+    return order
+
+
+def _binary_insert(chain, item, hi, better):
+    # Insert into chain[0:hi] (best first): find the first element `item` beats.
+    lo = 0
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if better(item, chain[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    chain.insert(lo, item)
+
+
+def merge_insertion_sort(items, better):
+    '''
+    Function that sorts items best-first with Ford-Johnson merge insertion.
+    `better(a, b)` returns True if a ranks above b.
+    '''
+    if len(items) <= 1:
+        return list(items)
+
+    # 1. Compare in pairs: winner -> loser
+    loser_of = {}
+    for i in range(0, len(items) - 1, 2):
+        a, b = items[i], items[i + 1]
+        if better(a, b):
+            loser_of[a] = b
+        else:
+            loser_of[b] = a
+    straggler = items[-1] if len(items) % 2 else None
+
+    # 2. Sort the winners recursively (best first)
+    winners = merge_insertion_sort(list(loser_of), better)
+
+    # 3. The loser of the worst winner goes right below it without a comparison.
+    #    pend[i] is the loser of the i-th worst winner (1-based), the straggler goes last.
+    chain = list(winners)
+    pend = [loser_of[w] for w in reversed(winners)]
+    chain.append(pend[0])
+    bound_of = {loser_of[w]: w for w in winners}
+    if straggler is not None:
+        pend.append(straggler)
+
+    # 4. Insert the rest in Jacobsthal order; each loser only searches below its winner.
+    for index in _jacobsthal_order(len(pend)):
+        item = pend[index - 1]
+        winner = bound_of.get(item)
+        # Everything above the winner is known to be better, so search from the winner down.
+        start = chain.index(winner) + 1 if winner is not None else 0
+        tail = chain[start:]
+        _binary_insert(tail, item, len(tail), better)
+        chain[start:] = tail
+    return chain
+
+
+def feedback_bounds(feedback, n):
+    '''
+    Function that returns the allowed slots [lo, hi] in a ranking of n cities for a feedback,
+    matching the search bounds of the single-city flow.
+    '''
+    if feedback == "LIKE":
+        return 0, n // 2 + 1
+    if feedback == "DISLIKE":
+        return n // 2, n
+    return 0, n
+
+
+FEEDBACK_ORDER = ["LIKE", "NEUTRAL", "DISLIKE"]
+
+
+def plan_bulk_placement(ranked, new_cities, answers):
+    '''
+    Function that replays the bulk placement with the answers so far.
+    `ranked` is the existing ranking (best first), `new_cities` is a list of
+    [city_id, feedback]. Returns the merged ranking (best first), or raises
+    NeedComparison with the next pair to ask.
+    '''
+    better = ReplayComparator(answers).better
+
+    # 1. Sort each feedback group among themselves
+    groups = {feedback: [] for feedback in FEEDBACK_ORDER}
+    for city_id, feedback in new_cities:
+        groups[feedback if feedback in groups else "NEUTRAL"].append(city_id)
+
+    ordered_new = []
+    for feedback in FEEDBACK_ORDER:
+        for city_id in merge_insertion_sort(groups[feedback], better):
+            ordered_new.append((city_id, feedback))
+
+    # 2. Merge into the existing ranking. The middle new city is placed first, which
+    #    bounds the slots of the better half from below and the worse half from above.
+    n = len(ranked)
+    slots = [0] * len(ordered_new)
+
+    def place(first, last, lo, hi):
+        if first > last:
+            return
+        middle = (first + last) // 2
+        city_id, feedback = ordered_new[middle]
+        feedback_lo, feedback_hi = feedback_bounds(feedback, n)
+        left = min(max(lo, feedback_lo), hi)
+        right = max(min(hi, feedback_hi), left)
+        while left < right:
+            mid = (left + right) // 2
+            if better(city_id, ranked[mid]):
+                right = mid
+            else:
+                left = mid + 1
+        slots[middle] = left
+        place(first, middle - 1, lo, left)
+        place(middle + 1, last, left, hi)
+
+    place(0, len(ordered_new) - 1, 0, n)
+
+    merged = []
+    position = 0
+    for (city_id, _), slot in zip(ordered_new, slots):
+        merged.extend(ranked[position:slot])
+        merged.append(city_id)
+        position = slot
+    merged.extend(ranked[position:])
+    return merged
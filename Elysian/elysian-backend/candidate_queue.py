@@ -0,0 +1,132 @@
+"""
+File: candidate_queue.py
+Function: Keeps short-lived server-side cursors over ranked city queues.
+
+/next_cities ranks the top cities for a user once and hands the client a cursor.
+The client can then prefetch more cities from the same ranking without paying for
+encoding, inference, Firestore reads and scoring again. A cursor is dropped (so
+the next call re-ranks) once it has served `rerank_after` cities, when the queue
+runs out, or when it has not been used for CURSOR_TTL seconds. Queue entries are
+indices into one artifact bundle, so a cursor also stops once another bundle
+version is active.
+
+Cursors are kept in the memory of the worker that ranked the queue; they are not
+shared between gunicorn workers or kept across restarts. A cursor that lands on a
+worker that doesn't know it is treated like an expired one: take() returns None
+and /next_cities ranks again, so the client still gets cities (just not the cheap
+way). Run one worker (or pin clients to a worker) to get the full benefit.
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# How long an unused cursor stays valid (seconds)
+CURSOR_TTL = 120
+
+# Default number of cities served from one ranking before re-ranking
+RERANK_AFTER = int(os.environ.get("NEXT_CITIES_RERANK_AFTER", "10"))
+
+# Most cities one /next_cities request can ask for
+MAX_NEXT_CITIES = 50
+
+
+def next_cities_params(data):
+    '''
+    Function that reads k and rerank_after from a /next_cities request, clamped to
+    1..MAX_NEXT_CITIES and at least k. Raises ValueError (400) if they aren't integers.
+    '''
+    try:
+        k = int(data.get("k", 10))
+        rerank_after = int(data.get("rerank_after", RERANK_AFTER))
+    except (TypeError, ValueError):
+        raise ValueError("k and rerank_after must be integers")
+    k = max(1, min(k, MAX_NEXT_CITIES))
+    return k, max(k, rerank_after)
+
+
+class CursorStore:
+    '''
+    Class that stores ranked queues by cursor token.
+    Cursors are kept in last-used order, so expired ones are always at the front
+    and cleanup only touches the expired entries.
+    '''
+
+    def __init__(self, ttl=CURSOR_TTL):
+        self.ttl = ttl
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cleanup(self, now):
+        '''
+        Function to drop expired cursors from the front of the store.
+        '''
+        while self._cursors:
+            token, cursor = next(iter(self._cursors.items()))
+            if now - cursor["lastActivity"] <= self.ttl:
+                break
+            self._cursors.pop(token)
+
+    def create(self, user_id, queue, rerank_after, served, version=None):
+        '''
+        Function to store a ranked queue (list of (city index, score) pairs) for a user.
+        `served` is how many cities from the front of the queue were already returned,
+        `version` the artifact bundle the indices belong to. Returns the new cursor token.
+        '''
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._lock:
+            self._cleanup(now)
+            self._cursors[token] = {
+                "user_id": user_id,
+                "queue": queue,
+                "position": served,
+                "rerank_after": rerank_after,
+                "version": version,
+                "lastActivity": now
+            }
+        return token
+
+    def take(self, token, user_id, k, version=None):
+        '''
+        Function to return the next k (city index, score) pairs for a cursor.
+        Returns None if the cursor is unknown, expired, belongs to another user or
+        another bundle `version`, is exhausted or has already served `rerank_after` cities.
+        '''
+        now = time.time()
+        with self._lock:
+            self._cleanup(now)
+            cursor = self._cursors.get(token)
+            if cursor is None or cursor["user_id"] != user_id:
+                return None
+            if cursor["version"] != version:
+                self._cursors.pop(token)
+                return None
+
+            start = cursor["position"]
+            end = min(start + k, cursor["rerank_after"], len(cursor["queue"]))
+            if end <= start:
+                # Time to re-rank with the latest swipes
+                self._cursors.pop(token)
+                return None
+
+            cursor["position"] = end
+            cursor["lastActivity"] = now
+            self._cursors.move_to_end(token)
+            return cursor["queue"][start:end]
+
+    def discard(self, token):
+        '''
+        Function to drop a cursor, e.g. when the client asks for a fresh ranking.
+        '''
+        with self._lock:
+            self._cursors.pop(token, None)
+
+    def clear(self):
+        '''
+        Function to drop every cursor, e.g. after the city order changed.
+        '''
+        with self._lock:
+            self._cursors.clear()
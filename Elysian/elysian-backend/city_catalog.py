@@ -0,0 +1,187 @@
+"""
+File: city_catalog.py
+Function: In-memory cache of the allCities collection for the rating flow.
+
+Every comparison in rate_cities needs each city's name, country, global Elo and
+comparison count. Instead of reading the same allCities documents from Firestore
+on every comparison, the whole collection is loaded in one bulk read and kept
+fresh by a Firestore snapshot listener (or, if listening is turned off, by
+reloading after CATALOG_TTL seconds). When the backend itself changes a global
+Elo (see global_elo.py) it patches the cached entry directly.
+
+Listeners added with add_listener(callback) are told about every change as
+callback(changes, full), in order: `changes` maps city_id -> entry copy (None if
+removed) and `full` is True when the whole catalog was (re)loaded. leaderboard.py uses
+this to stay in sync without its own reads. Listeners run after the catalog lock is
+released (so a slow listener never blocks readers), one change at a time.
+
+Reads go through upstream.firestore (deadline, bulkhead, circuit breaker).
+"""
+
+import os
+import threading
+import time
+from elo import BASE_ELO
+import upstream
+
+# Seconds before the catalog is reloaded when no snapshot listener is running
+CATALOG_TTL = int(os.environ.get("CITY_CATALOG_TTL", "300"))
+
+# Keep the catalog fresh with a snapshot listener ("0" falls back to TTL reloads)
+CATALOG_LISTEN = os.environ.get("CITY_CATALOG_LISTEN", "1") == "1"
+
+
+def _read_collection(client, collection, timeout=None):
+    # The whole stream is read inside the call so the deadline covers all of it
+    return {doc.id: doc.to_dict() for doc in client.collection(collection).stream(timeout=timeout)}
+
+
+def _entry_from_doc(data):
+    return {
+        "city_name": data.get("city_name"),
+        "country_name": data.get("country_name"),
+        "globalElo": data.get("global_Elo", BASE_ELO),
+        "comparisonCount": data.get("comparison_count", 0),
+        "hasGlobalElo": "global_Elo" in data
+    }
+
+
+class CityCatalog:
+    '''
+    Class that holds name, country, global Elo and comparison count for every city.
+    '''
+
+    def __init__(self, client, collection="allCities", ttl=CATALOG_TTL, listen=CATALOG_LISTEN):
+        self.client = client
+        self.collection = collection
+        self.ttl = ttl
+        self.listen = listen
+        self._cities = {}
+        self._loaded_at = None
+        self._watch = None
+        self._lock = threading.Lock()
+        # Held from a change until its listeners have run, so they see changes in order.
+        # Reentrant so a listener may read the catalog (which can trigger a load).
+        self._notify_lock = threading.RLock()
+        self._listeners = []
+
+    def load(self):
+        '''
+        Function to (re)load every city in one bulk read.
+        '''
+        docs = upstream.firestore.call(_read_collection, self.client, self.collection)
+        cities = {city_id: _entry_from_doc(data) for city_id, data in docs.items()}
+        with self._notify_lock:
+            with self._lock:
+                self._cities = cities
+                self._loaded_at = time.time()
+                changes = {city_id: dict(entry) for city_id, entry in cities.items()}
+            self._notify(changes, full=True)
+
+    def add_listener(self, callback):
+        '''
+        Function to register callback(changes, full), called after the catalog changes.
+        '''
+        self._listeners.append(callback)
+
+    def _notify(self, changes, full=False):
+        # Called with _notify_lock but not the catalog lock held. Listeners get copies.
+        for callback in self._listeners:
+            callback(changes, full)
+
+    def start(self):
+        '''
+        Function to load the catalog and, if enabled, start the snapshot listener.
+        Called once at startup.
+        '''
+        self.load()
+        if self.listen and self._watch is None:
+            self._watch = self.client.collection(self.collection).on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Runs on the listener's thread with only the documents that changed.
+        changed = {}
+        with self._notify_lock:
+            with self._lock:
+                for change in changes:
+                    if change.type.name == "REMOVED":
+                        self._cities.pop(change.document.id, None)
+                        changed[change.document.id] = None
+                    else:
+                        entry = _entry_from_doc(change.document.to_dict())
+                        self._cities[change.document.id] = entry
+                        changed[change.document.id] = dict(entry)
+                self._loaded_at = time.time()
+            self._notify(changed)
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            self.load()
+        elif self._watch is None and time.time() - self._loaded_at > self.ttl:
+            self.load()
+
+    def get(self, city_id):
+        '''
+        Function that returns a copy of the cached entry for a city.
+        A city missing from the cache (e.g. added since the last load) is read once and cached.
+        '''
+        self._ensure_fresh()
+        with self._lock:
+            entry = self._cities.get(city_id)
+        if entry is None:
+            doc = upstream.firestore.call(self.client.collection(self.collection).document(city_id).get)
+            if not doc.exists:
+                raise ValueError(f"Unknown city: {city_id}")
+            entry = _entry_from_doc(doc.to_dict())
+            with self._notify_lock:
+                with self._lock:
+                    self._cities[city_id] = entry
+                    copy = dict(entry)
+                self._notify({city_id: copy})
+        return dict(entry)
+
+    def patch_global_elo(self, city_id, global_elo, comparison_increment=0):
+        '''
+        Function to update a cached city's global Elo (and comparison count) after
+        the backend changes it, without waiting for the listener or the TTL.
+        '''
+        with self._notify_lock:
+            with self._lock:
+                entry = self._cities.get(city_id)
+                if entry is None:
+                    return
+                entry["globalElo"] = global_elo
+                entry["comparisonCount"] += comparison_increment
+                copy = dict(entry)
+            self._notify({city_id: copy})
+
+    def add_global_elo_delta(self, city_id, delta, comparison_increment=0):
+        '''
+        Function to add a buffered global Elo change to a cached city, so ratings
+        see it before the write-behind flush reaches Firestore.
+        '''
+        with self._notify_lock:
+            with self._lock:
+                entry = self._cities.get(city_id)
+                if entry is None:
+                    return
+                entry["globalElo"] += delta
+                entry["comparisonCount"] += comparison_increment
+                copy = dict(entry)
+            self._notify({city_id: copy})
+
+    def has_global_elo(self, city_id):
+        '''
+        Function that returns True if the city's document has a global_Elo field.
+        '''
+        with self._lock:
+            entry = self._cities.get(city_id)
+            return entry is None or entry["hasGlobalElo"]
+
+    def __len__(self):
+        return len(self._cities)
@@ -0,0 +1,60 @@
+"""
+File: comparison_log.py
+Function: Append-only log of committed rating comparisons.
+
+Every comparison whose global Elo change is committed (/commit-rating) is
+appended as one "timestamp,winner_id,loser_id" line, in commit order. The log is
+what replay_elo.py replays to rebuild global_Elo and comparison_count for every
+city, e.g. after tuning K_FACTOR or GLOBAL_DAMPING.
+
+Logging is off unless COMPARISON_LOG_PATH is set. Each worker appends whole lines
+to the file opened in append mode, so several workers can share one file. The
+header is written once, by whichever worker creates the file: it is written to a
+temporary file that is then linked into place, which fails if the log exists, so
+no worker can append before the header or write it a second time.
+"""
+
+import os
+import threading
+import time
+
+COMPARISON_LOG_PATH = os.environ.get("COMPARISON_LOG_PATH", "")
+
+LOG_HEADER = "timestamp,winner_id,loser_id\n"
+
+
+class ComparisonLog:
+    '''
+    Class that appends comparisons to a CSV log file (does nothing without a path).
+    '''
+
+    def __init__(self, path=COMPARISON_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _create(self):
+        # Link a file that already holds the header, so the log never exists without it
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(LOG_HEADER)
+        try:
+            os.link(tmp, self.path)
+        except FileExistsError:
+            pass   # Another worker created it
+        finally:
+            os.remove(tmp)
+
+    def append(self, comparisons):
+        '''
+        Function to log a list of [winner_id, loser_id] comparisons in order.
+        '''
+        if not self.path or not comparisons:
+            return
+        now = round(time.time(), 3)
+        lines = "".join(f"{now},{winner},{loser}\n" for winner, loser in comparisons)
+        with self._lock:
+            if not os.path.exists(self.path):
+                self._create()
+            with open(self.path, "a") as f:
+                # One write per rating keeps its lines together across workers
+                f.write(lines)
@@ -0,0 +1,124 @@
+"""
+File: comparison_strategy.py
+Function: Chooses which ranked city a new city is compared against next.
+
+"binary" mode is the original binary search: always probe the middle of the
+remaining [left, right] range and stop when the range is empty.
+
+"adaptive" mode treats the new city's true Elo as uncertain around its initial
+Elo from INITIAL_ELO_MAP (the feedback levels are PRIOR_SIGMA apart, so that is
+how far we trust the initial guess). Each slot between two neighboring ranked
+cities gets the prior probability that the true Elo falls in the Elo gap
+between them. The next probe is the city that splits the remaining probability
+closest to 50/50 (the most informative question), and the session stops early
+once one slot is very likely or the remaining Elo range is narrower than one
+display-score step. A session that stops early puts the city in its most likely
+slot (placed_slot), and its personal Elo is moved into that slot's Elo gap
+(slot_elo).
+
+simulate_rating.py measures the average number of comparisons of both modes.
+Adaptive asks fewer questions (11-29% fewer for 5-1000 ranked cities), but a
+city placed by its most likely slot lands a little further from its true slot
+than binary search puts it (4.73 vs 4.43 slots off at 200 ranked cities, 22.65
+vs 20.32 at 1000, with the `python simulate_rating.py` defaults). Binary stays
+the default mode.
+"""
+
+import math
+import numpy as np
+from elo import INITIAL_ELO_MAP, MIN_ELO, MAX_ELO
+
+BINARY = "binary"
+ADAPTIVE = "adaptive"
+MODES = (BINARY, ADAPTIVE)
+
+# Spread (Elo) of the prior on the new city's true Elo: the gap between feedback levels
+_levels = sorted(INITIAL_ELO_MAP.values())
+PRIOR_SIGMA = min(b - a for a, b in zip(_levels, _levels[1:]))
+
+# One step (0.1) of the 0-10 display score, in Elo
+DISPLAY_RESOLUTION_ELO = (MAX_ELO - MIN_ELO) / 100
+
+# Stop once a single placement has at least this probability
+STOP_CONFIDENCE = 0.9
+
+
+def _normal_cdf(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def slot_probabilities(ranked_elos, left, right, prior_elo, sigma=PRIOR_SIGMA):
+    '''
+    Function that returns the probability of each remaining slot left..right+1,
+    where slot s means the new city goes just above ranked[s] (and below ranked[s-1]).
+    ranked_elos is sorted from highest to lowest.
+    '''
+    n = len(ranked_elos)
+    upper = ranked_elos[left - 1] if left > 0 else math.inf
+    lower = ranked_elos[right + 1] if right + 1 < n else -math.inf
+    edges = [upper] + list(ranked_elos[left:right + 1]) + [lower]
+
+    # P(true Elo above each edge); consecutive differences are the slot probabilities.
+    above = np.array([1 - _normal_cdf((edge - prior_elo) / sigma) for edge in edges])
+    probs = np.clip(np.diff(above), 0, None)
+
+    total = probs.sum()
+    if total <= 1e-12:
+        # The prior puts (almost) no mass in the remaining range, so treat slots as equally likely.
+        return np.full(len(probs), 1 / len(probs))
+    return probs / total
+
+
+def choose_probe(mode, ranked_elos, left, right, prior_elo):
+    '''
+    Function that returns the index in the ranking to compare against next.
+    '''
+    if mode != ADAPTIVE:
+        return (left + right) // 2
+
+    probs = slot_probabilities(ranked_elos, left, right, prior_elo)
+    # The new city beats ranked[i] exactly when its slot is <= i.
+    win_probs = np.cumsum(probs)[:-1]
+    return left + int(np.argmin(np.abs(win_probs - 0.5)))
+
+
+def is_settled(mode, ranked_elos, left, right, prior_elo):
+    '''
+    Function that returns True when no more comparisons are needed.
+    '''
+    if left > right:
+        return True
+    if mode != ADAPTIVE:
+        return False
+
+    # Every remaining placement gives (nearly) the same display score.
+    n = len(ranked_elos)
+    if left > 0 and right + 1 < n and ranked_elos[left - 1] - ranked_elos[right + 1] <= DISPLAY_RESOLUTION_ELO:
+        return True
+
+    return slot_probabilities(ranked_elos, left, right, prior_elo).max() >= STOP_CONFIDENCE
+
+
+def placed_slot(ranked_elos, left, right, prior_elo):
+    '''
+    Function that returns the slot a finished session puts the new city in: where
+    binary search ended, or the most likely remaining slot after an early stop.
+    '''
+    if left > right:
+        return left
+    return left + int(np.argmax(slot_probabilities(ranked_elos, left, right, prior_elo)))
+
+
+def slot_elo(elo, upper, lower):
+    '''
+    Function that returns an Elo inside the slot between the Elos `upper` and `lower`
+    (None for the top or bottom end): `elo` itself if it is already there, otherwise
+    the middle of the gap, or one display step past the only neighbor.
+    '''
+    if (upper is None or elo < upper) and (lower is None or elo > lower):
+        return elo
+    if upper is not None and lower is not None:
+        return (upper + lower) / 2
+    if upper is not None:
+        return upper - DISPLAY_RESOLUTION_ELO
+    return lower + DISPLAY_RESOLUTION_ELO
@@ -0,0 +1,114 @@
+"""
+File: disk_cache.py
+Function: Persistent key -> JSON value cache in a local SQLite file.
+
+Used behind an in-process LRUTTLCache so cached values survive restarts and are
+shared by every worker on the machine. Each entry has its own expiry, so found
+values (long TTL) and "nothing found" results (short TTL, stored as None) can
+live side by side.
+
+The file is opened (and created) on first use, not when the DiskCache is built,
+so importing a module that holds one at module level writes nothing to disk.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    '''
+    Class for a key -> JSON-serializable value cache stored in SQLite (WAL mode).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._created = False
+        self._create_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _create(self, conn):
+        '''
+        Function to set up the file and table the first time any thread uses the cache.
+        '''
+        with self._create_lock:
+            if self._created:
+                return
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+            conn.commit()
+            self._created = True
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._created:
+            self._create(conn)
+        return conn
+
+    def get(self, key):
+        '''
+        Function that returns (found, value); value can be None for a cached "not found".
+        '''
+        found, value, _ = self.get_entry(key)
+        return found, value
+
+    def get_entry(self, key):
+        '''
+        Function for get() that also returns when the entry expires: (found, value, expires_at).
+        '''
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None, None
+        self.hits += 1
+        return True, json.loads(row[0]), row[1]
+
+    def get_stale(self, key):
+        '''
+        Function for get() that also returns expired entries (until cleanup() removes them).
+        '''
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl)
+        )
+        conn.commit()
+
+    def expires_at(self, key):
+        '''
+        Function that returns when the key's entry expires, or None if there is none.
+        '''
+        row = self._conn().execute("SELECT expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def cleanup(self):
+        '''
+        Function to remove expired entries (an index range delete).
+        '''
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,43 @@
+"""
+File: elo.py
+Function: Elo constants and formulas shared by the rating flow and offline tools.
+
+rate_cities.py uses these for live ratings. They live in their own module
+(with no Firebase imports) so simulators and batch jobs can use the exact same
+numbers without a Firestore connection.
+"""
+
+# Configuration Constants
+BASE_ELO = 1000   # Default Elo rating for new cities
+K_FACTOR = 32     # Controls how fast ratings change
+
+# Global Elo updates move slower than personal ones (30% of K_FACTOR)
+GLOBAL_DAMPING = 0.3
+
+# Initial Elo rating assigned based on user's feedback
+# This gives a starting estimate before comparisons begin
+INITIAL_ELO_MAP = {
+    "LIKE": 1100,
+    "NEUTRAL": 1000,
+    "DISLIKE": 900
+}
+
+# Display score scaling range
+MIN_ELO = 800
+MAX_ELO = 1200
+
+
+def expected_score(rating_a, rating_b):
+    '''
+    Function to calculate expected win probability using Elo formula.
+    Returns value between 0 and 1.
+    '''
+    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+
+
+def display_score(elo):
+    '''
+    Function that converts an Elo rating into the 0-10 score shown in the app.
+    '''
+    scaled = 10 * (elo - MIN_ELO) / (MAX_ELO - MIN_ELO)
+    return round(max(0, min(10, scaled)), 1)
@@ -0,0 +1,357 @@
+"""
+File: feedback_store.py
+Function: Keeps running per-user aggregates of liked and disliked cities.
+
+Scoring only needs the mean raw vector and the mean normalized vector of the
+liked and disliked cities, plus which cities were already swiped. Instead of
+gathering city_vectors[liked_idx] and re-averaging on every /next_city, each
+user gets running sums, counts and a seen bitmap that are updated by one O(d)
+add/subtract per swipe. Aggregates are built from Firestore the first time a
+user is seen (or once they are older than the staleness bound) and are updated
+through /swipe afterwards.
+
+Each worker has its own aggregates and a swipe only reaches the worker that
+handled /swipe, so /next_city also sends the app's recent swipes
+("recent_swipes"). They are applied to a copy of the aggregate that only that
+request scores with; the cached aggregate changes only through /swipe and
+reloads, so swipes the app sends again with every request never pile up in it.
+parse_recent_swipes() rejects malformed entries with a ValueError (400).
+
+An aggregate holds indices and sums of one artifact bundle and is tagged with
+its version. get() is given the bundle the request uses and never returns an
+aggregate of another version, and only aggregates of the store's current
+version are cached, so a request that started before a bundle switch can't put
+an old aggregate back in front of new requests.
+
+The Firestore helpers take the client as an argument, so they work the same
+against the real project, the Firestore emulator or a local fake client. The
+*_async versions take an async Firestore client (asgi_app.py).
+"""
+
+import asyncio
+import threading
+import numpy as np
+from firebase_admin import firestore
+from ttl_cache import LRUTTLCache
+import upstream
+
+FAVORITES_COLLECTION = "userFavorites"
+DISLIKES_COLLECTION = "userDislikes"
+
+LIKE = "like"
+DISLIKE = "dislike"
+UNLIKE = "unlike"
+UNDISLIKE = "undislike"
+
+SWIPE_ACTIONS = (LIKE, DISLIKE, UNLIKE, UNDISLIKE)
+
+MAX_RECENT_SWIPES = 100   # Most recent swipes applied per request
+
+
+def fetch_user_feedback(client, user_id, timeout=None):
+    '''
+    Function that reads the user's favorites and dislikes documents in one
+    batched round trip. Returns (liked_ids, disliked_ids).
+    '''
+    fav_ref = client.collection(FAVORITES_COLLECTION).document(user_id)
+    dislike_ref = client.collection(DISLIKES_COLLECTION).document(user_id)
+
+    # get_all does not promise to return documents in order, so match them by collection.
+    docs = {doc.reference.parent.id: doc for doc in client.get_all([fav_ref, dislike_ref], timeout=timeout)}
+    fav_doc = docs.get(FAVORITES_COLLECTION)
+    dislike_doc = docs.get(DISLIKES_COLLECTION)
+
+    liked = list(fav_doc.to_dict().keys()) if fav_doc is not None and fav_doc.exists else []
+    disliked = list(dislike_doc.to_dict().keys()) if dislike_doc is not None and dislike_doc.exists else []
+    return liked, disliked
+
+
+async def fetch_user_feedback_async(client, user_id, timeout=None):
+    '''
+    Function that reads the user's favorites and dislikes documents concurrently
+    with an async client. Returns (liked_ids, disliked_ids).
+    '''
+    fav_doc, dislike_doc = await asyncio.gather(
+        client.collection(FAVORITES_COLLECTION).document(user_id).get(timeout=timeout),
+        client.collection(DISLIKES_COLLECTION).document(user_id).get(timeout=timeout)
+    )
+    liked = list(fav_doc.to_dict().keys()) if fav_doc.exists else []
+    disliked = list(dislike_doc.to_dict().keys()) if dislike_doc.exists else []
+    return liked, disliked
+
+
+def swipe_update(action, city_info=None):
+    '''
+    Function that returns (collection, value) for recording a swipe the same way the app does:
+    liked/disliked cities are merged into the user's document (with their city info),
+    unlike/undislike delete the city's field.
+    '''
+    if action not in SWIPE_ACTIONS:
+        raise ValueError(f"Unknown swipe action: {action}")
+    collection = FAVORITES_COLLECTION if action in (LIKE, UNLIKE) else DISLIKES_COLLECTION
+    value = (city_info or {}) if action in (LIKE, DISLIKE) else firestore.DELETE_FIELD
+    return collection, value
+
+
+def write_swipe(client, user_id, city_id, action, city_info=None):
+    '''
+    Function that records a swipe in Firestore (see swipe_update), through upstream.firestore.
+    '''
+    collection, value = swipe_update(action, city_info)
+    upstream.firestore.call(client.collection(collection).document(user_id).set, {city_id: value}, merge=True)
+
+
+async def write_swipe_async(client, user_id, city_id, action, city_info=None):
+    collection, value = swipe_update(action, city_info)
+    await upstream.firestore.call_async(client.collection(collection).document(user_id).set, {city_id: value}, merge=True)
+
+
+def parse_recent_swipes(recent_swipes):
+    '''
+    Function that checks the app's recent swipes ([{"city_id", "action"}, ...], oldest
+    first) and returns the last MAX_RECENT_SWIPES as (city_id, action) pairs.
+    Raises ValueError if they aren't a list of such entries.
+    '''
+    if recent_swipes is None:
+        return []
+    if not isinstance(recent_swipes, (list, tuple)):
+        raise ValueError("recent_swipes must be a list")
+    swipes = []
+    for swipe in recent_swipes:
+        if not isinstance(swipe, dict) or not isinstance(swipe.get("city_id"), str):
+            raise ValueError(f"Malformed recent swipe: {swipe!r}")
+        if swipe.get("action") not in SWIPE_ACTIONS:
+            raise ValueError(f"Unknown swipe action: {swipe.get('action')}")
+        swipes.append((swipe["city_id"], swipe["action"]))
+    return swipes[-MAX_RECENT_SWIPES:]
+
+
+class FeedbackAggregate:
+    '''
+    Class holding one user's liked/disliked city sets and the running sums
+    needed to score without touching the individual swiped vectors.
+    `bundle` is the artifact bundle its indices and sums belong to.
+    '''
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.version = bundle.version
+        num_cities, dim = bundle.vectors.shape
+        self.liked = set()
+        self.disliked = set()
+        self.liked_sum_raw = np.zeros(dim, dtype=np.float64)
+        self.liked_sum_norm = np.zeros(dim, dtype=np.float64)
+        self.disliked_sum_raw = np.zeros(dim, dtype=np.float64)
+        self.disliked_sum_norm = np.zeros(dim, dtype=np.float64)
+        self.seen = np.zeros(num_cities, dtype=bool)
+        self.lock = threading.Lock()
+
+    def _group(self, liked):
+        if liked:
+            return self.liked, self.liked_sum_raw, self.liked_sum_norm
+        return self.disliked, self.disliked_sum_raw, self.disliked_sum_norm
+
+    def add(self, idx, liked, raw, normed):
+        '''
+        Function to add a city to the liked or disliked group (no-op if already there).
+        '''
+        group, sum_raw, sum_norm = self._group(liked)
+        if idx in group:
+            return
+        group.add(idx)
+        sum_raw += raw
+        sum_norm += normed
+        self.seen[idx] = True
+
+    def remove(self, idx, liked, raw, normed):
+        '''
+        Function to remove a city from the liked or disliked group (no-op if not there).
+        '''
+        group, sum_raw, sum_norm = self._group(liked)
+        if idx not in group:
+            return
+        group.remove(idx)
+        sum_raw -= raw
+        sum_norm -= normed
+        self.seen[idx] = idx in self.liked or idx in self.disliked
+
+    def liked_mean_raw(self):
+        return self.liked_sum_raw / len(self.liked) if self.liked else None
+
+    def disliked_mean_raw(self):
+        return self.disliked_sum_raw / len(self.disliked) if self.disliked else None
+
+    def liked_mean_norm(self):
+        return self.liked_sum_norm / len(self.liked) if self.liked else None
+
+    def disliked_mean_norm(self):
+        return self.disliked_sum_norm / len(self.disliked) if self.disliked else None
+
+    def seen_idx(self):
+        return np.flatnonzero(self.seen)
+
+    def copy(self):
+        '''
+        Function that returns an independent copy, e.g. to apply one request's swipes to.
+        '''
+        other = FeedbackAggregate(self.bundle)
+        with self.lock:
+            other.liked = set(self.liked)
+            other.disliked = set(self.disliked)
+            other.liked_sum_raw[:] = self.liked_sum_raw
+            other.liked_sum_norm[:] = self.liked_sum_norm
+            other.disliked_sum_raw[:] = self.disliked_sum_raw
+            other.disliked_sum_norm[:] = self.disliked_sum_norm
+            other.seen[:] = self.seen
+        return other
+
+    def snapshot(self):
+        '''
+        Function that returns (liked_mean_raw, disliked_mean_raw, liked_mean_norm,
+        disliked_mean_norm, seen_idx) consistently while swipes may be arriving.
+        '''
+        with self.lock:
+            return (
+                self.liked_mean_raw(),
+                self.disliked_mean_raw(),
+                self.liked_mean_norm(),
+                self.disliked_mean_norm(),
+                self.seen_idx()
+            )
+
+
+class FeedbackStore:
+    '''
+    Class that keeps a bounded set of FeedbackAggregates by user id.
+    `load_feedback(user_id)` returns (liked_ids, disliked_ids) and is only called
+    when a user's aggregate is missing or was loaded more than `max_staleness`
+    seconds ago. The staleness bound covers writes that don't go through /swipe
+    (e.g. the favorites screen writing Firestore directly). If that read fails,
+    the expired aggregate is used rather than failing the request.
+    The bundle (vectors, normed, index, version) is passed to every get(); `version`
+    is the active bundle's, the only one whose aggregates are cached.
+    '''
+
+    def __init__(self, load_feedback, version=None, maxsize=10000, max_staleness=300):
+        self.load_feedback = load_feedback
+        self.version = version
+        self._aggregates = LRUTTLCache(maxsize=maxsize, ttl=max_staleness)
+        self.stale_served = 0
+
+    def _build(self, bundle, liked_ids, disliked_ids):
+        aggregate = FeedbackAggregate(bundle)
+        for liked, city_ids in ((True, liked_ids), (False, disliked_ids)):
+            idx = [bundle.index[cid] for cid in city_ids if cid in bundle.index]
+            group, sum_raw, sum_norm = aggregate._group(liked)
+            group.update(idx)
+            idx = sorted(group)
+            if idx:
+                # One gather per group when building; swipes after this are O(d).
+                sum_raw += bundle.vectors[idx].sum(axis=0)
+                sum_norm += bundle.normed[idx].sum(axis=0)
+                aggregate.seen[idx] = True
+        return aggregate
+
+    def _cached(self, user_id, bundle):
+        # The cached aggregate if it belongs to this bundle
+        aggregate = self._aggregates.get(user_id)
+        if aggregate is not None and aggregate.version != bundle.version:
+            return None
+        return aggregate
+
+    def _store(self, user_id, aggregate):
+        # An aggregate of an older bundle (its request started before the switch) is
+        # still used by that request, but not cached.
+        if aggregate.version == self.version:
+            self._aggregates.set(user_id, aggregate)
+        return aggregate
+
+    def get(self, user_id, bundle, recent_swipes=()):
+        '''
+        Function that returns the user's aggregate for `bundle`, loading it from Firestore if needed.
+        `recent_swipes` ([{"city_id", "action"}, ...], oldest first) are applied to a copy
+        that is returned instead, so swipes handled by another worker are not recommended
+        again without changing the cached aggregate. Raises ValueError if they are malformed.
+        '''
+        swipes = parse_recent_swipes(recent_swipes)
+        aggregate = self._cached(user_id, bundle)
+        if aggregate is None:
+            try:
+                liked_ids, disliked_ids = self.load_feedback(user_id)
+            except Exception as e:
+                aggregate = self._stale(user_id, bundle, e)
+            else:
+                aggregate = self._store(user_id, self._build(bundle, liked_ids, disliked_ids))
+        if swipes:
+            aggregate = aggregate.copy()
+            for city_id, action in swipes:
+                self._apply(aggregate, city_id, action)
+        return aggregate
+
+    def _stale(self, user_id, bundle, error):
+        # Expired aggregate for a failed read; re-raise the error if there is none for this bundle
+        aggregate = self._aggregates.get_stale(user_id)
+        if aggregate is None or aggregate.version != bundle.version:
+            raise error
+        self.stale_served += 1
+        return aggregate
+
+    async def get_async(self, user_id, load_feedback, bundle):
+        '''
+        Function for get() with an async loader: `await load_feedback(user_id)` returns (liked_ids, disliked_ids).
+        '''
+        aggregate = self._cached(user_id, bundle)
+        if aggregate is None:
+            try:
+                liked_ids, disliked_ids = await load_feedback(user_id)
+            except Exception as e:
+                return self._stale(user_id, bundle, e)
+            aggregate = self._store(user_id, self._build(bundle, liked_ids, disliked_ids))
+        return aggregate
+
+    def record(self, user_id, city_id, action):
+        '''
+        Function to apply one swipe to the user's aggregate if it is cached.
+        If it is not cached the next get() loads it (including this swipe) from Firestore.
+        '''
+        if action not in SWIPE_ACTIONS:
+            raise ValueError(f"Unknown swipe action: {action}")
+        aggregate = self._aggregates.get(user_id)
+        if aggregate is not None:
+            self._apply(aggregate, city_id, action)
+
+    def _apply(self, aggregate, city_id, action):
+        if action not in SWIPE_ACTIONS:
+            raise ValueError(f"Unknown swipe action: {action}")
+        bundle = aggregate.bundle
+        idx = bundle.index.get(city_id)
+        if idx is None:
+            return
+
+        raw = bundle.vectors[idx]
+        normed = bundle.normed[idx]
+        with aggregate.lock:
+            if action == LIKE:
+                aggregate.add(idx, True, raw, normed)
+            elif action == DISLIKE:
+                aggregate.add(idx, False, raw, normed)
+            elif action == UNLIKE:
+                aggregate.remove(idx, True, raw, normed)
+            else:
+                aggregate.remove(idx, False, raw, normed)
+
+    def switch(self, version):
+        '''
+        Function to make `version` (a new artifact bundle) the cached one and drop every
+        aggregate, since their sums and indices belong to the old bundle.
+        '''
+        self.version = version
+        self._aggregates.clear()
+
+    def invalidate(self, user_id):
+        self._aggregates.pop(user_id)
+
+    def stats(self):
+        stats = self._aggregates.stats()
+        stats["staleServed"] = self.stale_served
+        return stats
@@ -3,10 +3,11 @@ File: firebase_config.py
 Function: Initializes firebase for backend.
 
 This is needed for app.py and rate_cities.py since Firebase can only be intialized once.
+asgi_app.py also uses the async client, which shares the same credentials.
 """
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 import json
 import os
 
@@ -20,3 +21,6 @@ if not firebase_admin._apps:
 
 # Export Firestore client
 db = firestore.client()
+
+# Export async Firestore client (its connection is opened on first use, inside the event loop)
+async_db = firestore_async.client()
@@ -0,0 +1,221 @@
+"""
+File: global_elo.py
+Function: Write-behind buffer for global Elo updates of allCities.
+
+Global Elo used to be written back by the app as an absolute value computed from
+the Elo the city had when the comparison happened, so two users rating the same
+city at the same time overwrote each other's update, and every rated city cost a
+document write per post.
+
+Now each finished rating adds its per-city Elo *deltas* (and comparison counts)
+to an in-memory buffer, where deltas for the same city are summed. A background
+thread flushes the buffer every FLUSH_INTERVAL seconds, or sooner once
+FLUSH_THRESHOLD cities are waiting, as firestore.Increment writes of up to
+BATCH_LIMIT documents per commit.
+Increments commute, so concurrent raters (and several workers with their own
+buffers) never lose each other's updates. Commits go through upstream.firestore
+(deadline, bulkhead, circuit breaker); if one fails, it is retried on the next flush.
+
+Increments are not idempotent, and a failed commit may still have landed (a
+DeadlineExceeded after the server applied it). So every chunk of a flush has an
+id and is committed in a transaction that also writes a marker document
+(FLUSH_MARKERS/<id>). The transaction first reads the marker, and a retry whose
+marker already exists writes nothing. A failed chunk keeps its id and its
+deltas until it is retried. Markers carry "flushedAt", so a Firestore TTL
+policy on that field can delete old ones.
+
+tests/test_global_elo.py checks the buffer with concurrent raters against
+local_firestore.LocalFirestore.
+"""
+
+import atexit
+import os
+import secrets
+import threading
+import time
+from firebase_admin import firestore
+from elo import BASE_ELO
+import upstream
+
+# Seconds between background flushes
+FLUSH_INTERVAL = float(os.environ.get("GLOBAL_ELO_FLUSH_INTERVAL", "5"))
+
+# Flush early once this many cities have pending deltas
+FLUSH_THRESHOLD = int(os.environ.get("GLOBAL_ELO_FLUSH_THRESHOLD", "200"))
+
+# Most writes Firestore accepts in one commit; one of them is the chunk's marker
+BATCH_LIMIT = 500
+
+# Collection of the markers of committed chunks
+FLUSH_MARKERS = os.environ.get("GLOBAL_ELO_FLUSH_MARKERS", "globalEloFlushes")
+
+
+class GlobalEloBuffer:
+    '''
+    Class that sums global Elo deltas per city and flushes them as batched increments.
+    `has_global_elo(city_id)` tells whether the city document already has a global_Elo
+    field. An increment of a missing field would start from 0, so a city without one
+    is first seeded with BASE_ELO in a transaction (see _seed); every delta is then
+    an increment, whichever worker writes it.
+    '''
+
+    def __init__(self, client, collection="allCities", flush_interval=FLUSH_INTERVAL,
+                 flush_threshold=FLUSH_THRESHOLD, has_global_elo=None):
+        self.client = client
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.has_global_elo = has_global_elo
+
+        self._pending = {}   # city_id -> [elo delta, comparisons]
+        self._retry = []   # (chunk id, [(city_id, (elo delta, comparisons)), ...]) of failed commits
+        self._seeded = set()   # Cities this buffer already seeded (skips the transaction next time)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()   # One flush at a time
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._ratings = 0
+        self._comparisons = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._duplicates_skipped = 0
+        self._documents_written = 0
+        self._last_flush_ms = None
+        self._last_flush_at = None
+        self._last_error = None
+
+    def add(self, deltas, comparisons):
+        '''
+        Function to buffer one rating's global Elo deltas and per-city comparison counts.
+        '''
+        with self._lock:
+            for city_id, delta in deltas.items():
+                entry = self._pending.setdefault(city_id, [0.0, 0])
+                entry[0] += delta
+                entry[1] += comparisons.get(city_id, 0)
+            self._ratings += 1
+            self._comparisons += sum(comparisons.values())
+            full = len(self._pending) >= self.flush_threshold
+
+        if full:
+            self._wake.set()
+
+    def _needs_seed(self, city_id):
+        return not (city_id in self._seeded or self.has_global_elo is None or self.has_global_elo(city_id))
+
+    def _seed(self, city_id):
+        '''
+        Function that sets the city's global_Elo to BASE_ELO if its document has none.
+        The read and the write are one transaction, so when several workers seed the
+        same city only the first one writes and the others see the field.
+        '''
+        ref = self.client.collection(self.collection).document(city_id)
+
+        @firestore.transactional
+        def seed(transaction, timeout):
+            snapshot = ref.get(transaction=transaction, timeout=timeout)
+            if "global_Elo" not in (snapshot.to_dict() or {}):
+                transaction.set(ref, {"global_Elo": BASE_ELO}, merge=True)
+
+        upstream.firestore.call(seed, self.client.transaction())
+        self._seeded.add(city_id)
+
+    def _commit_chunk(self, chunk_id, chunk):
+        '''
+        Function that writes one chunk's increments and its marker in a transaction.
+        Returns False (and writes nothing) if the marker shows the chunk was already committed.
+        '''
+        collection = self.client.collection(self.collection)
+        marker = self.client.collection(FLUSH_MARKERS).document(chunk_id)
+
+        @firestore.transactional
+        def commit(transaction, timeout):
+            if marker.get(transaction=transaction, timeout=timeout).exists:
+                return False
+            for city_id, (delta, count) in chunk:
+                transaction.set(collection.document(city_id), {
+                    "global_Elo": firestore.Increment(delta),
+                    "comparison_count": firestore.Increment(count)
+                }, merge=True)
+            transaction.set(marker, {"cities": len(chunk), "flushedAt": time.time()})
+            return True
+
+        return upstream.firestore.call(commit, self.client.transaction())
+
+    def flush(self):
+        '''
+        Function to write all pending deltas. Returns the number of cities written.
+        Failed chunks are retried first on the next flush, under the same chunk id.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                chunks, self._retry = self._retry, []
+            items = list(pending.items())
+            size = BATCH_LIMIT - 1
+            chunks += [(secrets.token_hex(16), items[i:i + size]) for i in range(0, len(items), size)]
+            if not chunks:
+                return 0
+
+            start = time.perf_counter()
+            written = 0
+            for n, (chunk_id, chunk) in enumerate(chunks):
+                try:
+                    for city_id, _ in chunk:
+                        if self._needs_seed(city_id):
+                            self._seed(city_id)
+                    if self._commit_chunk(chunk_id, chunk):
+                        written += len(chunk)
+                    else:
+                        self._duplicates_skipped += 1
+                except Exception as e:
+                    with self._lock:
+                        self._retry.extend(chunks[n:])
+                    self._failed_flushes += 1
+                    self._last_error = str(e)
+                    print("Global Elo flush failed:", e)
+                    break
+
+            self._flushes += 1
+            self._documents_written += written
+            self._last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+            self._last_flush_at = time.time()
+            return written
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        '''
+        Function to start the background flush thread (and flush once more at exit).
+        '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="global-elo-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending_cities = len(self._pending) + sum(len(chunk) for _, chunk in self._retry)
+        return {
+            "pendingCities": pending_cities,
+            "ratings": self._ratings,
+            "comparisons": self._comparisons,
+            "flushes": self._flushes,
+            "failedFlushes": self._failed_flushes,
+            "duplicatesSkipped": self._duplicates_skipped,
+            "documentsWritten": self._documents_written,
+            "lastFlushMs": self._last_flush_ms,
+            "lastFlushAt": self._last_flush_at,
+            "lastError": self._last_error
+        }
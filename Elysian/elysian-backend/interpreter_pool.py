@@ -0,0 +1,163 @@
+"""
+File: interpreter_pool.py
+Function: Bounded pool of TFLite interpreters shared by request threads.
+
+A tf.lite.Interpreter is not safe to use from several threads at once: one
+request's set_tensor can overwrite another's inputs before invoke runs. Instead
+of one module-level interpreter, app.py borrows an interpreter from this pool for
+the whole set_tensor/invoke/get_tensor sequence and gives it back afterwards.
+The pool also records how long requests wait for a free interpreter.
+
+Batched calls (/embed/batch) need the inputs resized to N rows, and resizing
+reallocates every tensor. So that single and batched calls can interleave without
+reallocating each time, each pool slot keeps one interpreter per batch class (the
+batch size rounded up to a power of two), created the first time that class is
+needed. A batch is padded with zero rows up to its class and the padding is cut
+off the output. A slot holds at most log2(largest batch) + 1 interpreters.
+"""
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# Number of interpreters in the pool (roughly the number of concurrent inferences)
+POOL_SIZE = int(os.environ.get("TFLITE_POOL_SIZE", "4"))
+
+# Threads each interpreter may use for a single invoke
+NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", "1"))
+
+
+def load_interpreter(model_path, num_threads):
+    '''
+    Function that loads a TFLite interpreter with its tensors allocated.
+    '''
+    import tensorflow as tf
+    interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def batch_class(batch_size):
+    '''
+    Function that returns the batch size an interpreter is sized for: the smallest
+    power of two that fits `batch_size` rows.
+    '''
+    return 1 << max(0, batch_size - 1).bit_length()
+
+
+class InterpreterPool:
+    '''
+    Class that creates `size` slots of interpreters for a model and lends them out
+    one request at a time. Each slot starts with one interpreter for single rows and
+    adds one per batch class as batched calls need them.
+    '''
+
+    def __init__(self, model_path, size=POOL_SIZE, num_threads=NUM_THREADS, load=None):
+        self.model_path = model_path
+        # mtime of the model file, read before loading so a newer file always counts as a change
+        self.version = os.path.getmtime(model_path)
+        self.size = size
+        self.num_threads = num_threads
+        self._load = load or load_interpreter
+        self._free = queue.LifoQueue()
+
+        # Wait-time and allocation metrics
+        self._metrics_lock = threading.Lock()
+        self._acquired = 0
+        self._waiting = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._allocations = 0
+
+        # A slot maps batch class -> interpreter sized for it; only its borrower touches it.
+        for _ in range(size):
+            self._free.put({1: self._create_interpreter()})
+
+        # Tensor details are the same for every interpreter of the same model.
+        sample = self._free.get()
+        self.input_details = sample[1].get_input_details()
+        self.output_details = sample[1].get_output_details()
+        self._free.put(sample)
+
+    def _create_interpreter(self, batch_size=1):
+        '''
+        Function to load another interpreter for the model with its inputs sized
+        for `batch_size` rows.
+        '''
+        interpreter = self._load(self.model_path, self.num_threads)
+        if batch_size != 1:
+            for detail in self.input_details:
+                shape = list(detail["shape"])
+                shape[0] = batch_size
+                interpreter.resize_tensor_input(detail["index"], shape)
+            interpreter.allocate_tensors()
+        with self._metrics_lock:
+            self._allocations += 1
+        return interpreter
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        '''
+        Context manager that borrows a slot (batch class -> interpreter) for the
+        duration of the block. Raises queue.Empty if no slot is free within `timeout` seconds.
+        '''
+        with self._metrics_lock:
+            self._waiting += 1
+        start = time.perf_counter()
+        try:
+            slot = self._free.get(timeout=timeout)
+        finally:
+            waited = time.perf_counter() - start
+            with self._metrics_lock:
+                self._waiting -= 1
+
+        with self._metrics_lock:
+            self._acquired += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        try:
+            yield slot
+        finally:
+            self._free.put(slot)
+
+    def run(self, feeds, timeout=None):
+        '''
+        Function that runs one invoke on a pooled interpreter.
+        `feeds` maps input tensor index -> array whose first dimension is the batch size;
+        N rows run on the slot's interpreter for N's batch class and produce N outputs
+        in one invoke. Returns a copy of the first output tensor.
+        '''
+        batch_size = len(next(iter(feeds.values())))
+        size = batch_class(batch_size)
+        with self.acquire(timeout) as slot:
+            interpreter = slot.get(size)
+            if interpreter is None:
+                interpreter = slot[size] = self._create_interpreter(size)
+            for index, value in feeds.items():
+                if size != batch_size:
+                    value = np.concatenate([value, np.zeros((size - batch_size,) + value.shape[1:], value.dtype)])
+                interpreter.set_tensor(index, value)
+            interpreter.invoke()
+            return interpreter.get_tensor(self.output_details[0]["index"])[:batch_size].copy()
+
+    def stats(self):
+        '''
+        Function that returns pool size and wait-time metrics.
+        '''
+        with self._metrics_lock:
+            acquired = self._acquired
+            return {
+                "size": self.size,
+                "numThreads": self.num_threads,
+                "free": self._free.qsize(),
+                "waiting": self._waiting,
+                "acquired": acquired,
+                "totalWaitMs": round(self._total_wait * 1000, 3),
+                "meanWaitMs": round(self._total_wait * 1000 / acquired, 3) if acquired else 0.0,
+                "maxWaitMs": round(self._max_wait * 1000, 3),
+                "allocations": self._allocations
+            }
@@ -0,0 +1,156 @@
+"""
+File: leaderboard.py
+Function: In-memory leaderboard of cities by global Elo, for /leaderboard.
+
+Reading every allCities document per request would be needed to answer "top
+cities" from Firestore. Instead the leaderboard keeps one sorted list for all
+cities plus one per country and per continent, and follows the city catalog
+(see city_catalog.add_listener): a full catalog load rebuilds it, and each
+global Elo change moves one city with bisect in every list it belongs to.
+Cities with the same global Elo are ordered by city id. A new artifact bundle can
+move cities between continents, so set_continents regroups every city.
+
+Top-N is a slice and rank-of-city is one bisect, so queries take microseconds.
+"""
+
+import threading
+from bisect import bisect_left, insort
+
+
+def _group_key(name):
+    return (name or "").strip().lower()
+
+
+class Leaderboard:
+    '''
+    Class that keeps cities sorted by global Elo (highest first), overall and per group.
+    `continent_of` maps city_id -> continent (allCities documents only have the country).
+    '''
+
+    def __init__(self, continent_of=None):
+        self.continent_of = continent_of or {}
+        self._cities = {}   # city_id -> entry (city_name, country_name, continent, globalElo, comparisonCount)
+        self._all = []   # Sorted (-globalElo, city_id)
+        self._by_country = {}
+        self._by_continent = {}
+        self._lock = threading.Lock()
+
+    def _lists(self, entry):
+        # Every sorted list a city belongs to
+        lists = [self._all]
+        if entry["country_name"]:
+            lists.append(self._by_country.setdefault(_group_key(entry["country_name"]), []))
+        if entry["continent"]:
+            lists.append(self._by_continent.setdefault(_group_key(entry["continent"]), []))
+        return lists
+
+    def _remove(self, city_id):
+        entry = self._cities.pop(city_id, None)
+        if entry is None:
+            return
+        key = (-entry["globalElo"], city_id)
+        for sorted_list in self._lists(entry):
+            del sorted_list[bisect_left(sorted_list, key)]
+
+    def _add(self, city_id, catalog_entry):
+        entry = {
+            "city_name": catalog_entry["city_name"],
+            "country_name": catalog_entry["country_name"],
+            "continent": self.continent_of.get(city_id),
+            "globalElo": catalog_entry["globalElo"],
+            "comparisonCount": catalog_entry["comparisonCount"]
+        }
+        self._cities[city_id] = entry
+        key = (-entry["globalElo"], city_id)
+        for sorted_list in self._lists(entry):
+            insort(sorted_list, key)
+
+    def _rebuild(self, entries):
+        self._cities = {}
+        self._all = []
+        self._by_country = {}
+        self._by_continent = {}
+        for city_id, entry in entries.items():
+            self._add(city_id, entry)
+
+    def rebuild(self, entries):
+        '''
+        Function to rebuild every list from a full snapshot {city_id: catalog entry}.
+        '''
+        with self._lock:
+            self._rebuild(entries)
+
+    def set_continents(self, continent_of):
+        '''
+        Function to switch to a new city_id -> continent map (a new artifact bundle)
+        and regroup the cities already on the leaderboard.
+        '''
+        with self._lock:
+            self.continent_of = continent_of or {}
+            self._rebuild(self._cities)
+
+    def apply(self, changes, full=False):
+        '''
+        Function that takes catalog changes (the city_catalog listener callback).
+        '''
+        if full:
+            self.rebuild(changes)
+            return
+        with self._lock:
+            for city_id, entry in changes.items():
+                self._remove(city_id)
+                if entry is not None:
+                    self._add(city_id, entry)
+
+    def _select(self, country=None, continent=None):
+        if country:
+            return self._by_country.get(_group_key(country), [])
+        if continent:
+            return self._by_continent.get(_group_key(continent), [])
+        return self._all
+
+    def _row(self, rank, city_id):
+        return {"rank": rank, "city_id": city_id, **self._cities[city_id]}
+
+    def top(self, limit=10, country=None, continent=None):
+        '''
+        Function that returns (the top `limit` cities, how many cities the selection has),
+        optionally within a country or continent. With both filters, the country list
+        is filtered by continent.
+        '''
+        with self._lock:
+            sorted_list = self._select(country, continent)
+            if country and continent:
+                ids = [cid for _, cid in sorted_list
+                       if _group_key(self._cities[cid]["continent"]) == _group_key(continent)]
+                total = len(ids)
+            else:
+                ids = [cid for _, cid in sorted_list[:limit]]
+                total = len(sorted_list)
+            return [self._row(rank, cid) for rank, cid in enumerate(ids[:limit], start=1)], total
+
+    def rank_of(self, city_id, country=None, continent=None):
+        '''
+        Function that returns the city's row with its 1-based rank in the selected list,
+        or None if the city isn't in it.
+        '''
+        with self._lock:
+            entry = self._cities.get(city_id)
+            if entry is None:
+                return None
+            if country and _group_key(entry["country_name"]) != _group_key(country):
+                return None
+            if continent and _group_key(entry["continent"]) != _group_key(continent):
+                return None
+            sorted_list = self._select(country, continent)
+            rank = bisect_left(sorted_list, (-entry["globalElo"], city_id)) + 1
+            if country and continent:
+                # The country list may hold cities of other continents (e.g. transcontinental countries)
+                rank = 1 + sum(
+                    1 for _, cid in sorted_list[:rank - 1]
+                    if _group_key(self._cities[cid]["continent"]) == _group_key(continent)
+                )
+            return self._row(rank, city_id)
+
+    def __len__(self):
+        return len(self._cities)
@@ -0,0 +1,320 @@
+"""
+File: local_firestore.py
+Function: Small in-memory stand-in for the Firestore client, for local checks.
+
+Supports the calls the backend's read and write paths use: collection().document()
+get (field_paths) / set(merge) / update / delete, get_all(), collection().stream(),
+batch() writes with firestore.Increment, transactions run with
+@firestore.transactional, and the same document reads and writes awaited through
+async_client(). A batch
+commit is applied atomically under one lock, like a Firestore batched write, and a
+transaction holds that lock from its first read to its commit. Snapshots carry an
+update_time that changes on every write of the document. collection().on_snapshot()
+calls its callback with every document first and then with each write's changes,
+after the write has released the lock. fail_next_commits(n) makes the next n
+commits raise, and lose_next_acks(n) makes the next n commits apply their writes
+and then raise DeadlineExceeded (the commit landed but the reply was lost), to
+check retry paths. Not used by the server itself.
+"""
+
+import threading
+from types import SimpleNamespace
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+
+class LocalSnapshot:
+    def __init__(self, doc_id, data, update_time=None, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+        self.reference = reference
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+
+class LocalDocument:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def parent(self):
+        return LocalCollection(self._client, self._collection)
+
+    def get(self, field_paths=None, timeout=None, transaction=None):
+        with self._client.lock:
+            self._client.reads += 1
+            data = self._client.data.get(self._collection, {}).get(self.id)
+            if data is None:
+                return LocalSnapshot(self.id, None, reference=self)
+            if field_paths is not None:
+                # Like a field mask: only these fields (none for []), same update_time
+                data = {field: data[field] for field in field_paths if field in data}
+            update_time = self._client.update_times.get((self._collection, self.id), 0)
+            return LocalSnapshot(self.id, dict(data), update_time, reference=self)
+
+    def set(self, data, merge=False, timeout=None):
+        with self._client.lock:
+            self._client._write(self._collection, self.id, data, merge=merge)
+            result = SimpleNamespace(update_time=self._client.update_times[(self._collection, self.id)])
+        self._client._notify()
+        return result
+
+    def update(self, data):
+        with self._client.lock:
+            self._client._write(self._collection, self.id, data, merge=True, must_exist=True)
+        self._client._notify()
+
+    def delete(self):
+        with self._client.lock:
+            self._client._delete(self._collection, self.id)
+        self._client._notify()
+
+
+class LocalCollection:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+        self.id = name
+
+    def document(self, doc_id):
+        return LocalDocument(self._client, self._name, doc_id)
+
+    def stream(self, timeout=None):
+        with self._client.lock:
+            docs = list(self._client.data.get(self._name, {}).items())
+        return [LocalSnapshot(doc_id, dict(data)) for doc_id, data in docs]
+
+    def on_snapshot(self, callback):
+        '''
+        Function that calls callback(docs, changes, read_time) with every document now
+        (all ADDED) and after each write to the collection. Returns a watch with unsubscribe().
+        '''
+        docs = self.stream()
+        watch = LocalWatch(self._client, self._name, callback)
+        with self._client.lock:
+            self._client.watches.append(watch)
+        callback(docs, [_change("ADDED", doc) for doc in docs], None)
+        return watch
+
+
+def _change(kind, snapshot):
+    # Same shape as a DocumentChange: change.type.name and change.document
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=snapshot)
+
+
+class LocalWatch:
+    def __init__(self, client, collection, callback):
+        self._client = client
+        self.collection = collection
+        self.callback = callback
+
+    def unsubscribe(self):
+        with self._client.lock:
+            if self in self._client.watches:
+                self._client.watches.remove(self)
+
+
+class LocalBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge, False))
+
+    def update(self, ref, data):
+        self._writes.append((ref, data, True, True))
+
+    def commit(self, timeout=None):
+        try:
+            with self._client.lock:
+                self._client._fail_before_commit()
+                # Check every write first so a failing batch changes nothing
+                for ref, _, _, must_exist in self._writes:
+                    if must_exist and ref.id not in self._client.data.get(ref._collection, {}):
+                        raise ValueError(f"No document to update: {ref._collection}/{ref.id}")
+                for ref, data, merge, must_exist in self._writes:
+                    self._client._write(ref._collection, ref.id, data, merge=merge, must_exist=must_exist)
+                self._client.commits += 1
+                self._client._fail_after_commit()
+        finally:
+            self._client._notify()
+
+
+class LocalTransaction:
+    '''
+    Class with the parts of firestore.Transaction that @firestore.transactional uses.
+    '''
+
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, client):
+        self._client = client
+        self._id = None
+        self._writes = []
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        # Serializes transactions (and batches) like Firestore's pessimistic locking.
+        self._client.lock.acquire()
+        self._id = id(self)
+
+    def _commit(self):
+        try:
+            self._client._fail_before_commit()
+            for ref, data, merge in self._writes:
+                self._client._write(ref._collection, ref.id, data, merge=merge)
+            self._client.commits += 1
+            self._client._fail_after_commit()
+        finally:
+            self._clean_up()
+            self._client.lock.release()
+            self._client._notify()
+
+    def _rollback(self):
+        if self._id is not None:
+            self._clean_up()
+            self._client.lock.release()
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+
+class LocalAsyncDocument:
+    def __init__(self, document):
+        self._document = document
+        self.id = document.id
+
+    async def get(self, field_paths=None, timeout=None):
+        return self._document.get(field_paths)
+
+    async def set(self, data, merge=False, timeout=None):
+        return self._document.set(data, merge=merge)
+
+    async def update(self, data, timeout=None):
+        self._document.update(data)
+
+
+class LocalAsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def document(self, doc_id):
+        return LocalAsyncDocument(self._collection.document(doc_id))
+
+
+class LocalAsyncFirestore:
+    '''
+    Class for the async client (firebase_config.async_db) over the same data.
+    '''
+
+    def __init__(self, client):
+        self._client = client
+
+    def collection(self, name):
+        return LocalAsyncCollection(self._client.collection(name))
+
+
+class LocalFirestore:
+    '''
+    Class that mimics the parts of firestore.Client used by the backend's writes.
+    '''
+
+    def __init__(self, data=None):
+        self.data = data or {}
+        self.lock = threading.RLock()
+        self.commits = 0
+        self.reads = 0   # Document gets, to check what a code path reads
+        self.failures_left = 0
+        self.lost_acks_left = 0
+        self.update_times = {}   # (collection, doc_id) -> write counter, like a snapshot's update_time
+        self.watches = []
+        self._writes = 0
+        self._changes = []   # (collection, doc_id, kind) written since the last _notify()
+
+    def collection(self, name):
+        return LocalCollection(self, name)
+
+    def async_client(self):
+        return LocalAsyncFirestore(self)
+
+    def get_all(self, refs, timeout=None):
+        with self.lock:
+            return [ref.get() for ref in refs]
+
+    def batch(self):
+        return LocalBatch(self)
+
+    def transaction(self):
+        return LocalTransaction(self)
+
+    def fail_next_commits(self, count):
+        with self.lock:
+            self.failures_left = count
+
+    def lose_next_acks(self, count):
+        with self.lock:
+            self.lost_acks_left = count
+
+    def _fail_before_commit(self):
+        if self.failures_left > 0:
+            self.failures_left -= 1
+            raise RuntimeError("Simulated commit failure")
+
+    def _fail_after_commit(self):
+        if self.lost_acks_left > 0:
+            self.lost_acks_left -= 1
+            raise google_exceptions.DeadlineExceeded("Simulated deadline after the commit landed")
+
+    def _write(self, collection, doc_id, data, merge, must_exist=False):
+        docs = self.data.setdefault(collection, {})
+        if must_exist and doc_id not in docs:
+            raise ValueError(f"No document to update: {collection}/{doc_id}")
+        current = docs.get(doc_id, {}) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, firestore.Increment):
+                current[field] = current.get(field, 0) + value.value
+            elif value is firestore.DELETE_FIELD:
+                current.pop(field, None)
+            else:
+                current[field] = value
+        kind = "MODIFIED" if doc_id in docs else "ADDED"
+        docs[doc_id] = current
+        self._writes += 1
+        self.update_times[(collection, doc_id)] = self._writes
+        self._changes.append((collection, doc_id, kind))
+
+    def _delete(self, collection, doc_id):
+        if self.data.get(collection, {}).pop(doc_id, None) is not None:
+            self._writes += 1
+            self.update_times.pop((collection, doc_id), None)
+            self._changes.append((collection, doc_id, "REMOVED"))
+
+    def _notify(self):
+        '''
+        Function to send the changes written so far to the collection watches. Called
+        without the lock held, like Firestore's listener thread.
+        '''
+        with self.lock:
+            changes, self._changes = self._changes, []
+            batches = []
+            for watch in self.watches:
+                docs = self.data.get(watch.collection, {})
+                batch = [
+                    _change(kind, LocalSnapshot(doc_id, None if kind == "REMOVED" else dict(docs[doc_id])))
+                    for collection, doc_id, kind in changes
+                    if collection == watch.collection and (kind == "REMOVED" or doc_id in docs)
+                ]
+                if batch:
+                    batches.append((watch.callback, batch))
+        for callback, batch in batches:
+            callback(None, batch, None)
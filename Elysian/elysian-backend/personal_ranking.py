@@ -0,0 +1,239 @@
+"""
+File: personal_ranking.py
+Function: Keeps each user's cities sorted by personal Elo between ratings.
+
+start_rating used to read the userPosts document twice and sort every
+personalElos entry on each post. A PersonalRanking keeps the cities in sorted
+order and is updated by bisect insertion for the few cities a finished rating
+changes. Rank -> city is a list index and city -> rank is an index that is fixed
+up only for the cities between a moved city's old and new position.
+
+RankingStore keeps rankings per user (LRU with a staleness bound, like
+FeedbackStore). Workers don't share it and the app writes personalElos itself,
+so a rating starts with get(user_id, fresh=True). With a cached ranking that is
+a metadata-only read (an empty field mask): if the userPosts document's
+update_time is the ranking's version, the ranking is current and the document
+itself is not read. Otherwise the document is read; if its personalElos are the
+ones the ranking already holds (e.g. the app wrote back a rating this worker
+committed) the ranking is kept under the new version, else it is rebuilt.
+
+The sorted order is saved as "rankedCities" on the userPosts document when a
+rating is committed, so rebuilding a ranking only has to check the order (O(n))
+instead of sorting, and the update_time of that write becomes the ranking's
+version. Reads and writes go through upstream.firestore. A failed read fails the
+rating (the route answers 503) instead of rating against an expired ranking,
+whose Elos would then be written back as the user's new ones.
+"""
+
+import os
+import threading
+from bisect import bisect_right
+from ttl_cache import LRUTTLCache
+import upstream
+
+POSTS_COLLECTION = "userPosts"
+
+# Save the sorted order on userPosts when a rating is committed ("0" turns it off)
+PERSIST_RANKING = os.environ.get("PERSIST_RANKING", "1") == "1"
+
+
+class PersonalRanking:
+    '''
+    Class that keeps a user's cities sorted from highest to lowest personal Elo.
+    '''
+
+    def __init__(self, personal_elos, ranked_ids=None):
+        self._elos = dict(personal_elos)
+        if ranked_ids is None or not self._is_ranking(ranked_ids):
+            ranked_ids = sorted(self._elos, key=lambda cid: self._elos[cid], reverse=True)
+        self._ids = list(ranked_ids)
+        self._keys = [-self._elos[cid] for cid in self._ids]   # Ascending, for bisect
+        self._rank = {cid: i for i, cid in enumerate(self._ids)}
+        self.version = None   # update_time of the userPosts document it was built from
+        self.lock = threading.Lock()
+
+    def _is_ranking(self, ranked_ids):
+        # A saved order is only used if it holds exactly these cities in Elo order.
+        if len(ranked_ids) != len(self._elos) or set(ranked_ids) != self._elos.keys():
+            return False
+        return all(self._elos[a] >= self._elos[b] for a, b in zip(ranked_ids, ranked_ids[1:]))
+
+    def update(self, city_id, elo):
+        '''
+        Function to add a city or move it after its Elo changed (O(log n) search + list shift).
+        Only the ranks between the old and new position are rewritten.
+        '''
+        old = self._rank.get(city_id)
+        if old is not None:
+            del self._ids[old]
+            del self._keys[old]
+        position = bisect_right(self._keys, -elo)
+        self._ids.insert(position, city_id)
+        self._keys.insert(position, -elo)
+        self._elos[city_id] = elo
+
+        # A new city shifts every city after it down by one
+        first, last = (position, len(self._ids) - 1) if old is None else sorted((old, position))
+        for i in range(first, last + 1):
+            self._rank[self._ids[i]] = i
+
+    def update_many(self, personal_elos):
+        '''
+        Function to apply a rating's changed personal Elos; unchanged values are skipped.
+        '''
+        for city_id, elo in personal_elos.items():
+            if self._elos.get(city_id) != elo:
+                self.update(city_id, elo)
+
+    def rank_of(self, city_id):
+        '''
+        Function that returns the city's position (0 = highest Elo).
+        '''
+        return self._rank[city_id]
+
+    def city_at(self, rank):
+        return self._ids[rank]
+
+    def snapshot(self):
+        '''
+        Function that returns (ranked ids, their Elos, personal Elos dict) as consistent copies.
+        '''
+        with self.lock:
+            return list(self._ids), self.elos(), dict(self._elos)
+
+    def ids(self):
+        return list(self._ids)
+
+    def elos(self):
+        return [-key for key in self._keys]
+
+    def personal_elos(self):
+        return dict(self._elos)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class RankingStore:
+    '''
+    Class that keeps a bounded set of PersonalRankings by user id.
+    A ranking is read from userPosts when it is missing or older than `max_staleness`
+    seconds, and checked against the document's update_time on every get(fresh=True).
+    '''
+
+    def __init__(self, client, maxsize=10000, max_staleness=300, persist=PERSIST_RANKING):
+        self.client = client
+        self.persist = persist
+        self._rankings = LRUTTLCache(maxsize=maxsize, ttl=max_staleness)
+        self.checks = 0
+        self.reads = 0
+        self.reused = 0
+        self.save_failures = 0
+
+    def _document(self, user_id):
+        return self.client.collection(POSTS_COLLECTION).document(user_id)
+
+    def load(self, user_id, cached=None):
+        '''
+        Function that reads the user's document once and builds their ranking.
+        `cached` is returned as is if the document hasn't changed since it was built.
+        '''
+        doc = upstream.firestore.call(self._document(user_id).get)
+        return self._from_doc(doc, cached)
+
+    def _from_doc(self, doc, cached=None):
+        self.reads += 1
+        version = doc.update_time if doc.exists else None
+        if cached is not None and version is not None and cached.version == version:
+            self.reused += 1
+            return cached
+        data = doc.to_dict() if doc.exists else {}
+        personal_elos = data.get("personalElos", {})
+        if cached is not None and version is not None:
+            with cached.lock:
+                if cached.personal_elos() == personal_elos:
+                    # Same Elos under a new version (e.g. the app wrote back this worker's rating)
+                    cached.version = version
+                    self.reused += 1
+                    return cached
+        ranking = PersonalRanking(personal_elos, data.get("rankedCities"))
+        ranking.version = version
+        return ranking
+
+    def _is_current(self, ranking, doc):
+        # `doc` is a metadata-only snapshot of the user's document
+        self.checks += 1
+        if ranking.version is not None and doc.exists and doc.update_time == ranking.version:
+            self.reused += 1
+            return True
+        return False
+
+    def get(self, user_id, fresh=False):
+        '''
+        Function that returns the user's cached ranking, loading it if needed.
+        With `fresh`, changes made by other workers (or by the app) since the ranking
+        was cached are seen: a cached ranking is checked with a metadata-only read and
+        the document is only read if it changed.
+        '''
+        ranking = self._rankings.get(user_id)
+        if ranking is not None and fresh:
+            if self._is_current(ranking, upstream.firestore.call(self._document(user_id).get, field_paths=[])):
+                return ranking
+        if ranking is None or fresh:
+            ranking = self.load(user_id, ranking)
+            self._rankings.set(user_id, ranking)
+        return ranking
+
+    async def get_async(self, user_id, async_client, fresh=False):
+        '''
+        Function for get() that reads the document with an async Firestore client.
+        '''
+        ranking = self._rankings.get(user_id)
+        document = async_client.collection(POSTS_COLLECTION).document(user_id)
+        if ranking is not None and fresh:
+            if self._is_current(ranking, await upstream.firestore.call_async(document.get, field_paths=[])):
+                return ranking
+        if ranking is None or fresh:
+            doc = await upstream.firestore.call_async(document.get)
+            ranking = self._from_doc(doc, ranking)
+            self._rankings.set(user_id, ranking)
+        return ranking
+
+    def commit(self, user_id, personal_elos):
+        '''
+        Function to apply a finished rating's changed personal Elos and save the new order.
+        The ranking then holds the rating's Elos; once the order is saved, the write's
+        update_time is its version, so the next fresh get() doesn't rebuild it. The saved
+        order is only a hint (a load checks it), so a failed save is counted, not raised.
+        Without persistence the version is kept: the app writes the same Elos, which a
+        fresh get() then adopts without a rebuild.
+        '''
+        ranking = self.get(user_id)
+        with ranking.lock:
+            ranking.update_many(personal_elos)
+            ranked_ids = ranking.ids()
+            version = ranking.version
+
+        if self.persist:
+            try:
+                result = upstream.firestore.call(self._document(user_id).set, {"rankedCities": ranked_ids}, merge=True)
+            except Exception as e:
+                self.save_failures += 1
+                print("Saving ranking failed:", e)
+                with ranking.lock:
+                    # The write may still have landed, so the next fresh get() reads the document
+                    if ranking.version == version:
+                        ranking.version = None
+            else:
+                with ranking.lock:
+                    # Unless another request moved the ranking on meanwhile
+                    if ranking.version == version:
+                        ranking.version = result.update_time
+
+    def stats(self):
+        stats = self._rankings.stats()
+        stats["checks"] = self.checks
+        stats["reads"] = self.reads
+        stats["reused"] = self.reused
+        stats["saveFailures"] = self.save_failures
+        return stats
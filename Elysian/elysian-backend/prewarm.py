@@ -0,0 +1,208 @@
+"""
+File: prewarm.py
+Function: Fills the image and activity caches for every city in the catalog.
+
+The catalog is only the ~196 rows of cities.csv, so instead of making the first
+user to see a city wait for Unsplash and Gemini, this job walks every city with
+a bounded thread pool and fills both caches (see unsplash_service.py and
+activities_service.py). Entries that are missing or expire within
+PREWARM_REFRESH_MARGIN seconds are fetched again, so served requests keep hitting
+the cache. Each upstream has its own rate limit, and progress is printed and kept
+in status() for /metrics.
+
+Run once from the command line (or from cron):
+    python prewarm.py [--images] [--activities] [--workers 4]
+or in the background of the server with PREWARM=1 (a pass every PREWARM_INTERVAL
+seconds). Every gunicorn worker imports the app, so passes are coordinated through
+a lock file (PREWARM_LOCK_PATH) shared by the processes on the machine: a pass only
+runs while holding it (without waiting), and the file records when the last pass
+finished, so the other workers skip until the next one is due. Pointing
+UNSPLASH_API_URL / GEMINI_API_ENDPOINT at local stand-in servers makes the job
+testable offline.
+"""
+
+import argparse
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+
+CITIES_PATH = "../../Datasets/cities.csv"
+
+PREWARM_WORKERS = int(os.environ.get("PREWARM_WORKERS", "4"))
+PREWARM_INTERVAL = int(os.environ.get("PREWARM_INTERVAL", "3600"))   # Seconds between background passes
+PREWARM_LOCK_PATH = os.environ.get("PREWARM_LOCK_PATH", "prewarm.lock")
+PREWARM_REFRESH_MARGIN = int(os.environ.get("PREWARM_REFRESH_MARGIN", str(24 * 3600)))   # Refresh 1 day early
+
+# Upstream calls per second (Unsplash production keys allow 5000/hour)
+IMAGE_RATE = float(os.environ.get("PREWARM_IMAGE_RATE", "1"))
+ACTIVITY_RATE = float(os.environ.get("PREWARM_ACTIVITY_RATE", "0.5"))
+
+PROGRESS_EVERY = 25   # Print progress after this many cities
+
+
+class RateLimiter:
+    '''
+    Class for a thread-safe limiter that spaces calls at least 1 / rate seconds apart.
+    '''
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Prewarmer:
+    '''
+    Class that runs prewarm passes over the catalog and keeps their progress.
+    `jobs` maps a name to (expires_at(city, country), refresh(city, country), RateLimiter).
+    '''
+
+    def __init__(self, cities, jobs, workers=PREWARM_WORKERS, refresh_margin=PREWARM_REFRESH_MARGIN,
+                 lock_path=PREWARM_LOCK_PATH):
+        self.cities = cities
+        self.jobs = jobs
+        self.workers = workers
+        self.refresh_margin = refresh_margin
+        self.lock_path = lock_path
+        self._status = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _warm(self, name, city, country):
+        # Returns "fresh", "refreshed" or "failed" for one city.
+        expires_at, refresh, limiter = self.jobs[name]
+        expiry = expires_at(city, country)
+        if expiry is not None and expiry - time.time() > self.refresh_margin:
+            return "fresh"
+        limiter.wait()
+        try:
+            refresh(city, country)
+            return "refreshed"
+        except Exception as e:
+            print(f"Prewarm {name} failed for {city}, {country}: {e}")
+            return "failed"
+
+    def run_pass(self, name):
+        '''
+        Function to warm one cache for every city. Returns the pass's counters.
+        '''
+        status = {"done": 0, "total": len(self.cities), "fresh": 0, "refreshed": 0, "failed": 0,
+                  "startedAt": time.time(), "finishedAt": None}
+        with self._lock:
+            self._status[name] = status
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._warm, name, city, country) for city, country in self.cities]
+            for future in as_completed(futures):
+                with self._lock:
+                    status[future.result()] += 1
+                    status["done"] += 1
+                    if status["done"] % PROGRESS_EVERY == 0 or status["done"] == status["total"]:
+                        print(
+                            f"Prewarm {name}: {status['done']}/{status['total']} "
+                            f"({status['refreshed']} fetched, {status['failed']} failed)"
+                        )
+
+        with self._lock:
+            status["finishedAt"] = time.time()
+        return dict(status)
+
+    def run(self, min_interval=0):
+        '''
+        Function to run a pass for every job, unless another process is running one or the
+        last one finished less than `min_interval` seconds ago. Returns whether it ran.
+        '''
+        with open(self.lock_path, "a+") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                lock_file.seek(0)
+                finished_at = lock_file.read().strip()
+                if finished_at and time.time() - float(finished_at) < min_interval:
+                    return False
+                for name in self.jobs:
+                    self.run_pass(name)
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(time.time()))
+                lock_file.flush()
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _loop(self):
+        while True:
+            # Half an interval, so this worker's own next pass isn't skipped by timer jitter
+            self.run(min_interval=PREWARM_INTERVAL / 2)
+            time.sleep(PREWARM_INTERVAL)
+
+    def start(self):
+        '''
+        Function to run passes in a background thread, one every PREWARM_INTERVAL seconds.
+        '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+            self._thread.start()
+
+    def status(self):
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+
+def catalog_cities(path=CITIES_PATH):
+    df = pd.read_csv(path, usecols=["city_name", "country"])
+    return list(zip(df["city_name"], df["country"]))
+
+
+def build_prewarmer(images=True, activities=True, workers=PREWARM_WORKERS):
+    '''
+    Function that builds a Prewarmer for the image and/or activity caches.
+    '''
+    jobs = {}
+    if images:
+        import unsplash_service
+        jobs["images"] = (
+            lambda city, country: unsplash_service.image_expires_at(f"{city} {country}"),
+            lambda city, country: unsplash_service.refresh_city_image(f"{city} {country}"),
+            RateLimiter(IMAGE_RATE)
+        )
+    if activities:
+        import activities_service
+        jobs["activities"] = (
+            activities_service.expires_at,
+            activities_service.refresh_activities,
+            RateLimiter(ACTIVITY_RATE)
+        )
+    return Prewarmer(catalog_cities(), jobs, workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", action="store_true", help="Only warm the image cache")
+    parser.add_argument("--activities", action="store_true", help="Only warm the activity cache")
+    parser.add_argument("--workers", type=int, default=PREWARM_WORKERS)
+    args = parser.parse_args()
+
+    both = not args.images and not args.activities
+    prewarmer = build_prewarmer(images=both or args.images, activities=both or args.activities, workers=args.workers)
+    if not prewarmer.run():
+        print("Another prewarm pass is running")
+        return
+    print(prewarmer.status())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+File: profile_encoder.py
+Function: Encodes user profiles with plain dict lookups instead of sklearn transforms.
+
+The pickled LabelEncoders and MultiLabelBinarizers are only lookup tables once
+they are fitted, but every transform call validates its input and allocates new
+arrays. At startup we copy their classes into dicts (label -> index) and then
+encode a profile by writing 1s into a preallocated float32 buffer. The output is
+bit-identical to the sklearn path in app.py (checked by tests/test_profile_encoder.py).
+"""
+
+import numpy as np
+
+# Key used for NaN labels (NaN != NaN, so it can't be looked up directly in a dict)
+_NAN_KEY = ("nan",)
+
+# Multi-select questions, in the order the model expects them in the multi-hot vector
+MULTI_FEATURES = ["vacation_types", "seasons", "budget", "place_type"]
+
+
+def _lookup_key(label):
+    # LabelEncoder maps every NaN to the NaN class, so give all NaNs the same dict key.
+    if isinstance(label, float) and label != label:
+        return _NAN_KEY
+    return label
+
+
+class CompiledProfileEncoder:
+    '''
+    Class that encodes profiles into (origin_enc, fav_enc, multi_hot) like
+    encode_user_inputs, using lookup tables built from the fitted encoders.
+    '''
+
+    def __init__(self, le_origin, le_fav, mlbs, multi_features=MULTI_FEATURES):
+        # LabelEncoder: label -> position in classes_
+        self.origin_index = {_lookup_key(label): float(i) for i, label in enumerate(le_origin.classes_)}
+        self.fav_index = {_lookup_key(label): float(i) for i, label in enumerate(le_fav.classes_)}
+
+        # MultiLabelBinarizer: label -> column in the concatenated multi-hot vector
+        self.multi_features = list(multi_features)
+        self.multi_index = {}
+        offset = 0
+        for feature in self.multi_features:
+            classes = mlbs[feature].classes_
+            self.multi_index[feature] = {label: offset + i for i, label in enumerate(classes)}
+            offset += len(classes)
+        self.multi_hot_size = offset
+
+    def _label_index(self, table, label):
+        # Same error as LabelEncoder.transform for a label it was not fitted on.
+        try:
+            return table[_lookup_key(label)]
+        except (KeyError, TypeError):
+            raise ValueError(f"y contains previously unseen labels: {label!r}")
+
+    def _fill_multi_hot(self, data, out):
+        for feature in self.multi_features:
+            columns = self.multi_index[feature]
+            for value in data.get(feature, []):
+                column = columns.get(value)
+                # MultiLabelBinarizer ignores unknown labels, so do the same.
+                if column is not None:
+                    out[column] = 1.0
+
+    def encode(self, data):
+        '''
+        Function that encodes one profile. Returns (origin_enc, fav_enc, multi_hot).
+        '''
+        origin_enc = self._label_index(self.origin_index, data["origin_country"])
+        fav_enc = self._label_index(self.fav_index, data["favorite_country_visited"])
+        multi_hot = np.zeros(self.multi_hot_size, dtype=np.float32)
+        self._fill_multi_hot(data, multi_hot)
+        return origin_enc, fav_enc, multi_hot
+
+    def encode_batch(self, profiles):
+        '''
+        Function that encodes many profiles into preallocated arrays.
+        Returns (origin_batch (N, 1), fav_batch (N, 1), multi_batch (N, multi_hot_size)), all float32.
+        '''
+        n = len(profiles)
+        origin_batch = np.empty((n, 1), dtype=np.float32)
+        fav_batch = np.empty((n, 1), dtype=np.float32)
+        multi_batch = np.zeros((n, self.multi_hot_size), dtype=np.float32)
+
+        for row, data in enumerate(profiles):
+            origin_batch[row, 0] = self._label_index(self.origin_index, data["origin_country"])
+            fav_batch[row, 0] = self._label_index(self.fav_index, data["favorite_country_visited"])
+            self._fill_multi_hot(data, multi_batch[row])
+
+        return origin_batch, fav_batch, multi_batch
@@ -8,88 +8,122 @@ has already rated.
 
 Process:
 1. Assign initial Elo from feedback (LIKE=1100, NEUTRAL=1000, DISLIKE=900)
-2. Compare against ranked cities using binary search (O(log n))
+2. Compare against ranked cities using binary search (O(log n)),
+   or adaptive probes that can stop early (see comparison_strategy.py)
 3. Update personal and global Elo after each comparison
 4. Convert final Elo to a 0–10 display score
-5. Store results and clear session
+5. Store results and clear session; the global Elo changes stay on the server
+   under a rating id, which the app commits with /commit-rating when the post
+   is uploaded (see global_elo.py)
 
 Returns updated Elos, comparison count, and final rating score.
+
+start_bulk_rating places many new cities at once (see bulk_rating.py) and
+reuses /compare-cities for its comparisons.
 """
 
+import os
+import secrets
 import time
-from flask import request, jsonify
 from firebase_config import db
-
-# Configuration Constants
-BASE_ELO = 1000   # Default Elo rating for new cities
-K_FACTOR = 32     # Controls how fast ratings change
-
-# Initial Elo rating assigned based on user's feedback
-# This gives a starting estimate before comparisons begin
-INITIAL_ELO_MAP = {
-    "LIKE": 1100,
-    "NEUTRAL": 1000,
-    "DISLIKE": 900
-}
-
-# Display score scaling range
-MIN_ELO = 800
-MAX_ELO = 1200
+from city_catalog import CityCatalog
+from global_elo import GlobalEloBuffer
+from comparison_log import ComparisonLog
+from personal_ranking import RankingStore
+from session_store import create_session_store
+from bulk_rating import NeedComparison, plan_bulk_placement
+from comparison_strategy import ADAPTIVE, BINARY, MODES, choose_probe, is_settled, placed_slot, slot_elo
+from elo import (
+    BASE_ELO,
+    K_FACTOR,
+    GLOBAL_DAMPING,
+    INITIAL_ELO_MAP,
+    expected_score,
+    display_score
+)
+
+# How comparisons are chosen unless the request says otherwise ("binary" or "adaptive")
+RATING_MODE = os.environ.get("RATING_MODE", BINARY)
+
+# Most new cities one bulk rating session accepts
+MAX_BULK_CITIES = 50
+
+# Session "kind" of a bulk rating session (single-city sessions have no kind)
+BULK = "bulk"
 
 # Session expiration time (seconds)
 SESSION_TIMEOUT = 300   # 5 minutes
 
+# How long a finished rating can still be committed (seconds)
+RATING_COMMIT_TIMEOUT = int(os.environ.get("RATING_COMMIT_TIMEOUT", str(24 * 3600)))
+
 
-# In-memory session that stores the state between API calls
+# Where rating sessions are kept between API calls:
+# "memory" (one worker process) or "sqlite" (shared by all workers on the machine)
+SESSION_STORE = os.environ.get("RATING_SESSION_STORE", "memory")
+SESSION_DB_PATH = os.environ.get("RATING_SESSION_DB", "rating_sessions.db")
+
+# Session store that keeps the state between API calls
 # Format:
-# _sessions[user_id] = {
+# session_store.get(user_id) = {
 #     "city_id": str,
 #     "left": int,
 #     "right": int,
 #     "ranked": list,
 #     "tempPersonalElos": {},
 #     "tempGlobalElos": {},
+#     "globalDeltas": {},       # Summed global Elo change per city
+#     "globalComparisons": {},  # Comparisons per city
+#     "comparisons": [],        # [winner_id, loser_id] in order
+#     "mode": "binary" | "adaptive",
+#     "rankedElos": list,
+#     "priorElo": float,
 #     "lastActivity": timestamp
 # }
-_sessions = {}
+# A bulk session instead has:
+#     "kind": "bulk",
+#     "cities": [[city_id, feedback], ...],
+#     "answers": [[first, second, winner], ...],
+#     "pending": [first, second]
+# Finished ratings (rating_id -> global Elo changes and comparisons) wait in the same store for /commit-rating.
+session_store = create_session_store(SESSION_STORE, SESSION_TIMEOUT, SESSION_DB_PATH, RATING_COMMIT_TIMEOUT)
 
-# Session Cleanup Helper
+# Shared cache of allCities (name, country, global Elo, comparison count), so a
+# rating session does no per-comparison Firestore reads. Loaded by app.py at startup.
+city_catalog = CityCatalog(db)
 
-def cleanup_expired_sessions():
-    '''
-    Function to remove sessions that have been inactive longer than SESSION_TIMEOUT.
-    This prevents memory leaks and stale sessions.
-    '''
-    now = time.time()
-    expired_users = []
+# Write-behind buffer that sums global Elo changes per city and writes them as
+# batched increments. Started by app.py at startup.
+global_elo_buffer = GlobalEloBuffer(db, has_global_elo=city_catalog.has_global_elo)
+
+# Log of committed comparisons for offline replays (see replay_elo.py)
+comparison_log = ComparisonLog()
+
+# Each user's cities kept sorted by personal Elo between ratings (see personal_ranking.py)
+RANKING_CACHE_SIZE = int(os.environ.get("RANKING_CACHE_SIZE", "10000"))
+RANKING_MAX_STALENESS = int(os.environ.get("RANKING_MAX_STALENESS", "300"))   # Seconds
 
-    # Find expired sessions
-    for user_id, session in _sessions.items():
-        if now - session["lastActivity"] > SESSION_TIMEOUT:
-            expired_users.append(user_id)
+ranking_store = RankingStore(db, maxsize=RANKING_CACHE_SIZE, max_staleness=RANKING_MAX_STALENESS)
 
-    for user_id in expired_users:
-        _sessions.pop(user_id)
+# Session Cleanup Helper
 
-def touch_session(user_id):
+def cleanup_expired_sessions():
     '''
-    Function to update session lastActivity timestamp.
-    This prevents active sessions from expiring.
+    Function to remove sessions that have been inactive longer than SESSION_TIMEOUT.
+    This prevents memory leaks and stale sessions. Only expired sessions are touched.
     '''
-    if user_id in _sessions:
-        _sessions[user_id]["lastActivity"] = time.time()
+    session_store.cleanup()
 
 # Firestore Read Helper Functions
 
 def get_city_data(city_id):
     '''
-    Function to fetch global Elo and comparison count fo a city from Firestore.
+    Function to get global Elo and comparison count for a city from the cached catalog.
     '''
-    doc = db.collection("allCities").document(city_id).get()
-    data = doc.to_dict()
+    city = city_catalog.get(city_id)
     return {
-        "globalElo": data.get("global_Elo", BASE_ELO),
-        "comparisonCount": data.get("comparison_count", 0)
+        "globalElo": city["globalElo"],
+        "comparisonCount": city["comparisonCount"]
     }
 
 
@@ -114,30 +148,23 @@ def get_user_data(user_id):
 
 def get_city_info(city_id):
     '''
-    Function to fetch readable city info (name and country).
+    Function to get readable city info (name and country) from the cached catalog.
     This is used for displaying comparison for UI.
     '''
-    doc = db.collection("allCities").document(city_id).get()
-    data = doc.to_dict()
+    city = city_catalog.get(city_id)
     return {
         "id": city_id,
-        "city_name": data.get("city_name"),
-        "country_name": data.get("country_name")
+        "city_name": city["city_name"],
+        "country_name": city["country_name"]
     }
 
 # Elo Rating Logic
 
-def expected_score(rating_a, rating_b):
-    '''
-    Function to calculate expected win probability using Elo formula.
-    Returns value between 0 and 1.
-    '''
-    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
-
 def calculate_rating_updates(session, winner_id, loser_id):
     '''
     Function to update temporary personal and global Elo ratings after comparison.
-    This is added to Firebase by frontend once user uploads the post.
+    The global Elo changes are stored with the finished rating and written by
+    /commit-rating once the user uploads the post (see commit_rating).
     '''
     # Temporary personal Elo rating
     personal_elos = session["tempPersonalElos"]
@@ -160,8 +187,8 @@ def calculate_rating_updates(session, winner_id, loser_id):
     personal_elos[winner_id] = winner_new_personal
     personal_elos[loser_id] = loser_new_personal
 
-    # Global Elo updates move slower (30%)
-    global_k = K_FACTOR * 0.3
+    # Global Elo updates move slower (GLOBAL_DAMPING = 30%)
+    global_k = K_FACTOR * GLOBAL_DAMPING
 
     winner_global = winner_city["globalElo"]
     loser_global = loser_city["globalElo"]
@@ -171,8 +198,18 @@ def calculate_rating_updates(session, winner_id, loser_id):
     winner_new_global = winner_global + global_k * (1 - winner_expected_global)
     loser_new_global = loser_global + global_k * (0 - (1 - winner_expected_global))
 
-    session["tempGlobalElos"][winner_id] = winner_new_global
-    session["tempGlobalElos"][loser_id] = loser_new_global
+    # Sum the changes per city: a city compared several times keeps every change,
+    # and the buffer applies them as increments (see global_elo.py).
+    deltas = session.setdefault("globalDeltas", {})
+    counts = session.setdefault("globalComparisons", {})
+    deltas[winner_id] = deltas.get(winner_id, 0) + winner_new_global - winner_global
+    deltas[loser_id] = deltas.get(loser_id, 0) + loser_new_global - loser_global
+    counts[winner_id] = counts.get(winner_id, 0) + 1
+    counts[loser_id] = counts.get(loser_id, 0) + 1
+    session.setdefault("comparisons", []).append([winner_id, loser_id])
+
+    session["tempGlobalElos"][winner_id] = winner_global + deltas[winner_id]
+    session["tempGlobalElos"][loser_id] = loser_global + deltas[loser_id]
 
     return {
         "comparisonIncrement": 1
@@ -180,36 +217,68 @@ def calculate_rating_updates(session, winner_id, loser_id):
 
 # Ranking Helper Functions
 
-def get_sorted_ranking(user_id):
+def get_sorted_ranking(user_id, ranking=None):
     '''
-    Function returns user's cities sorted by personal Elo (highest to lowest).
+    Function returns user's cities sorted by personal Elo (highest to lowest),
+    together with their Elos and a copy of all personal Elos.
+    Reads the user's document once and reuses the cached ranking if it is unchanged,
+    so ratings handled by other workers are never missed. `ranking` is a ranking the
+    caller already read fresh (asgi_app.py reads it without blocking).
     '''
-    user_data = get_user_data(user_id)
-    personal_elos = user_data["personalElos"]
-    return sorted(
-        personal_elos.keys(),
-        key=lambda cid: personal_elos[cid],
-        reverse=True
-    )
+    return (ranking or ranking_store.get(user_id, fresh=True)).snapshot()
+
+
+def personal_elo_updates(session, new_city_ids):
+    '''
+    Function that returns only the personal Elos a session changed: the new cities
+    and every city they were compared against.
+    '''
+    personal_elos = session["tempPersonalElos"]
+    changed = set(new_city_ids) | set(session.get("globalComparisons", {}))
+    return {city_id: personal_elos[city_id] for city_id in changed}
+
+
+def store_result(user_id, session, result):
+    '''
+    Function that keeps a finished rating's global Elo changes on the server until
+    /commit-rating, and adds the rating id the app commits them with to the result.
+    '''
+    rating_id = secrets.token_urlsafe(16)
+    session_store.put_result(rating_id, user_id, {
+        "globalDeltas": session.get("globalDeltas", {}),
+        "globalComparisons": session.get("globalComparisons", {}),
+        "comparisons": session.get("comparisons", []),
+        "personalEloUpdates": result["personalEloUpdates"]
+    })
+    result["ratingId"] = rating_id
+    return result
 
 
 def calculate_display_score_from_elos(personal_elos, city_id):
     '''
     Function that converts Elo rating into 0-10 rating score to display.
     '''
-    elo = personal_elos.get(city_id, BASE_ELO)
-    scaled = 10 * (elo - MIN_ELO) / (MAX_ELO - MIN_ELO)
-    return round(max(0, min(10, scaled)), 1)
+    return display_score(personal_elos.get(city_id, BASE_ELO))
 
 # Rating Flow
 
-def start_rating(user_id, city_id, feedback):
+def start_rating(user_id, city_id, feedback, prefetch=False, mode=None, ranking=None):
     '''
     Function to start rating process for a city.
     Creates session and retunrs first comparison if needed.
+    `mode` picks how comparisons are chosen ("binary" or "adaptive", see comparison_strategy.py);
+    large rankings always use binary search.
+    `ranking` is the user's ranking if the caller already read it (see get_sorted_ranking).
     '''
+    mode = mode or RATING_MODE
+    if mode not in MODES:
+        return {
+            "status": "error",
+            "message": f"Unknown rating mode: {mode}"
+        }
+
     cleanup_expired_sessions()
-    ranked = get_sorted_ranking(user_id) # Get user's ranked cities
+    ranked, ranked_elos, personal_elos = get_sorted_ranking(user_id, ranking) # Get user's ranked cities
 
     # If user has never rated any cities
     if not ranked:
@@ -221,17 +290,17 @@ def start_rating(user_id, city_id, feedback):
             city_id
         )
         # Return rating info since no comparisons needed
-        return {
+        return store_result(user_id, {}, {
             "status": "done",
             "personalElos": {city_id: initial_elo},
+            "personalEloUpdates": {city_id: initial_elo},
             "globalElos": {},
             "comparisonIncrement": 0,
             "ratingValue": rating_value
-        }
+        })
 
     # Copy user's personal Elos into temporary working version
-    user_data = get_user_data(user_id)
-    temp_elos = user_data["personalElos"].copy()
+    temp_elos = personal_elos
     # Assigne intial Elo to a new city
     temp_elos[city_id] = INITIAL_ELO_MAP.get(feedback, BASE_ELO)
 
@@ -249,77 +318,255 @@ def start_rating(user_id, city_id, feedback):
         right = len(ranked) - 1
 
     # Creates a new rating session for user
-    _sessions[user_id] = {
+    session = {
         "city_id": city_id,
         "left": left,
         "right": right,
         "ranked": ranked,
         "tempPersonalElos": temp_elos,
         "tempGlobalElos": {},
+        "mode": mode,
+        "rankedElos": ranked_elos,
+        "priorElo": temp_elos[city_id],
+        "lastActivity": time.time()
+    }
+
+    # Adaptive mode can already be sure of the placement before asking anything.
+    if session_settled(session):
+        return store_result(user_id, session, finish_session(session, 0))
+
+    with session_store.lock(user_id):
+        session_store.put(user_id, session)
+
+    return next_comparison(session, prefetch) # Return first comparison
+
+def start_bulk_rating(user_id, cities, prefetch=False, ranking=None):
+    '''
+    Function to start rating many new cities at once.
+    `cities` is a list of {"city_id", "feedback"}. The cities are sorted among
+    themselves and merged into the user's ranking (see bulk_rating.py); every
+    comparison goes through /compare-cities and all Elo updates come back in one
+    final result.
+    '''
+    if not cities or len(cities) > MAX_BULK_CITIES:
+        return {
+            "status": "error",
+            "message": f"Send between 1 and {MAX_BULK_CITIES} cities"
+        }
+
+    # Keep the first feedback given for a city
+    new_cities = []
+    for city in cities:
+        if city["city_id"] not in [cid for cid, _ in new_cities]:
+            new_cities.append([city["city_id"], city.get("feedback", "NEUTRAL")])
+
+    cleanup_expired_sessions()
+    ranked, _, temp_elos = get_sorted_ranking(user_id, ranking)
+
+    # Cities being re-rated are placed again like new ones
+    new_ids = {cid for cid, _ in new_cities}
+    ranked = [cid for cid in ranked if cid not in new_ids]
+    for city_id, feedback in new_cities:
+        temp_elos[city_id] = INITIAL_ELO_MAP.get(feedback, BASE_ELO)
+
+    session = {
+        "kind": BULK,
+        "cities": new_cities,
+        "ranked": ranked,
+        "answers": [],
+        "pending": None,
+        "tempPersonalElos": temp_elos,
+        "tempGlobalElos": {},
         "lastActivity": time.time()
     }
 
-    return next_comparison(user_id) # Return first comparison
+    result = advance_bulk(session)
+    if result is not None:
+        return store_result(user_id, session, result)
+
+    with session_store.lock(user_id):
+        session_store.put(user_id, session)
+
+    return next_comparison(session, prefetch)
+
+def advance_bulk(session):
+    '''
+    Function that replays the bulk placement with the answers so far.
+    Stores the next pair to ask in the session and returns None, or returns the
+    final "done" result once every city is placed.
+    '''
+    try:
+        ranking = plan_bulk_placement(session["ranked"], session["cities"], session["answers"])
+    except NeedComparison as e:
+        session["pending"] = [e.first, e.second]
+        return None
+
+    # Apply all Elo updates in the order the user answered
+    for first, second, winner in session["answers"]:
+        loser = second if winner == first else first
+        calculate_rating_updates(session, winner, loser)
+
+    place_bulk_cities(session, ranking)
+    final_personal_elos = session["tempPersonalElos"]
+    # The ranking returned is the one the written Elos give
+    ranking = sorted(ranking, key=lambda city_id: final_personal_elos[city_id], reverse=True)
+    return {
+        "status": "done",
+        "personalElos": final_personal_elos,
+        "personalEloUpdates": personal_elo_updates(session, [cid for cid, _ in session["cities"]]),
+        "globalElos": session["tempGlobalElos"],
+        "comparisonIncrement": len(session["answers"]),
+        "ratingValues": {
+            city_id: calculate_display_score_from_elos(final_personal_elos, city_id)
+            for city_id, _ in session["cities"]
+        },
+        "ranking": ranking
+    }
 
-def submit_comparison(user_id, preferred):
+def place_bulk_cities(session, merged):
+    '''
+    Function to move each new city's personal Elo between its neighbors in the merged
+    ranking, since the K-factor updates alone can leave it short of the slot the
+    answers put it in. Works from the top down, so new cities next to each other
+    stay in order.
+    '''
+    personal_elos = session["tempPersonalElos"]
+    new_ids = {city_id for city_id, _ in session["cities"]}
+    for i, city_id in enumerate(merged):
+        if city_id not in new_ids:
+            continue
+        upper = personal_elos[merged[i - 1]] if i > 0 else None
+        lower = next((personal_elos[cid] for cid in merged[i + 1:] if cid not in new_ids), None)
+        personal_elos[city_id] = slot_elo(personal_elos[city_id], upper, lower)
+
+def session_probe(session):
+    '''
+    Function that returns the ranking index the session compares against next.
+    '''
+    return choose_probe(
+        session.get("mode", BINARY),
+        session.get("rankedElos"),
+        session["left"],
+        session["right"],
+        session.get("priorElo")
+    )
+
+def session_settled(session):
+    '''
+    Function that returns True once the session needs no more comparisons.
+    '''
+    return is_settled(
+        session.get("mode", BINARY),
+        session.get("rankedElos"),
+        session["left"],
+        session["right"],
+        session.get("priorElo")
+    )
+
+def place_city(session):
+    '''
+    Function to move the new city's personal Elo into the slot an adaptive session
+    placed it in (the most likely one if it stopped early), since the K-factor
+    updates alone can leave it short of that slot. The slot's neighbors are taken
+    at their current Elos, which the comparisons may have moved.
+    '''
+    if session.get("mode") != ADAPTIVE:
+        return
+    ranked = session["ranked"]
+    personal_elos = session["tempPersonalElos"]
+    slot = placed_slot(session["rankedElos"], session["left"], session["right"], session["priorElo"])
+    upper = personal_elos[ranked[slot - 1]] if slot > 0 else None
+    lower = personal_elos[ranked[slot]] if slot < len(ranked) else None
+    city_id = session["city_id"]
+    personal_elos[city_id] = slot_elo(personal_elos[city_id], upper, lower)
+
+def finish_session(session, comparison_increment):
+    '''
+    Function that builds the final "done" result of a session.
+    '''
+    place_city(session)
+    final_personal_elos = session["tempPersonalElos"]
+    final_global_elos = session["tempGlobalElos"]
+
+    rating_value = calculate_display_score_from_elos(
+        final_personal_elos,
+        session["city_id"]
+    )
+
+    return {
+        "status": "done",
+        "personalElos": final_personal_elos,
+        "personalEloUpdates": personal_elo_updates(session, [session["city_id"]]),
+        "globalElos": final_global_elos,
+        "comparisonIncrement": comparison_increment,
+        "ratingValue": rating_value
+    }
+
+def apply_comparison(session, preferred):
+    '''
+    Function to apply one comparison choice to a session and update its Elo ratings.
+    Returns the final "done" result if this was the last comparison, otherwise None.
+    '''
+    if session.get("kind") == BULK:
+        first, second = session["pending"]
+        winner = first if preferred == "new" else second
+        session["answers"].append([first, second, winner])
+        return advance_bulk(session)
+
+    ranked = session["ranked"]
+    new_city = session["city_id"]
+
+    probe = session_probe(session)
+    existing_city = ranked[probe]
+
+    # Determine winner and loser
+    if preferred == "new":
+        winner = new_city
+        loser = existing_city
+        session["right"] = probe - 1
+    else:
+        winner = existing_city
+        loser = new_city
+        session["left"] = probe + 1
+
+    # Update Elo ratings
+    rating_updates = calculate_rating_updates(session, winner, loser)
+
+    # Still comparing
+    if not session_settled(session):
+        return None
+
+    # Finished comparisons
+    return finish_session(session, rating_updates["comparisonIncrement"])
+
+def submit_comparison(user_id, preferred, prefetch=False):
     '''
     Function to handle user comparison choice and update Elo rating.
     '''
     try:
         cleanup_expired_sessions()
-        # Session expired
-        if user_id not in _sessions:
-            return {
-                "status": "error",
-                "message": "Session expired or invalid"
-            }
-        
-        touch_session(user_id)
-        session = _sessions[user_id]
-
-        left = session["left"]
-        right = session["right"]
-        ranked = session["ranked"]
-        new_city = session["city_id"]
-
-        mid = (left + right) // 2
-        existing_city = ranked[mid]
-
-        # Determine winner and loser
-        if preferred == "new":
-            winner = new_city
-            loser = existing_city
-            session["right"] = mid - 1
-        else:
-            winner = existing_city
-            loser = new_city
-            session["left"] = mid + 1
-
-        # Update Elo ratings
-        rating_updates = calculate_rating_updates(session, winner, loser)
-
-        # Finished comparisons
-        if session["left"] > session["right"]:
-            final_personal_elos = session["tempPersonalElos"]
-            final_global_elos = session["tempGlobalElos"]
-
-            rating_value = calculate_display_score_from_elos(
-                final_personal_elos,
-                new_city
-            )
-
-            _sessions.pop(user_id) # Delete session
-
-            return {
-                "status": "done",
-                "personalElos": final_personal_elos,
-                "globalElos": final_global_elos,
-                "comparisonIncrement": rating_updates["comparisonIncrement"],
-                "ratingValue": rating_value
-            }
+
+        # Hold the user's lock so two comparisons can't update the same session at once.
+        with session_store.lock(user_id):
+            session = session_store.get(user_id)
+            # Session expired
+            if session is None:
+                return {
+                    "status": "error",
+                    "message": "Session expired or invalid"
+                }
+
+            result = apply_comparison(session, preferred)
+
+            # Finished comparisons
+            if result is not None:
+                session_store.delete(user_id) # Delete session
+                return store_result(user_id, session, result)
+
+            session_store.put(user_id, session) # Save progress and keep the session active
 
         # Continue comparing
-        return next_comparison(user_id)
+        return next_comparison(session, prefetch)
 
     except Exception as e:
         return {
@@ -327,21 +574,97 @@ def submit_comparison(user_id, preferred):
             "message": str(e)
         }
 
-def next_comparison(user_id):
+def comparison_pair(session):
     '''
-    Returns next comparison pair for user.
+    Returns the comparison pair a session is currently waiting on.
+    In a bulk session both cities can be new ones; "new" still means the first one wins.
     '''
-    touch_session(user_id)
-    session = _sessions[user_id]
-    left = session["left"]
-    right = session["right"]
+    if session.get("kind") == BULK:
+        first, second = session["pending"]
+        return {
+            "status": "compare",
+            "new_city": get_city_info(first),
+            "existing_city": get_city_info(second)
+        }
+
     ranked = session["ranked"]
     new_city = session["city_id"]
-    mid = (left + right) // 2
-    existing_city = ranked[mid]
+    existing_city = ranked[session_probe(session)]
 
     return {
         "status": "compare",
         "new_city": get_city_info(new_city),
         "existing_city": get_city_info(existing_city)
-    }
\ No newline at end of file
+    }
+
+def speculate_next(session):
+    '''
+    Function that precomputes what the user sees next for both answers
+    ("new" wins and "existing" wins) on copies of the session, so the app can
+    show it right away and confirm the real answer with /compare-cities afterwards.
+    '''
+    prefetch = {}
+    for preferred in ("new", "existing"):
+        trial = dict(session)
+        trial["tempPersonalElos"] = dict(session["tempPersonalElos"])
+        trial["tempGlobalElos"] = dict(session["tempGlobalElos"])
+        trial["globalDeltas"] = dict(session.get("globalDeltas", {}))
+        trial["globalComparisons"] = dict(session.get("globalComparisons", {}))
+        trial["comparisons"] = list(session.get("comparisons", []))
+        if "answers" in session:
+            trial["answers"] = list(session["answers"])
+
+        result = apply_comparison(trial, preferred)
+        prefetch[preferred] = result if result is not None else comparison_pair(trial)
+    return prefetch
+
+def next_comparison(session, prefetch=False):
+    '''
+    Returns next comparison pair for a session.
+    With prefetch, also includes the next step for both possible answers.
+    '''
+    response = comparison_pair(session)
+
+    if prefetch:
+        response["prefetch"] = speculate_next(session)
+    return response
+
+def commit_rating(rating_id, user_id):
+    '''
+    Function to apply the global Elo changes of a finished rating once its post is uploaded.
+    The changes are the ones the server stored when the rating finished (see store_result);
+    the app only sends the rating id. A rating is applied once: committing it again
+    (e.g. a retried request) returns "ok" without changing anything.
+    The session's comparisons ([winner_id, loser_id] pairs) are appended to the comparison
+    log, and the personal Elo changes move the user's cities in their cached ranking.
+    '''
+    cleanup_expired_sessions()
+    # Read the ranking first, so an unreachable Firestore fails the commit before anything is applied
+    ranking_store.get(user_id)
+    stored, first = session_store.claim_result(rating_id, user_id)
+    if stored is None:
+        return {
+            "status": "error",
+            "message": "Rating expired or invalid"
+        }
+    deltas = stored["globalDeltas"]
+    counts = stored["globalComparisons"]
+    if not first:
+        return {
+            "status": "ok",
+            "cities": len(deltas),
+            "alreadyCommitted": True
+        }
+
+    global_elo_buffer.add(deltas, counts)
+    comparison_log.append(stored["comparisons"])
+    for city_id, delta in deltas.items():
+        city_catalog.add_global_elo_delta(city_id, delta, counts[city_id])
+
+    if stored["personalEloUpdates"]:
+        ranking_store.commit(user_id, stored["personalEloUpdates"])
+
+    return {
+        "status": "ok",
+        "cities": len(deltas)
+    }
@@ -0,0 +1,320 @@
+"""
+File: replay_elo.py
+Function: Rebuilds global_Elo and comparison_count for every city from the comparison log.
+
+Needed after tuning K_FACTOR or GLOBAL_DAMPING: the comparison log (see
+comparison_log.py) is replayed from the start with the new constants.
+
+The log is streamed in chunks. Each chunk's city IDs are turned into positions
+in one vectorized pass (pd.factorize), comparison counts are a np.bincount, and
+the Elo updates are applied in log order to an array of ratings indexed by city
+position, in a tight loop with no dict lookups or Firestore reads.
+
+Elo updates can't be batched much further without changing the result: every
+update depends on the ratings its two cities got from their previous
+comparisons. Grouping comparisons into "levels" that share no city (so each level
+is one set of NumPy operations) was measured and is slower here: with ~200
+cities a level averages ~27 comparisons, and the NumPy overhead per level
+outweighs the work (2.3s vs 0.9s for 2M comparisons). `--synthetic` checks the
+speed and that the result matches the per-comparison formula.
+
+Usage:
+    python replay_elo.py comparisons.csv [--current current.csv | --from-firestore]
+                         [--initial snapshot.csv] [--k-factor 32] [--global-damping 0.3]
+                         [--output replayed.csv]
+                         [--apply (--metrics http://worker:5003/metrics ... | --servers-stopped)]
+    python replay_elo.py --synthetic 2000000   # timing and exactness check
+
+Log files are CSV (winner_id,loser_id columns, extra columns ignored) or NDJSON
+({"winner_id": ..., "loser_id": ...} per line, for files ending in .ndjson/.jsonl).
+Current/initial snapshots are CSV with city_id,global_Elo,comparison_count.
+
+--apply overwrites global_Elo and comparison_count, so deltas still buffered in a
+server's GlobalEloBuffer would later be added on top of the replayed values (and
+are not in the replay). It refuses unless every worker's /metrics reports no
+pending cities, or --servers-stopped says no server is running (each server
+flushes its buffer when it stops).
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from elo import BASE_ELO, K_FACTOR, GLOBAL_DAMPING, expected_score
+
+CITIES_PATH = "../../Datasets/cities.csv"
+CHUNK_SIZE = 1_000_000
+BATCH_LIMIT = 500   # Most writes Firestore accepts in one batch
+
+
+class CityIndex:
+    '''
+    Class that maps city IDs to array positions, growing for IDs it hasn't seen.
+    '''
+
+    def __init__(self, city_ids=()):
+        self.ids = []
+        self._position = {}
+        for city_id in city_ids:
+            self.position(city_id)
+
+    def position(self, city_id):
+        if city_id not in self._position:
+            self._position[city_id] = len(self.ids)
+            self.ids.append(city_id)
+        return self._position[city_id]
+
+    def positions(self, city_ids):
+        # Factorize once per chunk instead of a dict lookup per row
+        codes, uniques = pd.factorize(np.asarray(city_ids, dtype=object))
+        mapping = np.array([self.position(city_id) for city_id in uniques], dtype=np.int64)
+        return mapping[codes]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def read_log(path, chunk_size=CHUNK_SIZE):
+    '''
+    Function that yields (winner_ids, loser_ids) arrays chunk by chunk.
+    '''
+    if path.endswith((".ndjson", ".jsonl")):
+        chunks = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        chunks = pd.read_csv(path, chunksize=chunk_size, dtype=str, usecols=["winner_id", "loser_id"])
+
+    for chunk in chunks:
+        # Several workers may each have written the CSV header into a shared log
+        chunk = chunk[chunk["winner_id"] != "winner_id"]
+        yield chunk["winner_id"].to_numpy(dtype=object), chunk["loser_id"].to_numpy(dtype=object)
+
+
+def replay_chunk(ratings, counts, winners, losers, global_k):
+    '''
+    Function that applies one chunk of comparisons (as city positions) to the ratings in place.
+    '''
+    values = ratings.tolist()
+    for w, l in zip(winners.tolist(), losers.tolist()):
+        # Same update as rate_cities.calculate_rating_updates for the global Elo
+        rating_w = values[w]
+        rating_l = values[l]
+        delta = global_k * (1 - 1 / (1 + 10 ** ((rating_l - rating_w) / 400)))
+        values[w] = rating_w + delta
+        values[l] = rating_l - delta
+    ratings[:] = values
+
+    counts += np.bincount(winners, minlength=len(counts))
+    counts += np.bincount(losers, minlength=len(counts))
+
+
+def replay(chunks, index, initial=None, global_k=K_FACTOR * GLOBAL_DAMPING):
+    '''
+    Function that replays every chunk and returns (ratings, counts, comparisons) arrays
+    aligned with index.ids. `initial` maps city_id -> (global_Elo, comparison_count).
+    '''
+    ratings = np.full(len(index), float(BASE_ELO))
+    counts = np.zeros(len(index), dtype=np.int64)
+    for city_id, (elo, count) in (initial or {}).items():
+        position = index.position(city_id)
+        if position >= len(ratings):
+            ratings = np.append(ratings, np.full(position + 1 - len(ratings), float(BASE_ELO)))
+            counts = np.append(counts, np.zeros(position + 1 - len(counts), dtype=np.int64))
+        ratings[position] = elo
+        counts[position] = count
+
+    total = 0
+    for winner_ids, loser_ids in chunks:
+        winners = index.positions(winner_ids)
+        losers = index.positions(loser_ids)
+        # Cities first seen in this chunk start at BASE_ELO
+        if len(index) > len(ratings):
+            grow = len(index) - len(ratings)
+            ratings = np.append(ratings, np.full(grow, float(BASE_ELO)))
+            counts = np.append(counts, np.zeros(grow, dtype=np.int64))
+        replay_chunk(ratings, counts, winners, losers, global_k)
+        total += len(winners)
+    return ratings, counts, total
+
+
+def replay_reference(winners, losers, size, global_k):
+    '''
+    Function that replays comparisons with elo.expected_score one at a time, for checking.
+    '''
+    ratings = [float(BASE_ELO)] * size
+    for w, l in zip(winners.tolist(), losers.tolist()):
+        expected_win = expected_score(ratings[w], ratings[l])
+        ratings[w] += global_k * (1 - expected_win)
+        ratings[l] += global_k * (0 - (1 - expected_win))
+    return np.array(ratings)
+
+
+def read_snapshot(path):
+    '''
+    Function that reads city_id,global_Elo,comparison_count into {city_id: (elo, count)}.
+    '''
+    df = pd.read_csv(path, dtype={"city_id": str})
+    return {
+        row.city_id: (float(row.global_Elo), int(row.comparison_count))
+        for row in df.itertuples(index=False)
+    }
+
+
+def read_firestore_snapshot():
+    '''
+    Function that reads the current values of every allCities document.
+    '''
+    from firebase_config import db
+    return {
+        doc.id: (
+            float(doc.to_dict().get("global_Elo", BASE_ELO)),
+            int(doc.to_dict().get("comparison_count", 0))
+        )
+        for doc in db.collection("allCities").stream()
+    }
+
+
+def build_report(index, ratings, counts, current):
+    '''
+    Function that returns a DataFrame of the replayed values next to the current ones.
+    '''
+    report = pd.DataFrame({
+        "city_id": index.ids,
+        "global_Elo": np.round(ratings, 4),
+        "comparison_count": counts
+    })
+    if current:
+        # Cities missing from the snapshot have the defaults the rating flow assumes
+        report["current_global_Elo"] = [current.get(c, (BASE_ELO, 0))[0] for c in index.ids]
+        report["current_comparison_count"] = [current.get(c, (BASE_ELO, 0))[1] for c in index.ids]
+        report["elo_diff"] = np.round(report["global_Elo"] - report["current_global_Elo"], 4)
+        report["count_diff"] = report["comparison_count"] - report["current_comparison_count"]
+    return report
+
+
+def read_buffer_stats(url):
+    '''
+    Function that returns the GlobalEloBuffer stats in a worker's /metrics.
+    '''
+    import json
+    from urllib.request import urlopen
+    with urlopen(url, timeout=10) as response:
+        return json.load(response)["globalElo"]
+
+
+def check_drained(buffer_stats):
+    '''
+    Function that raises RuntimeError unless every GlobalEloBuffer's stats show no pending cities.
+    '''
+    pending = sum(stats["pendingCities"] for stats in buffer_stats)
+    if pending:
+        raise RuntimeError(f"{pending} cities still have buffered global Elo deltas; wait for the buffers to flush")
+
+
+def apply_to_firestore(report, buffer_stats=None, servers_stopped=False):
+    '''
+    Function that writes the replayed values to allCities in batches.
+    Refuses (RuntimeError) unless `buffer_stats` (GlobalEloBuffer.stats() of every live
+    worker) shows the buffers drained, or `servers_stopped` says no server is running.
+    '''
+    if not servers_stopped:
+        if not buffer_stats:
+            raise RuntimeError("Pass the stats of every worker's Elo buffer, or stop the servers first")
+        check_drained(buffer_stats)
+
+    from firebase_config import db
+    rows = list(report.itertuples(index=False))
+    collection = db.collection("allCities")
+    for i in range(0, len(rows), BATCH_LIMIT):
+        batch = db.batch()
+        for row in rows[i:i + BATCH_LIMIT]:
+            batch.set(collection.document(row.city_id), {
+                "global_Elo": float(row.global_Elo),
+                "comparison_count": int(row.comparison_count)
+            }, merge=True)
+        batch.commit()
+    print(f"Wrote {len(rows)} cities to allCities")
+
+
+def run_synthetic(n, global_k, seed=42):
+    '''
+    Function that writes n random comparisons among the cities in cities.csv to a
+    temporary log, times the streamed replay, and checks it against the
+    one-by-one elo.expected_score replay on the first 200k comparisons.
+    '''
+    import os
+    import tempfile
+
+    city_ids = pd.read_csv(CITIES_PATH, usecols=["city_id"])["city_id"].tolist()
+    rng = np.random.default_rng(seed)
+    winners = rng.integers(len(city_ids), size=n)
+    losers = (winners + rng.integers(1, len(city_ids), size=n)) % len(city_ids)
+    names = np.array(city_ids, dtype=object)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "comparisons.csv")
+        pd.DataFrame({"winner_id": names[winners], "loser_id": names[losers]}).to_csv(path, index=False)
+
+        start = time.perf_counter()
+        ratings, counts, total = replay(read_log(path), CityIndex(city_ids), global_k=global_k)
+        elapsed = time.perf_counter() - start
+    print(f"Replayed {total:,} comparisons over {len(city_ids)} cities in {elapsed:.2f}s (including parsing)")
+
+    check = min(n, 200_000)
+    replayed, _, _ = replay([(names[winners[:check]], names[losers[:check]])], CityIndex(city_ids), global_k=global_k)
+    reference = replay_reference(winners[:check], losers[:check], len(city_ids), global_k)
+    print(f"Max difference from the reference replay on {check:,} comparisons: {np.abs(replayed - reference).max():.2e} Elo")
+    assert counts.sum() == 2 * n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", nargs="?", help="Comparison log (CSV or NDJSON)")
+    parser.add_argument("--current", help="CSV snapshot of current values to diff against")
+    parser.add_argument("--from-firestore", action="store_true", help="Diff against allCities in Firestore")
+    parser.add_argument("--initial", help="CSV snapshot to start from instead of BASE_ELO (for a partial log)")
+    parser.add_argument("--k-factor", type=float, default=K_FACTOR)
+    parser.add_argument("--global-damping", type=float, default=GLOBAL_DAMPING)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--output", default="replayed_elos.csv")
+    parser.add_argument("--apply", action="store_true", help="Write the replayed values to allCities")
+    parser.add_argument("--metrics", action="append", default=[],
+                        help="/metrics URL of a running worker, whose Elo buffer must be empty (repeat for each)")
+    parser.add_argument("--servers-stopped", action="store_true", help="No server is running (for --apply)")
+    parser.add_argument("--synthetic", type=int, help="Time a replay of this many random comparisons")
+    args = parser.parse_args()
+
+    global_k = args.k_factor * args.global_damping
+    if args.synthetic:
+        run_synthetic(args.synthetic, global_k)
+        return
+    if not args.log:
+        parser.error("a comparison log is required")
+    if args.apply and not (args.metrics or args.servers_stopped):
+        parser.error("--apply needs --metrics for every running worker, or --servers-stopped")
+
+    # Every known city is in the output, even if it never appears in the log
+    index = CityIndex(pd.read_csv(CITIES_PATH, usecols=["city_id"])["city_id"])
+    initial = read_snapshot(args.initial) if args.initial else None
+    current = read_firestore_snapshot() if args.from_firestore else (
+        read_snapshot(args.current) if args.current else None
+    )
+
+    start = time.perf_counter()
+    ratings, counts, total = replay(read_log(args.log, args.chunk_size), index, initial, global_k)
+    print(f"Replayed {total:,} comparisons in {time.perf_counter() - start:.2f}s (global K = {global_k:g})")
+
+    report = build_report(index, ratings, counts, current)
+    report.to_csv(args.output, index=False)
+    print(f"Wrote {len(report)} cities to {args.output}")
+    if current:
+        changed = report[report["elo_diff"].abs() > 1e-6]
+        print(f"{len(changed)} cities change; largest moves:")
+        print(changed.reindex(changed["elo_diff"].abs().sort_values(ascending=False).index).head(10).to_string(index=False))
+
+    if args.apply:
+        # Checked after the replay, right before writing
+        apply_to_firestore(report, [read_buffer_stats(url) for url in args.metrics], args.servers_stopped)
+
+
+if __name__ == "__main__":
+    main()
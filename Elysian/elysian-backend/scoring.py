@@ -0,0 +1,149 @@
+"""
+File: scoring.py
+Function: Scores every city for a user with a few matrix-vector products.
+
+The dynamic score for a city is
+    ALPHA * (city . user) + BETA * mean cosine to liked - GAMMA * mean cosine to disliked.
+The mean cosine between a city and a group of cities is the same as the dot
+product of the normalized city with the mean of the normalized group, so we keep
+a row-normalized copy of the city vectors (built once at startup) and the group
+terms become one matrix-vector product each instead of a Python loop over every
+city and every swipe.
+
+The score is also one dot product: with the city's raw and normalized vectors
+side by side (ann_vectors) and the query [ALPHA * user, BETA * liked - GAMMA * disliked]
+(query_vector), which lets ann_index.py search large catalogs for candidates
+that scores_at then scores exactly.
+"""
+
+import numpy as np
+
+
+class ScoringEngine:
+    '''
+    Class that holds the city vectors and their row-normalized copy and
+    computes the ALPHA/BETA/GAMMA dynamic scores for all cities at once.
+    '''
+
+    def __init__(self, city_vectors, alpha=1.0, beta=0.7, gamma=0.7, normed=None):
+        self.city_vectors = city_vectors
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+
+        # A precomputed copy (e.g. memory-mapped from artifact_bundle.py) is used as is.
+        if normed is not None:
+            self.normed = normed
+            return
+
+        # Normalize every row once. Zero rows stay zero so their cosine is 0 like before.
+        norms = np.linalg.norm(city_vectors, axis=1, keepdims=True)
+        self.normed = np.divide(
+            city_vectors,
+            norms,
+            out=np.zeros_like(city_vectors),
+            where=norms > 0
+        )
+
+    def group_mean(self, group_idx):
+        '''
+        Function that returns the mean of the normalized vectors of a group of cities.
+        Returns None for an empty group.
+        '''
+        if not group_idx:
+            return None
+        return self.normed[group_idx].mean(axis=0)
+
+    def group_similarity(self, group_mean):
+        '''
+        Function that returns the mean cosine similarity of every city to a group,
+        given the group's normalized mean (0 for an empty group).
+        '''
+        if group_mean is None:
+            return 0.0
+        return self.normed @ group_mean
+
+    def scores_from_means(self, user_vec, liked_mean, disliked_mean):
+        '''
+        Function that computes the dynamic scores from already aggregated
+        liked and disliked normalized means.
+        '''
+        base_scores = self.city_vectors @ user_vec
+        return (
+            self.alpha * base_scores +
+            self.beta * self.group_similarity(liked_mean) -
+            self.gamma * self.group_similarity(disliked_mean)
+        )
+
+    def query_vector(self, user_vec, liked_mean, disliked_mean):
+        '''
+        Function that returns the query whose dot product with ann_vectors() gives
+        the same dynamic scores as scores_from_means.
+        '''
+        group = np.zeros(self.normed.shape[1], dtype=np.float32)
+        if liked_mean is not None:
+            group += self.beta * liked_mean
+        if disliked_mean is not None:
+            group -= self.gamma * disliked_mean
+        return np.concatenate([self.alpha * np.asarray(user_vec, dtype=np.float32), group])
+
+    def scores_at(self, idx, user_vec, liked_mean, disliked_mean):
+        '''
+        Function that computes the exact dynamic scores of the cities in idx only.
+        '''
+        scores = self.alpha * (self.city_vectors[idx] @ user_vec)
+        if liked_mean is not None:
+            scores = scores + self.beta * (self.normed[idx] @ liked_mean)
+        if disliked_mean is not None:
+            scores = scores - self.gamma * (self.normed[idx] @ disliked_mean)
+        return scores
+
+    def base_scores_batch(self, user_matrix):
+        '''
+        Function that scores many users against every city with one matrix multiply.
+        Returns an array of shape (num_users, num_cities).
+        '''
+        return user_matrix @ self.city_vectors.T
+
+    def scores(self, user_vec, liked_idx, disliked_idx):
+        '''
+        Function that returns the dynamic score of every city for the user vector
+        and the indices of the liked and disliked cities.
+        '''
+        return self.scores_from_means(
+            user_vec,
+            self.group_mean(liked_idx),
+            self.group_mean(disliked_idx)
+        )
+
+
+def ann_vectors(city_vectors, normed):
+    '''
+    Function that returns the vectors indexed by ann_index.py: every city's raw and
+    normalized vector side by side (see ScoringEngine.query_vector).
+    '''
+    return np.hstack([city_vectors, normed]).astype(np.float32)
+
+
+def top_k(scores, k, exclude_idx=()):
+    '''
+    Function that returns the indices of the k highest scores, best first,
+    skipping the excluded (already swiped) indices. Uses argpartition so only
+    the k winners get sorted instead of the whole catalog.
+    '''
+    scores = np.array(scores, dtype=np.float64)
+    if len(exclude_idx):
+        scores[list(exclude_idx)] = -np.inf
+
+    available = int(np.count_nonzero(scores > -np.inf))
+    k = min(k, available)
+    if k <= 0:
+        return []
+
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    # Sort only the k winners, highest score first.
+    order = np.argsort(-scores[candidates], kind="stable")
+    return [int(i) for i in candidates[order]]
@@ -0,0 +1,255 @@
+"""
+File: session_store.py
+Function: Storage for rating sessions between /rate-city and /compare-cities calls.
+
+Two backends share one interface (get / put / delete / cleanup / lock, plus
+put_result / claim_result for finished ratings):
+- MemorySessionStore keeps sessions in a dict, for a single worker process.
+- SQLiteSessionStore keeps sessions in a local SQLite file in WAL mode, so every
+  gunicorn worker on the machine sees the same sessions and a comparison can land
+  on any worker.
+
+Expiry never scans every session: the memory store keeps a heap ordered by
+expiry time and the SQLite store has an index on expires_at, so cleanup only
+touches the sessions that actually expired. lock(user_id) serializes the
+read-modify-write of one user's session (across processes for SQLite).
+
+A finished rating's global Elo changes are kept by rating id (put_result) until
+the app commits them with /commit-rating. claim_result hands them out once: the
+first claim marks the rating committed, and later claims (a retried POST) see
+that it already was, so the changes are never applied twice.
+"""
+
+import fcntl
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Number of lock stripes for per-user locking (users hash onto a stripe)
+LOCK_STRIPES = 64
+
+
+class MemorySessionStore:
+    '''
+    Class that keeps sessions in process memory with heap-based expiry.
+    '''
+
+    def __init__(self, timeout, result_timeout=None):
+        self.timeout = timeout
+        self.result_timeout = result_timeout or timeout
+        self._sessions = {}
+        self._expiry_heap = []   # (expires_at, user_id); stale entries are skipped on cleanup
+        self._results = {}   # rating_id -> {"user_id", "result", "expiresAt", "committed"}
+        self._result_heap = []   # (expires_at, rating_id)
+        self._lock = threading.Lock()
+        self._user_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get(self, user_id):
+        '''
+        Function that returns the user's session, or None if there is none or it expired.
+        '''
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or time.time() - session["lastActivity"] > self.timeout:
+                return None
+            return session
+
+    def put(self, user_id, session):
+        '''
+        Function that saves a session and marks it as active now.
+        '''
+        now = time.time()
+        session["lastActivity"] = now
+        with self._lock:
+            self._sessions[user_id] = session
+            heapq.heappush(self._expiry_heap, (now + self.timeout, user_id))
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def cleanup(self):
+        '''
+        Function to remove expired sessions and finished ratings. Pops heap entries until
+        the earliest one is still in the future, so the cost is O(expired entries).
+        '''
+        now = time.time()
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, user_id = heapq.heappop(self._expiry_heap)
+                session = self._sessions.get(user_id)
+                # A session touched since this entry was pushed has a newer entry in the heap.
+                if session is not None and now - session["lastActivity"] > self.timeout:
+                    self._sessions.pop(user_id)
+            while self._result_heap and self._result_heap[0][0] <= now:
+                _, rating_id = heapq.heappop(self._result_heap)
+                self._results.pop(rating_id, None)
+
+    def put_result(self, rating_id, user_id, result):
+        '''
+        Function that keeps a finished rating's result until it is claimed or expires.
+        '''
+        expires_at = time.time() + self.result_timeout
+        with self._lock:
+            self._results[rating_id] = {"user_id": user_id, "result": result, "expiresAt": expires_at, "committed": False}
+            heapq.heappush(self._result_heap, (expires_at, rating_id))
+
+    def claim_result(self, rating_id, user_id):
+        '''
+        Function that returns (result, first) for the user's finished rating. `first` is
+        True only for the first claim. Returns (None, False) for an unknown or expired
+        rating id, or one that belongs to another user.
+        '''
+        with self._lock:
+            entry = self._results.get(rating_id)
+            if entry is None or entry["user_id"] != user_id or entry["expiresAt"] <= time.time():
+                return None, False
+            first = not entry["committed"]
+            entry["committed"] = True
+            return entry["result"], first
+
+    @contextmanager
+    def lock(self, user_id):
+        '''
+        Context manager that holds the user's lock for a read-modify-write of their session.
+        '''
+        with self._user_locks[zlib.crc32(user_id.encode()) % LOCK_STRIPES]:
+            yield
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    '''
+    Class that keeps sessions as JSON rows in a SQLite database in WAL mode,
+    shared by every worker process on the machine.
+    '''
+
+    def __init__(self, timeout, path, result_timeout=None):
+        self.timeout = timeout
+        self.result_timeout = result_timeout or timeout
+        self.path = path
+        self._local = threading.local()
+        self._lock_dir = path + ".locks"
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rating_results ("
+            "rating_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, data TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, committed_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS rating_results_expires_at ON rating_results (expires_at)")
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, user_id, session):
+        now = time.time()
+        session["lastActivity"] = now
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, data, expires_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(session), now + self.timeout)
+        )
+        conn.commit()
+
+    def delete(self, user_id):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+    def cleanup(self):
+        '''
+        Function to remove expired sessions and finished ratings (index range deletes, O(expired rows)).
+        '''
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM rating_results WHERE expires_at <= ?", (now,))
+        conn.commit()
+
+    def put_result(self, rating_id, user_id, result):
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO rating_results (rating_id, user_id, data, expires_at) VALUES (?, ?, ?, ?)",
+            (rating_id, user_id, json.dumps(result), time.time() + self.result_timeout)
+        )
+        conn.commit()
+
+    def claim_result(self, rating_id, user_id):
+        '''
+        Function for MemorySessionStore.claim_result. Marking the row committed is one
+        conditional UPDATE, so only one worker's claim is the first.
+        '''
+        now = time.time()
+        conn = self._conn()
+        first = conn.execute(
+            "UPDATE rating_results SET committed_at = ? "
+            "WHERE rating_id = ? AND user_id = ? AND expires_at > ? AND committed_at IS NULL",
+            (now, rating_id, user_id, now)
+        ).rowcount == 1
+        conn.commit()
+        row = conn.execute(
+            "SELECT data FROM rating_results WHERE rating_id = ? AND user_id = ? AND expires_at > ?",
+            (rating_id, user_id, now)
+        ).fetchone()
+        if row is None:
+            return None, False
+        return json.loads(row[0]), first
+
+    @contextmanager
+    def lock(self, user_id):
+        '''
+        Context manager that holds the user's lock across processes (a striped file lock)
+        and across threads of this process.
+        '''
+        stripe = zlib.crc32(user_id.encode()) % LOCK_STRIPES
+        with self._thread_locks[stripe]:
+            with open(os.path.join(self._lock_dir, f"{stripe}.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(kind, timeout, path, result_timeout=None):
+    '''
+    Function that builds the session store named by `kind` ("memory" or "sqlite").
+    '''
+    if kind == "memory":
+        return MemorySessionStore(timeout, result_timeout)
+    if kind == "sqlite":
+        return SQLiteSessionStore(timeout, path, result_timeout)
+    raise ValueError(f"Unknown session store: {kind}")
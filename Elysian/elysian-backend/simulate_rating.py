@@ -0,0 +1,92 @@
+"""
+File: simulate_rating.py
+Function: Simulates rating sessions to compare binary and adaptive comparison selection.
+
+For users with different numbers of rated cities, this script draws a personal
+ranking, a feedback level and a "true" Elo for the new city around the feedback's
+initial Elo, then answers comparisons from the true Elo (with optional answer
+noise). It reports the average number of comparisons (= round trips) per mode and
+how far the final placement is from the true one. The placement is the slot the
+server puts the city in (comparison_strategy.placed_slot).
+
+Usage:
+    python simulate_rating.py [--sessions 2000] [--noise 0]
+"""
+
+import argparse
+import numpy as np
+from elo import INITIAL_ELO_MAP
+from comparison_strategy import (
+    BINARY,
+    ADAPTIVE,
+    PRIOR_SIGMA,
+    choose_probe,
+    is_settled,
+    placed_slot
+)
+
+RANKING_SIZES = [5, 20, 50, 200, 1000]
+
+
+def initial_bounds(feedback, n):
+    # Same starting range as rate_cities.start_rating
+    if feedback == "LIKE":
+        return 0, n // 2
+    if feedback == "DISLIKE":
+        return n // 2, n - 1
+    return 0, n - 1
+
+
+def simulate_session(mode, ranked_elos, feedback, true_elo, noise, rng):
+    '''
+    Function that runs one session and returns (comparisons, placement error in slots).
+    '''
+    prior_elo = INITIAL_ELO_MAP[feedback]
+    left, right = initial_bounds(feedback, len(ranked_elos))
+
+    comparisons = 0
+    while not is_settled(mode, ranked_elos, left, right, prior_elo):
+        probe = choose_probe(mode, ranked_elos, left, right, prior_elo)
+        new_wins = true_elo + noise * rng.normal() > ranked_elos[probe]
+        if new_wins:
+            right = probe - 1
+        else:
+            left = probe + 1
+        comparisons += 1
+
+    placed = placed_slot(ranked_elos, left, right, prior_elo)
+    true_slot = int(np.sum(np.array(ranked_elos) > true_elo))
+    return comparisons, abs(placed - true_slot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000, help="Sessions per ranking size")
+    parser.add_argument("--noise", type=float, default=0.0, help="Std dev (Elo) of noise in the user's answers")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    feedbacks = list(INITIAL_ELO_MAP)
+
+    print(f"{'rated':>6} {'binary cmp':>11} {'adaptive cmp':>13} {'saved':>7} {'binary err':>11} {'adaptive err':>13}")
+    for n in RANKING_SIZES:
+        results = {BINARY: [], ADAPTIVE: []}
+        for _ in range(args.sessions):
+            ranked_elos = sorted(rng.normal(1000, 90, size=n).clip(700, 1300).tolist(), reverse=True)
+            feedback = feedbacks[rng.integers(len(feedbacks))]
+            true_elo = rng.normal(INITIAL_ELO_MAP[feedback], PRIOR_SIGMA)
+            for mode in results:
+                results[mode].append(simulate_session(mode, ranked_elos, feedback, true_elo, args.noise, rng))
+
+        binary = np.array(results[BINARY])
+        adaptive = np.array(results[ADAPTIVE])
+        saved = 1 - adaptive[:, 0].mean() / binary[:, 0].mean()
+        print(
+            f"{n:>6} {binary[:, 0].mean():>11.2f} {adaptive[:, 0].mean():>13.2f} {saved:>6.0%} "
+            f"{binary[:, 1].mean():>11.2f} {adaptive[:, 1].mean():>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
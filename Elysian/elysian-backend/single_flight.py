@@ -0,0 +1,230 @@
+"""
+File: single_flight.py
+Function: Coalesces concurrent calls for the same key into one call.
+
+When several requests need the same missing value at once (e.g. the image for
+a popular city), only the first one calls upstream; the others wait for it and
+get the same result (or the same exception). AsyncSingleFlight does the same
+for coroutines on one event loop (asgi_app.py); there the call runs as its own
+task, so cancelling the request that started it doesn't cancel it for the others.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.items = []
+        self._changed = threading.Condition()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def publish(self, item):
+        '''
+        Function for the running call to hand out a partial result (e.g. one streamed activity).
+        '''
+        with self._changed:
+            self.items.append(item)
+            self._changed.notify_all()
+
+    def stream(self):
+        '''
+        Generator of the published items, from the first one, until the call is done.
+        Then call wait() for the result (or the error). The lock is not held while
+        the caller handles an item, so a slow reader only slows itself down.
+        '''
+        sent = 0
+        while True:
+            with self._changed:
+                while sent == len(self.items) and not self.done.is_set():
+                    self._changed.wait()
+                new_items = self.items[sent:]
+                finished = self.done.is_set()
+            for item in new_items:
+                yield item
+            sent += len(new_items)
+            if finished:
+                return
+
+    def _set(self, result, error):
+        with self._changed:
+            self.result = result
+            self.error = error
+            self.done.set()
+            self._changed.notify_all()
+
+
+class SingleFlight:
+    '''
+    Class that runs at most one fn() per key at a time and shares its result with waiters.
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def join(self, key):
+        '''
+        Function that returns (call, leader). The leader must compute the value and
+        pass it to finish(); other callers wait with call.wait().
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        return call, leader
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call._set(result, error)
+
+    def do(self, key, fn):
+        '''
+        Function that returns fn()'s result, running it only if no call for key is in flight.
+        '''
+        call, leader = self.join(key)
+        if not leader:
+            return call.wait()
+        return self._lead(key, call, fn)
+
+    def start(self, key, fn):
+        '''
+        Function that returns (call, leader) like join(), but runs the leader's fn(call)
+        on its own thread, so every caller (the leader included) can read call.stream()
+        at its own pace while the call goes on.
+        '''
+        call, leader = self.join(key)
+        if leader:
+            threading.Thread(target=self._lead_quietly, args=(key, call, lambda: fn(call)), daemon=True).start()
+        return call, leader
+
+    def _lead_quietly(self, key, call, fn):
+        try:
+            self._lead(key, call, fn)
+        except BaseException:
+            pass   # The error went to the callers through call.wait()
+
+    def _lead(self, key, call, fn):
+        result = error = None
+        try:
+            result = fn()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            # Waiters get an ordinary error, not the leader's interrupt
+            error = RuntimeError(f"Call for {key!r} was interrupted")
+            raise
+        finally:
+            # Always runs, so waiters are never left blocked on the key
+            self.finish(key, call, result=result, error=error)
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared}
+
+
+class _AsyncCall:
+    '''
+    Class for one in-flight async call: the task that computes the value, plus the
+    items it published so far for callers that stream them (see publish()).
+    '''
+
+    def __init__(self):
+        self.task = None
+        self.items = []
+        self._changed = asyncio.Event()
+
+    def publish(self, item):
+        '''
+        Function for the running call to hand out a partial result (e.g. one streamed activity).
+        '''
+        self.items.append(item)
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        # shield() so a cancelled caller (even the one that started the call) doesn't
+        # cancel the call for everyone else
+        return await asyncio.shield(self.task)
+
+    async def stream(self):
+        '''
+        Async generator of the published items, from the first one, until the call is done.
+        Then await wait() for the result (or the error).
+        '''
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.items):
+                yield self.items[sent]
+                sent += 1
+            if self.task.done():
+                return
+            await changed.wait()
+
+
+class AsyncSingleFlight:
+    '''
+    Class for the asyncio version of SingleFlight: at most one fn() per key at a time
+    on one event loop, shared with every coroutine that asks for the same key meanwhile.
+    The call runs as its own task, so it finishes (and its waiters get the result)
+    even if the request that started it is cancelled.
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def join(self, key, fn):
+        '''
+        Function that returns (call, leader). If no call for key is in flight, fn(call)
+        is started as a task (leader is True). Callers await call.wait() or read call.stream().
+        '''
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            return call, False
+        self.calls += 1
+        call = self._calls[key] = _AsyncCall()
+        call.task = asyncio.get_running_loop().create_task(fn(call))
+        call.task.add_done_callback(lambda task: self._finish(key, call))
+        return call, True
+
+    def _finish(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # Mark the exception as retrieved in case nobody else was waiting
+            call.task.exception()
+        call._notify()
+
+    async def do(self, key, fn):
+        '''
+        Function that returns await fn()'s result, running it only if no call for key is in flight.
+        '''
+        call, _ = self.join(key, lambda call: fn())
+        return await call.wait()
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared}
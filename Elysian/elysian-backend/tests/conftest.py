@@ -0,0 +1,173 @@
+"""
+Shared fixtures for the backend tests.
+
+Tests run from any directory: the backend directory is put on sys.path, and
+backend_file() builds paths to the model artifacts next to the modules.
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+# The city list the legacy bundle is built from (see artifact_bundle.CITIES_PATH)
+CITIES_CSV = os.path.join("..", "..", "Datasets", "cities.csv")
+
+
+def backend_file(name):
+    return os.path.join(BACKEND_DIR, name)
+
+
+@pytest.fixture(autouse=True)
+def firestore_upstream(monkeypatch):
+    '''
+    Fixture that gives every test its own Firestore breaker, so failures one test
+    injects can't leave the circuit open for the next.
+    '''
+    import upstream
+    guard = upstream.Upstream("firestore", timeout=5, max_concurrent=64)
+    monkeypatch.setattr(upstream, "firestore", guard)
+    return guard
+
+
+@pytest.fixture
+def local_firestore():
+    from local_firestore import LocalFirestore
+    return LocalFirestore()
+
+
+CITY_IDS = [f"c{i:03d}" for i in range(12)]
+
+
+@pytest.fixture
+def rating(monkeypatch, tmp_path):
+    '''
+    Fixture that returns (rate_cities, client): the rating flow over a LocalFirestore
+    with 12 cities and a user "u1" who rated the first 8, with fresh stores per test.
+    '''
+    from local_firestore import LocalFirestore
+    client = LocalFirestore({
+        "allCities": {
+            city_id: {"city_name": city_id, "country_name": "X", "global_Elo": 1000.0, "comparison_count": 0}
+            for city_id in CITY_IDS
+        },
+        "userPosts": {
+            "u1": {"personalElos": {city_id: 1200.0 - 50 * i for i, city_id in enumerate(CITY_IDS[:8])}}
+        }
+    })
+    monkeypatch.setitem(sys.modules, "firebase_config", type(sys)("firebase_config"))
+    sys.modules["firebase_config"].db = client
+    sys.modules["firebase_config"].async_db = None
+
+    import rate_cities
+    from city_catalog import CityCatalog
+    from comparison_log import ComparisonLog
+    from global_elo import GlobalEloBuffer
+    from personal_ranking import RankingStore
+    from session_store import MemorySessionStore
+
+    catalog = CityCatalog(client, listen=False)
+    monkeypatch.setattr(rate_cities, "session_store", MemorySessionStore(300, 3600))
+    monkeypatch.setattr(rate_cities, "city_catalog", catalog)
+    monkeypatch.setattr(rate_cities, "global_elo_buffer", GlobalEloBuffer(client, has_global_elo=catalog.has_global_elo))
+    monkeypatch.setattr(rate_cities, "ranking_store", RankingStore(client))
+    monkeypatch.setattr(rate_cities, "comparison_log", ComparisonLog(str(tmp_path / "comparisons.csv")))
+    return rate_cities, client
+
+
+def run_rating(rate_cities, user_id, city_id, feedback="NEUTRAL", prefer="new"):
+    '''
+    Function that rates a city, answering every comparison with `prefer`. Returns the final result.
+    '''
+    result = rate_cities.start_rating(user_id, city_id, feedback)
+    while result["status"] == "compare":
+        result = rate_cities.submit_comparison(user_id, prefer)
+    assert result["status"] == "done", result
+    return result
+
+
+class FakeUserEncoder:
+    '''
+    Class with the tf.lite.Interpreter calls InterpreterPool makes, standing in for
+    user_encoder.tflite: inputs multi-hot (index 0), origin (1) and favorite (2), and
+    a fixed random projection of them as the embedding (index 3).
+    '''
+
+    def __init__(self, multi_hot_size, dim, seed=0):
+        self.shapes = {0: [1, multi_hot_size], 1: [1, 1], 2: [1, 1]}
+        self.weights = np.random.default_rng(seed).normal(size=(multi_hot_size + 2, dim)).astype(np.float32)
+        self.tensors = {}
+
+    def get_input_details(self):
+        return [{"index": index, "shape": np.array(shape)} for index, shape in self.shapes.items()]
+
+    def get_output_details(self):
+        return [{"index": 3}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shapes[index] = list(shape)
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        assert list(value.shape) == self.shapes[index]
+        self.tensors[index] = value
+
+    def invoke(self):
+        inputs = np.concatenate([self.tensors[0], self.tensors[1] / 100, self.tensors[2] / 100], axis=1)
+        self.tensors[3] = np.tanh(inputs @ self.weights)
+
+    def get_tensor(self, index):
+        return self.tensors[index]
+
+
+def city_ids():
+    return pd.read_csv(backend_file(CITIES_CSV))["city_id"].tolist()
+
+
+@pytest.fixture
+def backend_app(monkeypatch, tmp_path):
+    '''
+    Fixture that imports a fresh app.py (and with it the modules that hold app state) over a
+    LocalFirestore, with the TFLite model and Gemini stubbed out, so no TensorFlow or
+    Gemini SDK is needed. Returns (app, client); user "u1" has rated the first 3 cities.
+    '''
+    import joblib
+    from local_firestore import LocalFirestore
+    import activities_service
+    import interpreter_pool
+
+    ids = city_ids()
+    client = LocalFirestore({
+        "allCities": {
+            city_id: {"city_name": city_id, "country_name": "X", "global_Elo": 1000.0 + i, "comparison_count": 0}
+            for i, city_id in enumerate(ids)
+        },
+        "userPosts": {"u1": {"personalElos": {city_id: 1100.0 - 50 * i for i, city_id in enumerate(ids[:3])}}}
+    })
+    monkeypatch.setitem(sys.modules, "firebase_config", type(sys)("firebase_config"))
+    sys.modules["firebase_config"].db = client
+    sys.modules["firebase_config"].async_db = client.async_client()
+
+    mlbs = joblib.load(backend_file("mlbs.pkl"))
+    multi_hot_size = sum(len(mlbs[feature].classes_) for feature in ("vacation_types", "seasons", "budget", "place_type"))
+    dim = np.load(backend_file("city_vectors.npy"), mmap_mode="r").shape[1]
+    monkeypatch.setattr(interpreter_pool, "load_interpreter", lambda path, num_threads: FakeUserEncoder(multi_hot_size, dim))
+    monkeypatch.setattr(activities_service, "configure", lambda: None)
+    monkeypatch.setenv("PREWARM", "0")
+    monkeypatch.chdir(BACKEND_DIR)
+
+    # Import app, asgi_app and rate_cities again so they pick up the stubs; the modules
+    # other tests imported are put back afterwards.
+    for name in ("app", "asgi_app", "rate_cities"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    import app
+    yield app, client
+    app.rate_cities.global_elo_buffer.stop()
+    app.rate_cities.city_catalog.stop()
@@ -0,0 +1,125 @@
+"""
+Activities are cached in memory and on disk, and while Gemini is failing the last
+cached list is served. Only Gemini and parse errors fall back to it.
+"""
+
+import asyncio
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import activities_service
+import upstream
+from disk_cache import DiskCache
+from single_flight import AsyncSingleFlight, SingleFlight
+from ttl_cache import LRUTTLCache
+
+PARIS = [{"name": "Louvre", "category": "arts"}]
+OLD_PARIS = [{"name": "Old list", "category": "outdoor"}]
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(activities_service, "disk_cache", DiskCache(str(tmp_path / "activities.db")))
+    monkeypatch.setattr(activities_service, "memory_cache", LRUTTLCache(ttl=activities_service.ACTIVITY_CACHE_TTL))
+    monkeypatch.setattr(activities_service, "in_flight", SingleFlight())
+    monkeypatch.setattr(activities_service, "async_in_flight", AsyncSingleFlight())
+    monkeypatch.setattr(upstream, "gemini", upstream.Upstream("gemini", timeout=5, max_concurrent=8, failure_threshold=100))
+    calls = []
+
+    def use(result):
+        # Every Gemini call returns (or raises) `result`
+        def generate(city, country, timeout=None):
+            calls.append((city, country))
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        async def generate_async(city, country, timeout=None):
+            return generate(city, country, timeout)
+
+        monkeypatch.setattr(activities_service, "generate_activities", generate)
+        monkeypatch.setattr(activities_service, "generate_activities_async", generate_async)
+        return calls
+    return use
+
+
+def expire(city, country, activities):
+    # A cached list that has already expired (kept until cleanup)
+    activities_service.disk_cache.set(activities_service.cache_key(city, country), activities, -1)
+
+
+def test_miss_generates_once_and_is_cached_in_both_levels(service):
+    calls = service(PARIS)
+    assert activities_service.get_activities("Paris", "France") == PARIS
+    assert activities_service.get_activities("  paris ", "FRANCE") == PARIS
+    assert calls == [("Paris", "France")]
+
+    # Another worker finds it on disk
+    activities_service.memory_cache.clear()
+    assert activities_service.get_activities("Paris", "France") == PARIS
+    assert len(calls) == 1
+
+
+def test_cache_key_changes_with_the_prompt_version(monkeypatch):
+    key = activities_service.cache_key("Paris", "France")
+    assert activities_service.cache_key(" paris", "france ") == key
+    monkeypatch.setattr(activities_service, "PROMPT_VERSION", "next")
+    assert activities_service.cache_key("Paris", "France") != key
+
+
+def test_expired_list_is_regenerated(service):
+    calls = service(PARIS)
+    expire("Paris", "France", OLD_PARIS)
+    assert activities_service.get_activities("Paris", "France") == PARIS
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ServiceUnavailable("down"),
+    google_exceptions.DeadlineExceeded("slow"),
+    upstream.CircuitOpen("gemini circuit open"),
+    json.JSONDecodeError("bad reply", "{", 0),
+])
+def test_gemini_failure_serves_the_expired_list(service, error):
+    service(error)
+    expire("Paris", "France", OLD_PARIS)
+    assert activities_service.get_activities("Paris", "France") == OLD_PARIS
+    assert upstream.gemini.stats()["fallbacks"] == 1
+
+
+def test_gemini_failure_without_a_cached_list_raises(service):
+    service(google_exceptions.ServiceUnavailable("down"))
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        activities_service.get_activities("Paris", "France")
+
+
+@pytest.mark.parametrize("error", [KeyError("activities"), TypeError("bug"), RuntimeError("bug")])
+def test_other_errors_are_not_hidden_by_the_stale_list(service, error):
+    service(error)
+    expire("Paris", "France", OLD_PARIS)
+    with pytest.raises(type(error)):
+        activities_service.get_activities("Paris", "France")
+    assert upstream.gemini.stats()["fallbacks"] == 0
+
+
+def test_async_version_shares_the_caches_and_the_fallback(service):
+    calls = service(PARIS)
+    assert asyncio.run(activities_service.get_activities_async("Paris", "France")) == PARIS
+    assert activities_service.get_activities("Paris", "France") == PARIS
+    assert len(calls) == 1
+
+    service(google_exceptions.ServiceUnavailable("down"))
+    expire("Rome", "Italy", OLD_PARIS)
+    assert asyncio.run(activities_service.get_activities_async("Rome", "Italy")) == OLD_PARIS
+
+    service(TypeError("bug"))
+    expire("Oslo", "Norway", OLD_PARIS)
+    with pytest.raises(TypeError):
+        asyncio.run(activities_service.get_activities_async("Oslo", "Norway"))
+
+
+def test_parse_activities_caps_the_list():
+    reply = json.dumps({"activities": [{"name": str(i)} for i in range(40)]})
+    assert len(activities_service.parse_activities(reply)) == activities_service.MAX_ACTIVITIES
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from activity_stream import ActivityStreamParser
+
+
+ACTIVITIES = [
+    {"name": "Louvre", "category": "arts", "description": "Art {and} more"},
+    {"name": "Say \"hi\" at the \\ café", "category": "restaurants", "tags": ["a]", "{b"]},
+    {"name": "Seine cruise", "category": "outdoor", "stops": [{"at": "Pont Neuf"}]},
+]
+REPLY = json.dumps({"city": "Paris", "activities": ACTIVITIES, "note": "{\"activities\": []}"})
+
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def test_whole_reply_returns_every_activity():
+    parser = ActivityStreamParser()
+    assert parser.feed(REPLY) == ACTIVITIES
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_chunks_split_mid_object_give_the_same_activities(size):
+    parser = ActivityStreamParser()
+    chunks = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+    assert feed_all(parser, chunks) == ACTIVITIES
+    assert json.loads(parser.text) == json.loads(REPLY)
+
+
+def test_each_activity_is_returned_once_its_closing_brace_arrives():
+    parser = ActivityStreamParser()
+    first_end = REPLY.index("}, {") + 1
+    assert parser.feed(REPLY[:first_end - 1]) == []
+    assert parser.feed(REPLY[first_end - 1:first_end]) == [ACTIVITIES[0]]
+
+
+def test_escaped_quotes_and_braces_inside_strings_are_ignored():
+    reply = json.dumps({"activities": [{"name": "a \"} { [ ] \\\" \\", "x": "}"}, {"name": "b"}]})
+    parser = ActivityStreamParser()
+    items = feed_all(parser, list(reply))
+    assert items == [{"name": "a \"} { [ ] \\\" \\", "x": "}"}, {"name": "b"}]
+
+
+def test_objects_outside_the_activities_array_are_not_returned():
+    reply = json.dumps({"meta": {"activities": "no"}, "other": [{"name": "x"}], "activities": [{"name": "y"}]})
+    assert ActivityStreamParser().feed(reply) == [{"name": "y"}]
+
+
+def test_truncated_reply_returns_only_complete_activities():
+    cut = REPLY.index("Seine") + 3
+    parser = ActivityStreamParser()
+    assert feed_all(parser, [REPLY[:40], REPLY[40:cut]]) == ACTIVITIES[:2]
+    # The full-text parse that builds the cached list fails, so the stream ends with an error
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(parser.text)
+
+
+def test_limit_caps_the_returned_activities():
+    parser = ActivityStreamParser(limit=2)
+    assert parser.feed(REPLY) == ACTIVITIES[:2]
+    assert parser.count == 2
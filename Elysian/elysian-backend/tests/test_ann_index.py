@@ -0,0 +1,65 @@
+"""
+The IVF index must return exact results when every list is probed, and good
+recall (as measured by bench_ann.py) with a few lists.
+"""
+
+import numpy as np
+import pytest
+from ann_index import IVFIndex, load_index
+from bench_ann import ann_top_k, random_queries, synthetic_catalog
+from scoring import ScoringEngine, ann_vectors, top_k
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(3)
+    cities = rng.normal(size=(30, 8)).astype(np.float32)
+    vectors = synthetic_catalog(cities, 2000, rng)
+    engine = ScoringEngine(vectors)
+    index = IVFIndex.build(ann_vectors(vectors, engine.normed), nlist=40)
+    return engine, index, random_queries(engine, rng)[:50]
+
+
+def brute_force(engine, query, k):
+    user_vec, liked_mean, disliked_mean, seen_idx = query
+    return top_k(engine.scores_from_means(user_vec, liked_mean, disliked_mean), k, seen_idx)
+
+
+def test_lists_cover_every_row_once(catalog):
+    _, index, _ = catalog
+    assert sorted(index.ids.tolist()) == list(range(2000))
+    assert index.offsets[0] == 0 and index.offsets[-1] == len(index)
+
+
+def test_probing_every_list_is_exact(catalog):
+    engine, index, queries = catalog
+    for query in queries:
+        assert ann_top_k(engine, index, query, 10, index.nlist, 100) == brute_force(engine, query, 10)
+
+
+def test_recall_with_few_lists(catalog):
+    engine, index, queries = catalog
+    recall = np.mean([
+        len(set(ann_top_k(engine, index, q, 10, 8, 100)) & set(brute_force(engine, q, 10))) / 10
+        for q in queries
+    ])
+    assert recall > 0.8
+
+
+def test_search_excludes_rows(catalog):
+    engine, index, queries = catalog
+    user_vec, liked_mean, disliked_mean, _ = queries[0]
+    query = engine.query_vector(user_vec, liked_mean, disliked_mean)
+    best = index.search(query, k=5, nprobe=index.nlist)
+    again = index.search(query, k=5, nprobe=index.nlist, exclude=best[:2])
+    assert not set(best[:2]) & set(again)
+    assert again[0] == best[2]
+
+
+def test_save_and_load(catalog, tmp_path):
+    _, index, _ = catalog
+    index.save(str(tmp_path / "ann"))
+    loaded = load_index(str(tmp_path / "ann"))
+    assert loaded.nlist == index.nlist
+    assert np.array_equal(loaded.ids, index.ids)
+    assert load_index(str(tmp_path / "missing")) is None
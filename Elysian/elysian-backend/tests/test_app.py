@@ -0,0 +1,134 @@
+"""
+Smoke test of the Flask routes in app.py, with Firestore, the TFLite model and
+Gemini stubbed out (see the backend_app fixture).
+"""
+
+import json
+
+import pytest
+from conftest import city_ids
+
+PROFILE = {
+    "user_id": "u1",
+    "origin_country": "Argentina",
+    "favorite_country_visited": "Brazil",
+    "vacation_types": ["Beach", "City"],
+    "seasons": ["Summer"],
+    "budget": ["Mid-Range"],
+    "place_type": ["Quiet"]
+}
+
+
+@pytest.fixture
+def client(backend_app):
+    app, _ = backend_app
+    return app.app.test_client()
+
+
+def test_home_and_metrics(client):
+    assert client.get("/").status_code == 200
+    metrics = client.get("/metrics").get_json()
+    assert metrics["interpreterPool"]["size"] > 0
+
+
+def test_next_city_skips_swiped_cities(client):
+    first = client.post("/next_city", json=PROFILE).get_json()["city"]
+    assert first["city_id"] in city_ids()
+
+    assert client.post("/swipe", json={"user_id": "u1", "city_id": first["city_id"], "action": "like"}).get_json() == {"ok": True}
+    second = client.post("/next_city", json=PROFILE).get_json()["city"]
+    assert second["city_id"] != first["city_id"]
+
+
+def test_recent_swipes_are_checked(client):
+    liked = client.post("/next_city", json=PROFILE).get_json()["city"]["city_id"]
+    recent = [{"city_id": liked, "action": "like"}]
+    assert client.post("/next_city", json=dict(PROFILE, recent_swipes=recent)).get_json()["city"]["city_id"] != liked
+
+    for bad in ([{"city_id": liked}], [liked], {"city_id": liked, "action": "like"}):
+        response = client.post("/next_city", json=dict(PROFILE, recent_swipes=bad))
+        assert response.status_code == 400
+    assert client.post("/next_cities", json=dict(PROFILE, recent_swipes=[{"action": "like"}])).status_code == 400
+
+
+def test_next_cities_pages_with_the_cursor(client):
+    first = client.post("/next_cities", json=dict(PROFILE, k=3, rerank_after=6)).get_json()
+    assert len(first["cities"]) == 3
+    more = client.post("/next_cities", json=dict(PROFILE, k=3, cursor=first["cursor"])).get_json()
+    assert more["cursor"] == first["cursor"]
+    ids = [city["city_id"] for city in first["cities"] + more["cities"]]
+    assert len(set(ids)) == 6
+
+    bad = client.post("/next_cities", json=dict(PROFILE, k="many"))
+    assert bad.status_code == 400
+
+
+def test_embed_batch(client):
+    response = client.post("/embed/batch", json={"profiles": [PROFILE, dict(PROFILE, seasons=["Winter"])], "top_k": 2})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert len(body["embeddings"]) == 2
+    assert [len(cities) for cities in body["cities"]] == [2, 2]
+
+
+@pytest.mark.parametrize("body", [
+    {"profiles": [PROFILE], "top_k": "three"},
+    {"profiles": [PROFILE], "top_k": None},
+    {"profiles": [PROFILE], "top_k": [2]},
+    {"profiles": "not a list"},
+    {"top_k": 2},
+    {"profiles": [PROFILE] * 257},
+    {"profiles": [{"user_id": "u1"}]},
+])
+def test_embed_batch_rejects_bad_input(client, body):
+    response = client.post("/embed/batch", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_embed_batch_clamps_top_k(client):
+    body = client.post("/embed/batch", json={"profiles": [PROFILE], "top_k": -4}).get_json()
+    assert "cities" not in body
+    body = client.post("/embed/batch", json={"profiles": [PROFILE], "top_k": "100000"}).get_json()
+    assert len(body["cities"][0]) == 50
+    assert client.post("/embed/batch", json={"profiles": []}).get_json() == {"embeddings": []}
+
+
+def test_rating_flow(client, backend_app):
+    app, _ = backend_app
+    new_city = app.city_state.bundle.city(5)["city_id"]
+    result = client.post("/rate-city", json={"user_id": "u1", "city_id": new_city, "feedback": "LIKE"}).get_json()
+    while result["status"] == "compare":
+        result = client.post("/compare-cities", json={"user_id": "u1", "preferred": "new"}).get_json()
+    assert result["status"] == "done"
+
+    assert client.post("/commit-rating", json={"user_id": "u1"}).status_code == 400
+    committed = client.post("/commit-rating", json={"user_id": "u1", "rating_id": result["ratingId"]})
+    assert committed.status_code == 200
+
+    leaderboard = client.get("/leaderboard?limit=5").get_json()
+    assert len(leaderboard["cities"]) == 5
+
+
+@pytest.mark.parametrize("path", ["/api/activities", "/api/activities/stream"])
+def test_activities_need_city_and_country(client, path):
+    assert client.post(path, json={"city": "Paris"}).status_code == 400
+    assert client.post(path, json=None).status_code in (400, 415)
+
+
+def test_activities_stream_sends_ndjson(client, backend_app, monkeypatch):
+    app, _ = backend_app
+    activities = [{"name": "Louvre", "category": "arts"}]
+
+    def stream(city, country):
+        yield {"activity": activities[0]}
+        yield {"ok": True, "activities": activities}
+
+    monkeypatch.setattr(app.activities_service, "stream_activities", stream)
+    monkeypatch.setattr(app.activities_service, "get_activities", lambda city, country: activities)
+
+    response = client.post("/api/activities/stream", json={"city": "Paris", "country": "France"})
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"activity": activities[0]}, {"ok": True, "activities": activities}]
+    assert client.post("/api/activities", json={"city": "Paris", "country": "France"}).get_json() == lines[-1]
@@ -0,0 +1,122 @@
+"""
+A written bundle opens memory-mapped with the same arrays, a damaged one fails
+verification, and BundleWatcher switches to a newly activated version.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from artifact_bundle import (ArtifactBundle, BundleWatcher, CURRENT_FILE, activate, current_version,
+                             verify_bundle, write_bundle)
+
+
+def make_bundle(num_cities=20, dim=4, seed=0):
+    rng = np.random.default_rng(seed)
+    # Ids out of order, so the index has to sort them
+    city_ids = [f"c{i:03d}" for i in rng.permutation(num_cities)]
+    cities_df = pd.DataFrame({
+        "city_id": city_ids,
+        "city_name": [f"City {city_id}" for city_id in city_ids],
+        "country": ["X"] * num_cities,
+        "continent": ["Europe", "Asia"] * (num_cities // 2)
+    })
+    vectors = rng.normal(size=(num_cities, dim)).astype(np.float32)
+    vectors[0] = 0   # A zero row stays zero when normalized
+    return ArtifactBundle.from_frames(vectors, cities_df)
+
+
+def test_city_index_finds_every_row():
+    bundle = make_bundle()
+    assert len(bundle.index) == len(bundle)
+    for row, city_id in enumerate(bundle.cities["city_id"]):
+        assert city_id in bundle.index
+        assert bundle.index[str(city_id)] == row
+    assert "c999" not in bundle.index and "" not in bundle.index
+    with pytest.raises(KeyError):
+        bundle.index["c999"]
+    assert list(bundle.index) == sorted(bundle.cities["city_id"].tolist())
+    assert bundle.index.get("c999") is None
+
+
+def test_written_bundle_opens_memory_mapped(tmp_path):
+    bundle = make_bundle()
+    version = write_bundle(bundle, str(tmp_path), "v1")
+    assert version == "v1"
+    assert sorted(os.listdir(tmp_path)) == ["v1"]
+
+    opened = ArtifactBundle.open(str(tmp_path / "v1"))
+    assert opened.version == "v1" and opened.manifest["numCities"] == 20
+    assert isinstance(opened.vectors, np.memmap)
+    np.testing.assert_array_equal(opened.vectors, bundle.vectors)
+    np.testing.assert_array_equal(opened.normed, bundle.normed)
+    assert not opened.normed[0].any()
+    np.testing.assert_allclose(np.linalg.norm(opened.normed[1:], axis=1), 1, rtol=1e-5)
+    assert opened.city(3) == bundle.city(3)
+    assert dict(opened.index) == dict(bundle.index)
+    assert opened.continent_of() == bundle.continent_of()
+
+    with pytest.raises(FileExistsError):
+        write_bundle(bundle, str(tmp_path), "v1")
+
+
+def test_verify_rejects_a_changed_file(tmp_path):
+    write_bundle(make_bundle(), str(tmp_path), "v1")
+    path = str(tmp_path / "v1")
+    assert verify_bundle(path)["version"] == "v1"
+
+    np.save(os.path.join(path, "vectors.npy"), np.zeros((20, 4), dtype=np.float32))
+    with pytest.raises(ValueError):
+        verify_bundle(path)
+    with pytest.raises(ValueError):
+        activate("v1", str(tmp_path))
+    assert current_version(str(tmp_path)) is None
+
+
+def test_watcher_switches_to_the_activated_version(tmp_path):
+    root = str(tmp_path)
+    write_bundle(make_bundle(seed=0), root, "v1")
+    activate("v1", root)
+    assert current_version(root) == "v1"
+    assert sorted(os.listdir(tmp_path)) == [CURRENT_FILE, "v1"]
+
+    watcher = BundleWatcher(root, check_interval=0)
+    assert watcher.bundle.version == "v1"
+    assert watcher.check() is None
+
+    second = make_bundle(num_cities=30, seed=1)
+    write_bundle(second, root, "v2")
+    # Written but not active yet
+    assert watcher.check() is None
+
+    activate("v2", root)
+    bundle = watcher.check()
+    assert bundle is watcher.bundle and bundle.version == "v2"
+    np.testing.assert_array_equal(bundle.vectors, second.vectors)
+    assert watcher.check() is None
+    assert watcher.stats()["swaps"] == 1 and watcher.stats()["numCities"] == 30
+
+
+def test_watcher_keeps_its_bundle_when_the_new_one_cannot_open(tmp_path):
+    root = str(tmp_path)
+    write_bundle(make_bundle(), root, "v1")
+    activate("v1", root)
+    watcher = BundleWatcher(root, check_interval=0)
+
+    # CURRENT names a version that isn't there
+    with open(os.path.join(root, CURRENT_FILE), "w") as f:
+        f.write("v2\n")
+    assert watcher.check() is None
+    assert watcher.bundle.version == "v1" and watcher.swaps == 0
+
+
+def test_watcher_waits_for_its_check_interval(tmp_path):
+    root = str(tmp_path)
+    write_bundle(make_bundle(), root, "v1")
+    activate("v1", root)
+    watcher = BundleWatcher(root, check_interval=3600)
+
+    write_bundle(make_bundle(seed=1), root, "v2")
+    activate("v2", root)
+    assert watcher.check() is None
+    assert watcher.bundle.version == "v1"
@@ -0,0 +1,80 @@
+"""
+Smoke test of the async routes in asgi_app.py, with Firestore, the TFLite model and
+Gemini stubbed out (see the backend_app fixture). The lifespan runs, so CPU work goes
+through the real thread pool.
+"""
+
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import city_ids
+from test_app import PROFILE
+
+
+@pytest.fixture
+def client(backend_app):
+    import asgi_app
+    with TestClient(asgi_app.app) as client:
+        yield client
+
+
+def test_home_and_metrics(client):
+    assert client.get("/").status_code == 200
+    assert client.get("/metrics").json()["interpreterPool"]["size"] > 0
+
+
+def test_next_city_skips_swiped_cities(client):
+    first = client.post("/next_city", json=PROFILE).json()["city"]
+    assert first["city_id"] in city_ids()
+
+    swipe = {"user_id": "u1", "city_id": first["city_id"], "action": "dislike", "write": True}
+    assert client.post("/swipe", json=swipe).json() == {"ok": True}
+    second = client.post("/next_city", json=PROFILE).json()["city"]
+    assert second["city_id"] != first["city_id"]
+
+
+def test_next_cities_and_embed_batch(client):
+    first = client.post("/next_cities", json=dict(PROFILE, k=2, rerank_after=4)).json()
+    more = client.post("/next_cities", json=dict(PROFILE, k=2, cursor=first["cursor"])).json()
+    assert len({city["city_id"] for city in first["cities"] + more["cities"]}) == 4
+    assert client.post("/next_cities", json=dict(PROFILE, rerank_after=[])).status_code == 400
+
+    body = client.post("/embed/batch", json={"profiles": [PROFILE] * 3, "top_k": 1}).json()
+    assert len(body["embeddings"]) == 3
+    assert body["cities"][0] == body["cities"][2]
+    assert client.post("/embed/batch", json={"profiles": [PROFILE], "top_k": "one"}).status_code == 400
+    assert client.post("/embed/batch", json={"profiles": [{}]}).status_code == 400
+
+
+def test_rating_flow(client, backend_app):
+    app, _ = backend_app
+    new_city = app.city_state.bundle.city(6)["city_id"]
+    result = client.post("/rate-city", json={"user_id": "u1", "city_id": new_city, "feedback": "DISLIKE"}).json()
+    while result["status"] == "compare":
+        result = client.post("/compare-cities", json={"user_id": "u1", "preferred": "existing"}).json()
+    assert result["status"] == "done"
+    assert client.post("/commit-rating", json={"user_id": "u1", "rating_id": result["ratingId"]}).status_code == 200
+    assert client.get("/leaderboard", params={"city_id": new_city}).json()["city"]["city_id"] == new_city
+
+
+def test_activities(client, backend_app, monkeypatch):
+    app, _ = backend_app
+    activities = [{"name": "Louvre", "category": "arts"}]
+
+    async def get(city, country):
+        return activities
+
+    async def stream(city, country):
+        yield {"activity": activities[0]}
+        yield {"ok": True, "activities": activities}
+
+    monkeypatch.setattr(app.activities_service, "get_activities_async", get)
+    monkeypatch.setattr(app.activities_service, "stream_activities_async", stream)
+
+    for path in ("/api/activities", "/api/activities/stream"):
+        assert client.post(path, json={"country": "France"}).status_code == 400
+    assert client.post("/api/activities", json={"city": "Paris", "country": "France"}).json() == {"ok": True, "activities": activities}
+    response = client.post("/api/activities/stream", json={"city": "Paris", "country": "France"})
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"activity": activities[0]}, {"ok": True, "activities": activities}]
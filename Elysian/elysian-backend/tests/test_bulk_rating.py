@@ -0,0 +1,72 @@
+"""
+Bulk rating sorts the new cities within their feedback groups, merges them into
+the ranking with few comparisons, and writes Elos that give the returned ranking.
+"""
+
+import math
+import random
+import pytest
+from bulk_rating import NeedComparison, plan_bulk_placement
+
+
+def run_plan(ranked, new_cities, true_elo):
+    # Answers every comparison from true_elo; returns (merged ranking, comparisons asked)
+    answers = []
+    while True:
+        try:
+            return plan_bulk_placement(ranked, new_cities, answers), len(answers)
+        except NeedComparison as e:
+            winner = e.first if true_elo[e.first] > true_elo[e.second] else e.second
+            answers.append([e.first, e.second, winner])
+
+
+@pytest.mark.parametrize("n, k", [(40, 5), (200, 20), (200, 50)])
+def test_comparisons_stay_near_the_minimum(n, k):
+    rng = random.Random(n + k)
+    ranked = [f"r{i}" for i in range(n)]
+    true_elo = {city_id: 1300 - i * (600 / n) for i, city_id in enumerate(ranked)}
+    new_cities = []
+    for i in range(k):
+        true_elo[f"n{i}"] = rng.uniform(700, 1300)
+        new_cities.append([f"n{i}", "NEUTRAL"])
+
+    merged, asked = run_plan(ranked, new_cities, true_elo)
+    assert merged == sorted(merged, key=lambda city_id: true_elo[city_id], reverse=True)
+    # Fewest comparisons that can tell apart every way of placing k cities among n
+    minimum = sum(math.log2(n + i) for i in range(1, k + 1))
+    assert asked <= 1.1 * minimum
+
+
+def test_feedback_groups_are_kept_in_order():
+    ranked = ["r0", "r1", "r2", "r3"]
+    true_elo = {"r0": 1200, "r1": 1100, "r2": 1000, "r3": 900, "liked": 800, "neutral": 1250}
+    merged, _ = run_plan(ranked, [["liked", "LIKE"], ["neutral", "NEUTRAL"]], true_elo)
+    # The LIKE city stays in the upper half and above the NEUTRAL one, even though the user prefers everything to it
+    assert merged.index("liked") <= 3
+    assert merged.index("liked") < merged.index("neutral")
+
+
+def test_bulk_rating_writes_elos_that_give_the_ranking(rating):
+    rate_cities, _ = rating
+    # u1 ranked c000..c007 at 1200, 1150, ..., 850
+    true_elo = {f"c{i:03d}": 1200.0 - 50 * i for i in range(8)}
+    true_elo.update({"c008": 1120.0, "c009": 1010.0, "c010": 1005.0, "c011": 870.0})
+    cities = [{"city_id": city_id, "feedback": "NEUTRAL"} for city_id in ("c008", "c009", "c010", "c011")]
+
+    result = rate_cities.start_bulk_rating("u1", cities)
+    asked = 0
+    while result["status"] == "compare":
+        first, second = result["new_city"]["id"], result["existing_city"]["id"]
+        result = rate_cities.submit_comparison("u1", "new" if true_elo[first] > true_elo[second] else "existing")
+        asked += 1
+
+    assert result["status"] == "done"
+    assert result["comparisonIncrement"] == asked
+    expected = sorted(true_elo, key=lambda city_id: true_elo[city_id], reverse=True)
+    assert result["ranking"] == expected
+
+    # The written Elos give the same order, and every new city's Elo is written
+    elos = result["personalElos"]
+    assert sorted(elos, key=lambda city_id: elos[city_id], reverse=True) == expected
+    for city_id in ("c008", "c009", "c010", "c011"):
+        assert result["personalEloUpdates"][city_id] == elos[city_id]
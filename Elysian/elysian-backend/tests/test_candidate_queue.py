@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from candidate_queue import MAX_NEXT_CITIES, RERANK_AFTER, CursorStore, next_cities_params
+
+
+QUEUE = [(i, 1.0 - i / 100) for i in range(30)]
+
+
+def test_cursor_pages_through_the_queue_until_rerank_after():
+    store = CursorStore()
+    token = store.create("u1", QUEUE, rerank_after=12, served=5)
+    assert store.take(token, "u1", 5) == QUEUE[5:10]
+    assert store.take(token, "u1", 5) == QUEUE[10:12]
+    # rerank_after reached: the cursor is dropped so the next call ranks again
+    assert store.take(token, "u1", 5) is None
+    assert store.take(token, "u1", 5) is None
+
+
+def test_cursor_stops_when_the_queue_runs_out():
+    store = CursorStore()
+    token = store.create("u1", QUEUE[:8], rerank_after=20, served=5)
+    assert store.take(token, "u1", 5) == QUEUE[5:8]
+    assert store.take(token, "u1", 5) is None
+
+
+def test_cursor_belongs_to_one_user_and_bundle_version():
+    store = CursorStore()
+    token = store.create("u1", QUEUE, rerank_after=20, served=0, version="v1")
+    assert store.take(token, "u2", 5, version="v1") is None
+    assert store.take(token, "u1", 5, version="v1") == QUEUE[:5]
+    assert store.take(token, "u1", 5, version="v2") is None
+    # A version mismatch drops the cursor
+    assert store.take(token, "u1", 5, version="v1") is None
+
+
+def test_unknown_cursor_falls_back_to_reranking():
+    # e.g. a cursor created by another worker
+    assert CursorStore().take("not-a-cursor", "u1", 5) is None
+
+
+def test_unused_cursor_expires_after_the_ttl():
+    store = CursorStore(ttl=0.1)
+    token = store.create("u1", QUEUE, rerank_after=20, served=0)
+    assert store.take(token, "u1", 2) == QUEUE[:2]
+    time.sleep(0.15)
+    assert store.take(token, "u1", 2) is None
+
+
+def test_using_a_cursor_keeps_it_alive():
+    store = CursorStore(ttl=0.2)
+    token = store.create("u1", QUEUE, rerank_after=30, served=0)
+    for start in range(0, 6, 2):
+        time.sleep(0.12)
+        assert store.take(token, "u1", 2) == QUEUE[start:start + 2]
+
+
+def test_expired_cursors_are_cleaned_up():
+    store = CursorStore(ttl=0.1)
+    old = [store.create("u1", QUEUE, rerank_after=20, served=0) for _ in range(3)]
+    time.sleep(0.15)
+    fresh = store.create("u1", QUEUE, rerank_after=20, served=0)
+    assert list(store._cursors) == [fresh]
+    assert all(store.take(token, "u1", 1) is None for token in old)
+
+
+def test_discard_and_clear():
+    store = CursorStore()
+    a = store.create("u1", QUEUE, rerank_after=20, served=0)
+    b = store.create("u2", QUEUE, rerank_after=20, served=0)
+    store.discard(a)
+    assert store.take(a, "u1", 1) is None
+    store.clear()
+    assert store.take(b, "u2", 1) is None
+
+
+@pytest.mark.parametrize("data, expected", [
+    ({}, (10, max(10, RERANK_AFTER))),
+    ({"k": 3, "rerank_after": 20}, (3, 20)),
+    ({"k": "4", "rerank_after": "8"}, (4, 8)),
+    ({"k": 0}, (1, max(1, RERANK_AFTER))),
+    ({"k": -5, "rerank_after": 0}, (1, 1)),
+    ({"k": 1000, "rerank_after": 5}, (MAX_NEXT_CITIES, MAX_NEXT_CITIES)),
+    ({"k": 8, "rerank_after": 2}, (8, 8)),
+])
+def test_next_cities_params_are_clamped(data, expected):
+    assert next_cities_params(data) == expected
+
+
+@pytest.mark.parametrize("data", [{"k": "ten"}, {"k": None}, {"rerank_after": "x"}, {"k": [1]}])
+def test_next_cities_params_rejects_non_integers(data):
+    with pytest.raises(ValueError):
+        next_cities_params(data)
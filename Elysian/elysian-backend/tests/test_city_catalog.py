@@ -0,0 +1,134 @@
+"""
+The city catalog is loaded in one read, kept fresh by a snapshot listener (or a TTL),
+patched by the backend's own global Elo changes, and tells its listeners about every
+change without holding its lock.
+"""
+
+import threading
+
+import pytest
+
+import upstream
+from city_catalog import CityCatalog
+from elo import BASE_ELO
+from local_firestore import LocalFirestore
+
+
+@pytest.fixture
+def client():
+    return LocalFirestore({"allCities": {
+        "paris": {"city_name": "Paris", "country_name": "France", "global_Elo": 1100.0, "comparison_count": 4},
+        "rome": {"city_name": "Rome", "country_name": "Italy"},
+    }})
+
+
+def test_whole_catalog_is_loaded_in_one_read(client, firestore_upstream):
+    catalog = CityCatalog(client, listen=False)
+    assert catalog.get("paris")["globalElo"] == 1100.0
+    assert catalog.get("rome") == {
+        "city_name": "Rome", "country_name": "Italy", "globalElo": BASE_ELO,
+        "comparisonCount": 0, "hasGlobalElo": False
+    }
+    assert firestore_upstream.stats()["calls"] == 1
+    assert catalog.has_global_elo("paris") and not catalog.has_global_elo("rome")
+
+
+def test_entries_are_copies(client):
+    catalog = CityCatalog(client, listen=False)
+    catalog.get("paris")["globalElo"] = 0
+    assert catalog.get("paris")["globalElo"] == 1100.0
+
+
+def test_missing_city_is_read_once_and_cached(client, firestore_upstream):
+    catalog = CityCatalog(client, listen=False)
+    catalog.load()
+    client.collection("allCities").document("oslo").set({"city_name": "Oslo", "global_Elo": 990.0})
+    assert catalog.get("oslo")["globalElo"] == 990.0
+    assert catalog.get("oslo")["globalElo"] == 990.0
+    assert firestore_upstream.stats()["calls"] == 2
+    with pytest.raises(ValueError):
+        catalog.get("atlantis")
+
+
+def test_reads_go_through_the_firestore_breaker(client, firestore_upstream):
+    catalog = CityCatalog(client, listen=False)
+    firestore_upstream.state = upstream.OPEN
+    firestore_upstream._opened_at = float("inf")
+    with pytest.raises(upstream.CircuitOpen):
+        catalog.get("paris")
+
+
+def test_ttl_reload_without_a_listener(client):
+    catalog = CityCatalog(client, ttl=0, listen=False)
+    catalog.get("paris")
+    client.collection("allCities").document("paris").set({"global_Elo": 1200.0}, merge=True)
+    assert catalog.get("paris")["globalElo"] == 1200.0
+
+
+def test_snapshot_listener_keeps_the_catalog_fresh(client):
+    catalog = CityCatalog(client, ttl=0, listen=True)
+    seen = []
+    catalog.add_listener(lambda changes, full: seen.append((changes, full)))
+    catalog.start()
+    assert seen[0][1] is True and set(seen[0][0]) == {"paris", "rome"}
+
+    client.collection("allCities").document("rome").set({"global_Elo": 1050.0}, merge=True)
+    client.collection("allCities").document("paris").delete()
+    assert catalog.get("rome")["globalElo"] == 1050.0
+    assert seen[-2][0]["rome"]["globalElo"] == 1050.0
+    assert seen[-1] == ({"paris": None}, False)
+    assert len(catalog) == 1
+
+    catalog.stop()
+    client.collection("allCities").document("rome").set({"global_Elo": 1.0}, merge=True)
+    assert len(seen) == 4
+
+
+def test_backend_changes_patch_the_cache(client):
+    catalog = CityCatalog(client, listen=False)
+    seen = []
+    catalog.add_listener(lambda changes, full: seen.append(changes))
+    catalog.load()
+    catalog.add_global_elo_delta("paris", 10.0, comparison_increment=2)
+    catalog.patch_global_elo("rome", 980.0, comparison_increment=1)
+    catalog.add_global_elo_delta("atlantis", 5.0)
+    assert catalog.get("paris")["globalElo"] == 1110.0
+    assert catalog.get("paris")["comparisonCount"] == 6
+    assert catalog.get("rome")["globalElo"] == 980.0
+    assert seen[1:] == [{"paris": catalog.get("paris")}, {"rome": catalog.get("rome")}]
+
+
+def test_listeners_run_without_the_catalog_lock(client):
+    catalog = CityCatalog(client, listen=False)
+    catalog.load()
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_listener(changes, full):
+        # A listener may read the catalog, and a slow one doesn't block other readers
+        assert catalog.get("rome")["city_name"] == "Rome"
+        entered.set()
+        release.wait(5)
+
+    catalog.add_listener(slow_listener)
+    writer = threading.Thread(target=catalog.add_global_elo_delta, args=("paris", 1.0))
+    writer.start()
+    assert entered.wait(5)
+    assert catalog.get("paris")["globalElo"] == 1101.0
+    assert catalog.has_global_elo("paris")
+    release.set()
+    writer.join()
+
+
+def test_listeners_see_changes_in_order(client):
+    catalog = CityCatalog(client, listen=False)
+    catalog.load()
+    seen = []
+    catalog.add_listener(lambda changes, full: seen.append(changes["paris"]["globalElo"]))
+
+    threads = [threading.Thread(target=catalog.add_global_elo_delta, args=("paris", 1.0)) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == [1100.0 + i for i in range(1, 21)]
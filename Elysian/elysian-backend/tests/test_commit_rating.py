@@ -0,0 +1,88 @@
+"""
+/commit-rating applies the Elo changes the server stored for a finished rating,
+only for the user who rated, and only once.
+"""
+
+import csv
+import time
+import pytest
+from conftest import run_rating
+from personal_ranking import RankingStore
+from upstream import CircuitOpen
+
+
+def logged_comparisons(rate_cities):
+    with open(rate_cities.comparison_log.path) as f:
+        return [(row["winner_id"], row["loser_id"]) for row in csv.DictReader(f)]
+
+
+def test_result_carries_a_rating_id_not_the_deltas(rating):
+    rate_cities, _ = rating
+    result = run_rating(rate_cities, "u1", "c010")
+    assert result["ratingId"]
+    assert "globalDeltas" not in result and "globalComparisons" not in result
+    assert "comparisons" not in result
+
+
+def test_commit_applies_stored_deltas_once(rating):
+    rate_cities, client = rating
+    result = run_rating(rate_cities, "u1", "c010")
+
+    committed = rate_cities.commit_rating(result["ratingId"], "u1")
+    assert committed["status"] == "ok"
+    again = rate_cities.commit_rating(result["ratingId"], "u1")
+    assert again["status"] == "ok" and again["alreadyCommitted"]
+    assert rate_cities.global_elo_buffer.stats()["ratings"] == 1
+
+    # The log holds the comparisons the server recorded, once
+    logged = logged_comparisons(rate_cities)
+    compared = len(logged)
+    assert compared > 0 and all(winner == "c010" for winner, _ in logged)
+    assert committed["cities"] == compared + 1
+
+    rate_cities.global_elo_buffer.flush()
+    docs = client.data["allCities"]
+    # The new city won every comparison
+    assert docs["c010"]["global_Elo"] > 1000.0
+    assert docs["c010"]["comparison_count"] == compared
+    assert sum(doc["comparison_count"] for doc in docs.values()) == 2 * compared
+
+
+def test_commit_rejects_unknown_ids_and_other_users(rating):
+    rate_cities, _ = rating
+    result = run_rating(rate_cities, "u1", "c010")
+    assert rate_cities.commit_rating("made-up", "u1")["status"] == "error"
+    assert rate_cities.commit_rating(result["ratingId"], "u2")["status"] == "error"
+    assert rate_cities.global_elo_buffer.stats()["ratings"] == 0
+    # The owner can still commit it
+    assert rate_cities.commit_rating(result["ratingId"], "u1")["status"] == "ok"
+
+
+def test_first_rating_needs_no_comparisons(rating):
+    rate_cities, _ = rating
+    result = rate_cities.start_rating("new-user", "c003", "LIKE")
+    assert result["status"] == "done" and result["ratingId"]
+    assert rate_cities.commit_rating(result["ratingId"], "new-user") == {"status": "ok", "cities": 0}
+    assert rate_cities.ranking_store.get("new-user").ids() == ["c003"]
+
+
+def test_rating_fails_instead_of_using_an_expired_ranking(rating, firestore_upstream, monkeypatch):
+    rate_cities, client = rating
+    rate_cities.ranking_store.get("u1")
+    firestore_upstream.state = "open"
+    firestore_upstream._opened_at = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        rate_cities.start_rating("u1", "c010", "LIKE")
+
+    firestore_upstream.state = "closed"
+    result = run_rating(rate_cities, "u1", "c010")
+    # Committed on a worker that has no ranking cached
+    monkeypatch.setattr(rate_cities, "ranking_store", RankingStore(client))
+    firestore_upstream.state = "open"
+    firestore_upstream._opened_at = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        rate_cities.commit_rating(result["ratingId"], "u1")
+    # Nothing was applied, so the retry commits it
+    firestore_upstream.state = "closed"
+    assert rate_cities.commit_rating(result["ratingId"], "u1")["status"] == "ok"
+    assert rate_cities.global_elo_buffer.stats()["ratings"] == 1
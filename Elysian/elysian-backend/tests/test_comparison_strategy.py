@@ -0,0 +1,76 @@
+"""
+Placement checks for the binary and adaptive comparison strategies, using the
+session simulation from simulate_rating.py with noiseless answers.
+"""
+
+import numpy as np
+import pytest
+from comparison_strategy import ADAPTIVE, BINARY, choose_probe, is_settled, slot_elo, slot_probabilities
+from elo import INITIAL_ELO_MAP
+from simulate_rating import simulate_session
+
+
+def ranking(n, seed):
+    rng = np.random.default_rng(seed)
+    return sorted(rng.normal(1000, 90, size=n).clip(700, 1300).tolist(), reverse=True)
+
+
+@pytest.mark.parametrize("n", [5, 20, 200])
+def test_binary_search_places_exactly(n):
+    rng = np.random.default_rng(n)
+    for seed in range(50):
+        ranked_elos = ranking(n, seed)
+        # Start from the full range (NEUTRAL), so the true slot is always reachable
+        true_elo = rng.normal(INITIAL_ELO_MAP["NEUTRAL"], 150)
+        comparisons, error = simulate_session(BINARY, ranked_elos, "NEUTRAL", true_elo, 0, rng)
+        assert error == 0
+        assert comparisons <= int(np.ceil(np.log2(n + 1)))
+
+
+def test_adaptive_never_asks_more_than_it_needs():
+    rng = np.random.default_rng(0)
+    for seed in range(50):
+        ranked_elos = ranking(20, seed)
+        true_elo = rng.normal(INITIAL_ELO_MAP["LIKE"], 50)
+        comparisons, _ = simulate_session(ADAPTIVE, ranked_elos, "LIKE", true_elo, 0, rng)
+        assert comparisons <= 20
+
+
+def test_slot_probabilities_sum_to_one():
+    ranked_elos = ranking(30, 1)
+    probs = slot_probabilities(ranked_elos, 5, 20, 1000)
+    assert len(probs) == 17
+    assert abs(probs.sum() - 1) < 1e-9
+
+
+def test_probes_stay_in_range():
+    ranked_elos = ranking(30, 2)
+    for mode in (BINARY, ADAPTIVE):
+        assert 5 <= choose_probe(mode, ranked_elos, 5, 20, 1100) <= 20
+        assert is_settled(mode, ranked_elos, 6, 5, 1100)
+
+
+
+def test_slot_elo_stays_between_the_neighbors():
+    assert slot_elo(1120, 1150, 1100) == 1120
+    assert slot_elo(1000, 1150, 1100) == 1125
+    assert slot_elo(1300, 1150, None) < 1150
+    assert slot_elo(800, None, 1100) > 1100
+
+
+@pytest.mark.parametrize("true_elo", [1230, 1110, 1010, 940, 800])
+def test_adaptive_rating_places_the_city_in_its_slot(rating, true_elo):
+    rate_cities, _ = rating
+    # u1 ranked c000..c007 at 1200, 1150, ..., 850
+    initial = {f"c{i:03d}": 1200.0 - 50 * i for i in range(8)}
+    result = rate_cities.start_rating("u1", "c010", "NEUTRAL", mode=ADAPTIVE)
+    while result["status"] == "compare":
+        existing = result["existing_city"]["id"]
+        result = rate_cities.submit_comparison("u1", "new" if true_elo > initial[existing] else "existing")
+    assert result["status"] == "done"
+
+    # Ordered by the Elos written, the new city sits where its true Elo puts it
+    elos = result["personalElos"]
+    order = sorted(elos, key=lambda cid: elos[cid], reverse=True)
+    true_slot = sum(elo > true_elo for elo in initial.values())
+    assert order.index("c010") == true_slot
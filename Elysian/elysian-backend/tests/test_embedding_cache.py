@@ -0,0 +1,107 @@
+"""
+User embeddings are cached per profile and model version: a new user_encoder.tflite
+is picked up by check_user_encoder, and the old model's entries are never served.
+"""
+
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import FakeUserEncoder
+from test_app import PROFILE
+
+
+@pytest.fixture
+def model(backend_app, tmp_path, monkeypatch):
+    '''
+    Fixture that points app.py at a copy of the model file and returns
+    (app, replace), where replace(seed) writes a "new model" with its own weights.
+    '''
+    app, _ = backend_app
+    import interpreter_pool
+    path = tmp_path / "user_encoder.tflite"
+    shutil.copy(app.USER_ENCODER_PATH, path)
+    os.utime(path, (1, 1))
+    monkeypatch.setattr(app, "USER_ENCODER_PATH", str(path))
+    multi_hot_size = int(app.interpreter_pool.input_details[0]["shape"][1])
+    dim = len(app.get_cached_user_embedding(*app.encode_user_inputs(PROFILE)))
+    loads = []
+
+    def replace(seed, mtime):
+        def load(model_path, num_threads):
+            loads.append(seed)
+            return FakeUserEncoder(multi_hot_size, dim, seed=seed)
+        monkeypatch.setattr(interpreter_pool, "load_interpreter", load)
+        os.utime(path, (mtime, mtime))
+        # Let the next request look at the file
+        monkeypatch.setattr(app, "_model_checked_at", 0)
+
+    replace.loads = loads
+    return app, replace
+
+
+def embed(app):
+    return app.get_cached_user_embedding(*app.encode_user_inputs(PROFILE))
+
+
+def test_profile_embedding_is_computed_once(backend_app):
+    app, _ = backend_app
+    before = app.interpreter_pool.stats()["acquired"]
+    first = embed(app)
+    expected = first.copy()
+    first += 1   # Callers may change their copy in place
+    assert np.array_equal(embed(app), expected)
+    assert app.interpreter_pool.stats()["acquired"] == before + 1
+
+
+def test_new_model_invalidates_the_cache(model):
+    app, replace = model
+    old = embed(app)
+    replace(seed=1, mtime=1000)
+    new = embed(app)
+    assert not np.allclose(new, old)
+    assert app.interpreter_pool.version == 1000
+    # Only the new model's entry is left
+    assert len(app.embedding_cache) == 1
+    assert np.array_equal(embed(app), new)
+
+
+def test_model_file_is_only_checked_every_interval(model):
+    app, replace = model
+    replace(seed=1, mtime=1000)
+    embed(app)
+    # A newer file inside the interval isn't looked at yet
+    replace(seed=2, mtime=2000)
+    app._model_checked_at = app.time.time()
+    embed(app)
+    assert app.interpreter_pool.version == 1000
+    assert replace.loads.count(2) == 0
+
+
+def test_concurrent_requests_reload_once(model):
+    app, replace = model
+    old = embed(app)
+    replace(seed=3, mtime=3000)
+    barrier = threading.Barrier(16)
+    results = []
+
+    def request():
+        barrier.wait()
+        results.append(embed(app))
+
+    threads = [threading.Thread(target=request) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One new pool (one interpreter per slot). Requests that didn't wait for the reload
+    # got the old model's vector, but the cache now serves the new model's.
+    assert replace.loads == [3] * app.interpreter_pool.size
+    assert app.interpreter_pool.version == 3000
+    new = embed(app)
+    assert not np.allclose(new, old)
+    assert all(np.array_equal(vec, old) or np.array_equal(vec, new) for vec in results)
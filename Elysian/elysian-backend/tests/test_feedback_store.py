@@ -0,0 +1,107 @@
+"""
+FeedbackStore aggregates apply swipes idempotently, so a worker that missed a
+/swipe catches up from the recent swipes sent with /next_city. Those are applied
+to a per-request copy, never to the cached aggregate.
+"""
+
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from feedback_store import FeedbackStore
+
+# The attributes of an artifact bundle FeedbackStore uses
+def make_bundle(version="v1", seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(10, 4)).astype(np.float32)
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = {f"c{i}": i for i in range(10)}
+    return SimpleNamespace(version=version, vectors=vectors, normed=normed, index=index)
+
+BUNDLE = make_bundle()
+
+
+def make_store(liked=(), disliked=()):
+    return FeedbackStore(lambda user_id: (list(liked), list(disliked)), version=BUNDLE.version)
+
+
+def test_recent_swipes_reach_a_worker_that_missed_them():
+    handled_swipe, other = make_store(), make_store()
+    for store in (handled_swipe, other):
+        store.get("u1", BUNDLE)
+    handled_swipe.record("u1", "c3", "like")
+    assert 3 not in other.get("u1", BUNDLE).seen_idx()
+
+    recent = [{"city_id": "c3", "action": "like"}, {"city_id": "c5", "action": "dislike"}]
+    for store in (handled_swipe, other):
+        aggregate = store.get("u1", BUNDLE, recent)
+        assert aggregate.seen_idx().tolist() == [3, 5]
+        assert aggregate.liked == {3} and aggregate.disliked == {5}
+    np.testing.assert_allclose(other.get("u1", BUNDLE, recent).liked_sum_raw, handled_swipe.get("u1", BUNDLE).liked_sum_raw)
+
+
+def test_recent_swipes_do_not_change_the_cached_aggregate():
+    store = make_store(liked=["c1"])
+    cached = store.get("u1", BUNDLE)
+    recent = [{"city_id": "c2", "action": "like"}, {"city_id": "c1", "action": "unlike"}]
+    for _ in range(3):
+        # The app sends the same recent swipes with every request
+        aggregate = store.get("u1", BUNDLE, recent)
+        assert aggregate is not cached
+        assert aggregate.liked == {2}
+        np.testing.assert_allclose(aggregate.liked_sum_raw, BUNDLE.vectors[2], rtol=1e-6)
+    assert store.get("u1", BUNDLE) is cached
+    assert cached.liked == {1} and cached.seen_idx().tolist() == [1]
+    np.testing.assert_allclose(cached.liked_sum_raw, BUNDLE.vectors[1], rtol=1e-6)
+
+    # Once the unlike reaches this worker through /swipe, the old list changes nothing more
+    store.record("u1", "c1", "unlike")
+    assert store.get("u1", BUNDLE, recent[1:]).liked == set()
+    assert store.get("u1", BUNDLE).liked == set()
+
+
+def test_recent_swipes_apply_in_order():
+    store = make_store(liked=["c1"])
+    recent = [{"city_id": "c1", "action": "unlike"}, {"city_id": "c1", "action": "like"}, {"city_id": "c2", "action": "like"}]
+    aggregate = store.get("u1", BUNDLE, recent)
+    assert aggregate.liked == {1, 2}
+    np.testing.assert_allclose(aggregate.liked_sum_raw, BUNDLE.vectors[[1, 2]].sum(axis=0), rtol=1e-6)
+
+
+@pytest.mark.parametrize("recent", [
+    [{"city_id": "c1", "action": "maybe"}],
+    [{"city_id": "c1"}],
+    [{"action": "like"}],
+    [{"city_id": 3, "action": "like"}],
+    ["c1"],
+    [None],
+    {"city_id": "c1", "action": "like"},
+    "c1",
+])
+def test_malformed_recent_swipes_are_rejected(recent):
+    loads = []
+    store = FeedbackStore(lambda user_id: loads.append(user_id) or ([], []), version=BUNDLE.version)
+    with pytest.raises(ValueError):
+        store.get("u1", BUNDLE, recent)
+    # Rejected before reading Firestore
+    assert loads == []
+
+
+def test_unknown_cities_in_recent_swipes_are_ignored():
+    store = make_store(liked=["c1"])
+    assert store.get("u1", BUNDLE, [{"city_id": "gone", "action": "like"}]).liked == {1}
+    assert store.get("u1", BUNDLE, None).liked == {1}
+
+
+def test_aggregate_of_an_old_bundle_is_not_served_after_a_switch():
+    store = make_store(liked=["c1"])
+    new_bundle = make_bundle("v2", seed=1)
+    store.switch(new_bundle.version)
+
+    # A request that started before the switch still scores with the old bundle...
+    old = store.get("u1", BUNDLE)
+    assert old.version == "v1"
+    # ...but its aggregate isn't cached for requests on the new bundle
+    new = store.get("u1", new_bundle)
+    assert new is not old and new.version == "v2"
+    np.testing.assert_allclose(new.liked_sum_raw, new_bundle.vectors[1])
+    assert store.get("u1", new_bundle) is new
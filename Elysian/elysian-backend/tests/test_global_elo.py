@@ -0,0 +1,148 @@
+"""
+GlobalEloBuffer must not lose a delta or comparison count with concurrent
+raters and failing commits, and must seed a missing global_Elo at BASE_ELO.
+"""
+
+import random
+import threading
+import time
+from elo import BASE_ELO
+from global_elo import GlobalEloBuffer
+from local_firestore import LocalFirestore
+
+CITIES = [f"c{i:03d}" for i in range(20)]
+
+
+def make_client():
+    # Odd cities already have a global_Elo, even ones don't
+    return LocalFirestore({
+        "allCities": {
+            city_id: ({"global_Elo": BASE_ELO, "comparison_count": 0} if i % 2 else {"city_name": city_id})
+            for i, city_id in enumerate(CITIES)
+        }
+    })
+
+
+def seeded_at_start(city_id):
+    return int(city_id[1:]) % 2 == 1
+
+
+def test_flush_sums_deltas_and_seeds_missing_elo():
+    client = make_client()
+    buffer = GlobalEloBuffer(client, has_global_elo=seeded_at_start)
+    buffer.add({"c000": 5.0, "c001": -5.0}, {"c000": 1, "c001": 1})
+    buffer.add({"c000": 2.5, "c001": -2.5}, {"c000": 1, "c001": 1})
+    assert buffer.flush() == 2
+
+    docs = client.data["allCities"]
+    assert docs["c000"] == {"city_name": "c000", "global_Elo": BASE_ELO + 7.5, "comparison_count": 2}
+    assert docs["c001"]["global_Elo"] == BASE_ELO - 7.5
+    assert buffer.flush() == 0
+
+
+def test_failed_flush_is_retried():
+    client = make_client()
+    buffer = GlobalEloBuffer(client, has_global_elo=seeded_at_start)
+    buffer.add({"c001": 3.0}, {"c001": 1})
+    client.fail_next_commits(1)
+    assert buffer.flush() == 0
+    assert buffer.stats()["pendingCities"] == 1
+    assert buffer.flush() == 1
+    assert client.data["allCities"]["c001"]["global_Elo"] == BASE_ELO + 3.0
+
+
+def test_commit_that_landed_before_timing_out_is_not_applied_twice():
+    client = make_client()
+    buffer = GlobalEloBuffer(client, has_global_elo=seeded_at_start)
+    buffer.add({"c001": 3.0, "c003": -3.0}, {"c001": 1, "c003": 1})
+    client.lose_next_acks(1)
+    assert buffer.flush() == 0
+    assert buffer.stats()["pendingCities"] == 2
+
+    # The retry finds the chunk's marker and writes nothing
+    buffer.add({"c001": 1.0}, {"c001": 1})
+    assert buffer.flush() == 1
+    docs = client.data["allCities"]
+    assert docs["c001"] == {"global_Elo": BASE_ELO + 4.0, "comparison_count": 2}
+    assert docs["c003"] == {"global_Elo": BASE_ELO - 3.0, "comparison_count": 1}
+    assert buffer.stats()["duplicatesSkipped"] == 1
+    assert buffer.stats()["pendingCities"] == 0
+
+
+def test_concurrent_raters_lose_nothing(firestore_upstream):
+    # Injected failures can come in a row; keep the breaker out of this test
+    firestore_upstream.failure_threshold = 1000
+    client = make_client()
+    buffer = GlobalEloBuffer(client, flush_interval=0.01, flush_threshold=5, has_global_elo=seeded_at_start)
+    buffer.start()
+
+    expected_elo = {city_id: float(BASE_ELO) for city_id in CITIES}
+    expected_count = {city_id: 0 for city_id in CITIES}
+    totals_lock = threading.Lock()
+
+    def rater(seed):
+        rng = random.Random(seed)
+        for n in range(150):
+            winner, loser = rng.sample(CITIES, 2)
+            delta = rng.uniform(0, 9.6)
+            buffer.add({winner: delta, loser: -delta}, {winner: 1, loser: 1})
+            with totals_lock:
+                expected_elo[winner] += delta
+                expected_elo[loser] -= delta
+                expected_count[winner] += 1
+                expected_count[loser] += 1
+            if n % 50 == 0:
+                client.fail_next_commits(1)
+            if n % 50 == 25:
+                client.lose_next_acks(1)
+            if n % 20 == 0:
+                time.sleep(0.002)   # Let flushes interleave with the raters
+
+    raters = [threading.Thread(target=rater, args=(seed,)) for seed in range(4)]
+    for thread in raters:
+        thread.start()
+    for thread in raters:
+        thread.join()
+    buffer.stop()
+
+    docs = client.data["allCities"]
+    for city_id in CITIES:
+        assert abs(docs[city_id]["global_Elo"] - expected_elo[city_id]) < 1e-6, city_id
+        assert docs[city_id]["comparison_count"] == expected_count[city_id], city_id
+
+
+def test_two_workers_seeding_the_same_city():
+    # Each worker's catalog still says c000 has no global_Elo; neither update may be lost
+    client = make_client()
+    buffers = [GlobalEloBuffer(client, has_global_elo=seeded_at_start) for _ in range(2)]
+    buffers[0].add({"c000": 4.0}, {"c000": 1})
+    buffers[1].add({"c000": -1.5}, {"c000": 1})
+
+    barrier = threading.Barrier(2)
+
+    def flush(buffer):
+        barrier.wait()
+        buffer.flush()
+
+    workers = [threading.Thread(target=flush, args=(buffer,)) for buffer in buffers]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    doc = client.data["allCities"]["c000"]
+    assert doc["global_Elo"] == BASE_ELO + 2.5
+    assert doc["comparison_count"] == 2
+
+
+def test_flush_waits_while_the_circuit_is_open(firestore_upstream):
+    client = make_client()
+    buffer = GlobalEloBuffer(client, has_global_elo=seeded_at_start)
+    buffer.add({"c001": 3.0}, {"c001": 1})
+    firestore_upstream.state = "open"
+    firestore_upstream._opened_at = time.monotonic()
+    assert buffer.flush() == 0 and client.commits == 0
+    assert buffer.stats()["pendingCities"] == 1
+
+    firestore_upstream.state = "closed"
+    assert buffer.flush() == 1
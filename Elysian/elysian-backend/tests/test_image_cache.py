@@ -0,0 +1,51 @@
+"""
+The in-process image cache keeps found images and "no image found" results for
+as long as their disk entries: IMAGE_CACHE_TTL and IMAGE_NEGATIVE_TTL.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import unsplash_service
+from disk_cache import DiskCache
+from ttl_cache import LRUTTLCache
+
+MISSING = object()
+
+
+def test_memory_entries_expire_with_their_disk_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(unsplash_service, "disk_cache", DiskCache(str(tmp_path / "images.db")))
+    monkeypatch.setattr(unsplash_service, "memory_cache", LRUTTLCache(ttl=unsplash_service.IMAGE_CACHE_TTL))
+    unsplash_service._store("paris france", {"url": "paris.jpg"})
+    unsplash_service._store("atlantis", None)
+
+    # Another worker reads both from disk into its own memory cache
+    other_worker = LRUTTLCache(ttl=unsplash_service.IMAGE_CACHE_TTL)
+    monkeypatch.setattr(unsplash_service, "memory_cache", other_worker)
+    assert unsplash_service._load("paris france") == {"url": "paris.jpg"}
+    assert unsplash_service._load("atlantis") is None
+
+    later = time.time() + unsplash_service.IMAGE_NEGATIVE_TTL + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert other_worker.get("paris france", MISSING) == {"url": "paris.jpg"}
+    assert other_worker.get("atlantis", MISSING) is MISSING
+
+
+def test_disk_cache_file_is_created_on_first_use(tmp_path):
+    path = tmp_path / "images.db"
+    cache = DiskCache(str(path))
+    assert not path.exists()
+    assert cache.get("paris france") == (False, None)
+    assert path.exists()
+    cache.set("paris france", {"url": "paris.jpg"}, 60)
+    assert DiskCache(str(path)).get("paris france") == (True, {"url": "paris.jpg"})
+
+
+
+def test_importing_the_service_writes_nothing_to_the_working_directory(tmp_path):
+    backend = os.path.dirname(os.path.abspath(unsplash_service.__file__))
+    env = dict(os.environ, PYTHONPATH=backend)
+    env.pop("IMAGE_CACHE_PATH", None)
+    subprocess.run([sys.executable, "-c", "import unsplash_service"], cwd=tmp_path, env=env, check=True)
+    assert list(tmp_path.iterdir()) == []
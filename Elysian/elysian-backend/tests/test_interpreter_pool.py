@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from interpreter_pool import InterpreterPool, batch_class
+
+
+class FakeInterpreter:
+    # Two inputs of 3 and 1 columns; the output row is their sum. Like TFLite it only
+    # accepts inputs of the allocated shape, and it fails if two threads use it at once.
+    def __init__(self):
+        self.shapes = {0: [1, 3], 1: [1, 1]}
+        self.allocated = dict(self.shapes)
+        self.tensors = {}
+        self.busy = False
+
+    def get_input_details(self):
+        return [{"index": index, "shape": np.array(shape)} for index, shape in self.shapes.items()]
+
+    def get_output_details(self):
+        return [{"index": 9}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shapes[index] = list(shape)
+
+    def allocate_tensors(self):
+        self.allocated = dict(self.shapes)
+
+    def set_tensor(self, index, value):
+        assert list(value.shape) == self.allocated[index]
+        self.tensors[index] = value
+
+    def invoke(self):
+        assert not self.busy, "interpreter used by two threads at once"
+        self.busy = True
+        time.sleep(0.002)
+        self.tensors[9] = self.tensors[0].sum(axis=1) + self.tensors[1][:, 0]
+        self.busy = False
+
+    def get_tensor(self, index):
+        return self.tensors[index]
+
+
+@pytest.fixture
+def make_pool(tmp_path):
+    model = tmp_path / "user_encoder.tflite"
+    model.write_bytes(b"model")
+    loaded = []
+
+    def load(path, num_threads):
+        interpreter = FakeInterpreter()
+        loaded.append(interpreter)
+        return interpreter
+
+    def make(size=2):
+        pool = InterpreterPool(str(model), size=size, num_threads=1, load=load)
+        pool.loaded = loaded
+        return pool
+    return make
+
+
+def feeds(rows):
+    a = np.arange(rows * 3, dtype=np.float32).reshape(rows, 3)
+    b = np.full((rows, 1), 0.5, dtype=np.float32)
+    return {0: a, 1: b}, a.sum(axis=1) + 0.5
+
+
+@pytest.mark.parametrize("rows, expected", [(1, 1), (2, 2), (3, 4), (4, 4), (5, 8), (256, 256)])
+def test_batch_class_rounds_up_to_a_power_of_two(rows, expected):
+    assert batch_class(rows) == expected
+
+
+@pytest.mark.parametrize("rows", [1, 2, 3, 7, 8, 20])
+def test_run_returns_one_output_per_row(make_pool, rows):
+    pool = make_pool()
+    inputs, expected = feeds(rows)
+    np.testing.assert_allclose(pool.run(inputs), expected)
+
+
+def test_interleaved_single_and_batched_calls_do_not_reallocate(make_pool):
+    pool = make_pool(size=1)
+    assert pool.stats()["allocations"] == 1
+    for _ in range(5):
+        for rows in (1, 5, 1, 7, 1, 3):
+            inputs, expected = feeds(rows)
+            np.testing.assert_allclose(pool.run(inputs), expected)
+    # One interpreter each for the 1, 4 and 8 row classes, created once
+    assert pool.stats()["allocations"] == 3
+    assert [interpreter.allocated[0][0] for interpreter in pool.loaded] == [1, 8, 4]
+
+
+def test_concurrent_borrowers_each_get_their_own_interpreter(make_pool):
+    pool = make_pool(size=3)
+
+    def call(n):
+        inputs, expected = feeds(1 + n % 6)
+        np.testing.assert_allclose(pool.run(inputs), expected)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(call, range(120)))
+
+    stats = pool.stats()
+    assert stats["acquired"] == 120
+    assert stats["free"] == 3
+    assert stats["waiting"] == 0
+    # At most one interpreter per slot and batch class (1, 2, 4 and 8 rows)
+    assert stats["allocations"] <= 3 * 4
+
+
+def test_acquire_times_out_when_every_slot_is_borrowed(make_pool):
+    pool = make_pool(size=1)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.acquire():
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with pytest.raises(queue.Empty):
+        pool.run(feeds(1)[0], timeout=0.05)
+    release.set()
+    thread.join()
+    np.testing.assert_allclose(pool.run(feeds(1)[0]), feeds(1)[1])
+    assert pool.stats()["waiting"] == 0
@@ -0,0 +1,63 @@
+"""
+The leaderboard keeps cities ordered by global Elo overall, per country and per
+continent, through catalog updates and continent changes.
+"""
+
+import pytest
+from leaderboard import Leaderboard
+
+CONTINENTS = {"paris": "Europe", "rome": "Europe", "tokyo": "Asia", "kyoto": "Asia", "istanbul": "Europe"}
+
+
+def city(name, country, elo):
+    return {"city_name": name, "country_name": country, "globalElo": elo, "comparisonCount": 0}
+
+
+@pytest.fixture
+def leaderboard():
+    board = Leaderboard(continent_of=dict(CONTINENTS))
+    board.apply({
+        "paris": city("Paris", "France", 1100.0),
+        "rome": city("Rome", "Italy", 1050.0),
+        "tokyo": city("Tokyo", "Japan", 1200.0),
+        "kyoto": city("Kyoto", "Japan", 1050.0),
+        "istanbul": city("Istanbul", "Turkey", 990.0)
+    }, full=True)
+    return board
+
+
+def ids(rows):
+    return [row["city_id"] for row in rows]
+
+
+def test_top_is_ordered_by_elo_with_ties_by_id(leaderboard):
+    rows, total = leaderboard.top(10)
+    assert ids(rows) == ["tokyo", "paris", "kyoto", "rome", "istanbul"]
+    assert [row["rank"] for row in rows] == [1, 2, 3, 4, 5]
+    assert total == 5
+    assert ids(leaderboard.top(2)[0]) == ["tokyo", "paris"]
+    assert leaderboard.rank_of("rome")["rank"] == 4
+
+
+def test_country_and_continent_filters(leaderboard):
+    assert ids(leaderboard.top(10, country="japan")[0]) == ["tokyo", "kyoto"]
+    rows, total = leaderboard.top(10, continent="Europe")
+    assert ids(rows) == ["paris", "rome", "istanbul"] and total == 3
+    assert ids(leaderboard.top(10, country="Turkey", continent="Europe")[0]) == ["istanbul"]
+    assert leaderboard.rank_of("rome", continent="europe")["rank"] == 2
+    assert leaderboard.rank_of("rome", continent="Asia") is None
+
+
+def test_updates_move_cities(leaderboard):
+    leaderboard.apply({"istanbul": city("Istanbul", "Turkey", 1300.0), "tokyo": None})
+    assert ids(leaderboard.top(10)[0]) == ["istanbul", "paris", "kyoto", "rome"]
+    assert ids(leaderboard.top(10, country="Japan")[0]) == ["kyoto"]
+    assert leaderboard.rank_of("tokyo") is None
+    assert len(leaderboard) == 4
+
+
+def test_new_continents_regroup_existing_cities(leaderboard):
+    leaderboard.set_continents({**CONTINENTS, "istanbul": "Asia"})
+    assert ids(leaderboard.top(10, continent="Asia")[0]) == ["tokyo", "kyoto", "istanbul"]
+    assert ids(leaderboard.top(10, continent="Europe")[0]) == ["paris", "rome"]
+    assert leaderboard.rank_of("istanbul", continent="Asia")["continent"] == "Asia"
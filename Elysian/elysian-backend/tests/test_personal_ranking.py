@@ -0,0 +1,94 @@
+"""
+PersonalRanking keeps ranks right under incremental updates, and RankingStore
+sees ratings committed by other workers without rebuilding its own.
+"""
+
+import random
+from conftest import run_rating
+from local_firestore import LocalDocument, LocalFirestore
+from personal_ranking import PersonalRanking, RankingStore
+
+
+def unavailable(*args, **kwargs):
+    raise ConnectionError("Firestore unavailable")
+
+
+def test_incremental_ranks_match_a_full_sort():
+    rng = random.Random(0)
+    elos = {f"c{i}": rng.uniform(800, 1400) for i in range(200)}
+    ranking = PersonalRanking(elos)
+    for _ in range(50):
+        updates = {f"c{rng.randrange(260)}": rng.uniform(800, 1400) for _ in range(5)}
+        ranking.update_many(updates)
+        elos.update(updates)
+
+        expected = sorted(elos, key=lambda cid: elos[cid], reverse=True)
+        assert [elos[cid] for cid in ranking.ids()] == [elos[cid] for cid in expected]
+        assert all(ranking.rank_of(cid) == i for i, cid in enumerate(ranking.ids()))
+
+
+def test_fresh_get_reuses_an_unchanged_ranking():
+    client = LocalFirestore({"userPosts": {"u1": {"personalElos": {"a": 1100, "b": 1000}}}})
+    store = RankingStore(client)
+    first = store.get("u1", fresh=True)
+    reads = client.reads
+    assert store.get("u1", fresh=True) is first
+    assert store.stats()["reused"] == 1
+    # Only the metadata was read
+    assert store.stats()["reads"] == 1 and client.reads == reads + 1
+
+
+def test_commit_keeps_the_ranking_current():
+    client = LocalFirestore({"userPosts": {"u1": {"personalElos": {"a": 1100, "b": 1000}}}})
+    store = RankingStore(client)
+    first = store.get("u1", fresh=True)
+    store.commit("u1", {"b": 1200, "c": 900})
+    assert client.data["userPosts"]["u1"]["rankedCities"] == ["b", "a", "c"]
+
+    # The ranking's own save doesn't make it stale
+    assert store.get("u1", fresh=True) is first
+    assert store.stats()["reads"] == 1
+
+    # The app writing back the same Elos is adopted without a rebuild
+    client.collection("userPosts").document("u1").set(
+        {"personalElos": {"a": 1100, "b": 1200, "c": 900}},
+        merge=True
+    )
+    assert store.get("u1", fresh=True) is first
+    assert store.stats()["reads"] == 2
+    assert store.get("u1", fresh=True) is first
+    assert store.stats()["reads"] == 2
+
+
+def test_failed_save_rebuilds_from_the_document(monkeypatch):
+    client = LocalFirestore({"userPosts": {"u1": {"personalElos": {"a": 1100, "b": 1000}}}})
+    store = RankingStore(client)
+    first = store.get("u1", fresh=True)
+    with monkeypatch.context() as patch:
+        patch.setattr(LocalDocument, "set", unavailable)
+        store.commit("u1", {"b": 1200})
+    assert store.stats()["saveFailures"] == 1
+
+    ranking = store.get("u1", fresh=True)
+    assert ranking is not first
+    assert ranking.ids() == ["a", "b"]
+
+
+def test_fresh_get_sees_another_workers_rating(rating):
+    rate_cities, client = rating
+    other_worker = RankingStore(client)
+    before = rate_cities.ranking_store.get("u1").ids()
+    assert other_worker.get("u1").ids() == before
+
+    # Rated and committed on this worker; the app writes the personal Elos itself
+    result = run_rating(rate_cities, "u1", "c010", "LIKE")
+    assert rate_cities.commit_rating(result["ratingId"], "u1")["status"] == "ok"
+    doc = client.data["userPosts"]["u1"]
+    client.collection("userPosts").document("u1").set(
+        {"personalElos": {**doc["personalElos"], **result["personalEloUpdates"]}},
+        merge=True
+    )
+
+    assert other_worker.get("u1").ids() == before
+    assert other_worker.get("u1", fresh=True).ids() == rate_cities.ranking_store.get("u1").ids()
+    assert "c010" in other_worker.get("u1").ids()
@@ -0,0 +1,62 @@
+"""
+With prefetch, each comparison carries the next step for both answers, which is
+what the server answers once the real choice comes in, without changing the session.
+"""
+
+import copy
+import random
+import pytest
+
+BULK_CITIES = [{"city_id": city_id, "feedback": "NEUTRAL"} for city_id in ("c008", "c009", "c010", "c011")]
+
+
+def without_prefetch(response):
+    return {key: value for key, value in response.items() if key != "prefetch"}
+
+
+def start(rate_cities, kind):
+    if kind == "bulk":
+        return rate_cities.start_bulk_rating("u1", BULK_CITIES, prefetch=True)
+    return rate_cities.start_rating("u1", "c010", "NEUTRAL", prefetch=True)
+
+
+@pytest.mark.parametrize("kind", ["single", "bulk"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_prefetch_matches_the_real_answer(rating, kind, seed):
+    rate_cities, _ = rating
+    rng = random.Random(seed)
+    result = start(rate_cities, kind)
+    while result["status"] == "compare":
+        assert set(result["prefetch"]) == {"new", "existing"}
+        preferred = rng.choice(["new", "existing"])
+        expected = result["prefetch"][preferred]
+        result = rate_cities.submit_comparison("u1", preferred, prefetch=True)
+
+        if result["status"] == "compare":
+            assert without_prefetch(result) == expected
+        else:
+            # The finished rating also gets a rating id when it is stored
+            assert result["status"] == expected["status"] == "done"
+            assert result["personalEloUpdates"] == expected["personalEloUpdates"]
+            assert result["comparisonIncrement"] == expected["comparisonIncrement"]
+
+
+@pytest.mark.parametrize("kind", ["single", "bulk"])
+def test_prefetch_leaves_the_session_unchanged(rating, kind):
+    rate_cities, _ = rating
+    start(rate_cities, kind)
+    session = rate_cities.session_store.get("u1")
+    before = copy.deepcopy(session)
+
+    rate_cities.speculate_next(session)
+    assert session == before
+    assert rate_cities.session_store.get("u1") == before
+
+
+def test_without_prefetch_nothing_is_speculated(rating, monkeypatch):
+    rate_cities, _ = rating
+    monkeypatch.setattr(rate_cities, "speculate_next", None)
+    result = rate_cities.start_rating("u1", "c010", "NEUTRAL")
+    assert result["status"] == "compare" and "prefetch" not in result
+    result = rate_cities.submit_comparison("u1", "new")
+    assert "prefetch" not in result
@@ -0,0 +1,34 @@
+"""
+Prewarm passes run in one process at a time, and not again until the next one is due.
+"""
+
+from prewarm import Prewarmer, RateLimiter
+
+
+def make_prewarmer(lock_path, refreshed):
+    jobs = {"images": (lambda city, country: None, lambda city, country: refreshed.append(city), RateLimiter(0))}
+    return Prewarmer([("Paris", "France"), ("Rome", "Italy")], jobs, workers=1, lock_path=lock_path)
+
+
+def test_only_one_worker_runs_a_due_pass(tmp_path):
+    lock_path = str(tmp_path / "prewarm.lock")
+    refreshed = []
+    workers = [make_prewarmer(lock_path, refreshed) for _ in range(3)]
+
+    assert [worker.run(min_interval=3600) for worker in workers] == [True, False, False]
+    assert sorted(refreshed) == ["Paris", "Rome"]
+    # A command line run doesn't wait for the interval
+    assert workers[1].run()
+    assert len(refreshed) == 4
+
+
+def test_pass_is_skipped_while_another_runs(tmp_path):
+    lock_path = str(tmp_path / "prewarm.lock")
+    refreshed = []
+    other = make_prewarmer(lock_path, refreshed)
+    nested = []
+    jobs = {"images": (lambda city, country: None, lambda city, country: nested.append(other.run()), RateLimiter(0))}
+    running = Prewarmer([("Paris", "France")], jobs, workers=1, lock_path=lock_path)
+
+    assert running.run()
+    assert nested == [False] and refreshed == []
@@ -0,0 +1,85 @@
+"""
+The compiled lookup encoder must give bit-identical output to the sklearn
+transforms it replaced, for known, unknown and missing labels.
+"""
+
+import joblib
+import numpy as np
+import pytest
+from conftest import backend_file
+from profile_encoder import MULTI_FEATURES, CompiledProfileEncoder
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    return (
+        joblib.load(backend_file("le_origin.pkl")),
+        joblib.load(backend_file("le_fav.pkl")),
+        joblib.load(backend_file("mlbs.pkl"))
+    )
+
+
+def sklearn_encode(le_origin, le_fav, mlbs, data):
+    # The original encoding in app.py, used as the reference
+    origin_enc = float(le_origin.transform([data["origin_country"]])[0])
+    fav_enc = float(le_fav.transform([data["favorite_country_visited"]])[0])
+    multi_hot_parts = [mlbs[feature].transform([data.get(feature, [])])[0] for feature in MULTI_FEATURES]
+    return origin_enc, fav_enc, np.concatenate(multi_hot_parts).astype(np.float32)
+
+
+def random_profiles(le_origin, le_fav, mlbs, count, seed=0):
+    rng = np.random.default_rng(seed)
+    profiles = []
+    for _ in range(count):
+        data = {
+            "origin_country": le_origin.classes_[rng.integers(len(le_origin.classes_))],
+            "favorite_country_visited": le_fav.classes_[rng.integers(len(le_fav.classes_))],
+        }
+        for feature in MULTI_FEATURES:
+            classes = list(mlbs[feature].classes_)
+            picked = rng.choice(classes, size=rng.integers(0, len(classes) + 1), replace=False)
+            data[feature] = [str(label) for label in picked]
+            # Unknown labels are ignored by MultiLabelBinarizer, so mix a few in
+            if rng.random() < 0.1:
+                data[feature].append("Not a real option")
+        profiles.append(data)
+    return profiles
+
+
+def test_encode_matches_sklearn(fitted):
+    encoder = CompiledProfileEncoder(*fitted)
+    for data in random_profiles(*fitted, count=300):
+        expected = sklearn_encode(*fitted, data)
+        actual = encoder.encode(data)
+        assert expected[0] == actual[0]
+        assert expected[1] == actual[1]
+        assert expected[2].dtype == actual[2].dtype
+        assert expected[2].tobytes() == actual[2].tobytes()
+
+
+def test_encode_batch_matches_encode(fitted):
+    encoder = CompiledProfileEncoder(*fitted)
+    profiles = random_profiles(*fitted, count=50, seed=1)
+    origin_batch, fav_batch, multi_batch = encoder.encode_batch(profiles)
+    for row, data in enumerate(profiles):
+        origin_enc, fav_enc, multi_hot = encoder.encode(data)
+        assert origin_batch[row, 0] == origin_enc
+        assert fav_batch[row, 0] == fav_enc
+        assert multi_batch[row].tobytes() == multi_hot.tobytes()
+
+
+def test_missing_multi_select_answers(fitted):
+    le_origin, le_fav, mlbs = fitted
+    encoder = CompiledProfileEncoder(*fitted)
+    data = {"origin_country": le_origin.classes_[0], "favorite_country_visited": le_fav.classes_[0]}
+    assert encoder.encode(data)[2].tobytes() == sklearn_encode(*fitted, data)[2].tobytes()
+
+
+def test_unknown_country_raises_like_sklearn(fitted):
+    le_origin, le_fav, mlbs = fitted
+    encoder = CompiledProfileEncoder(*fitted)
+    data = {"origin_country": "Atlantis", "favorite_country_visited": le_fav.classes_[0]}
+    with pytest.raises(ValueError):
+        le_origin.transform([data["origin_country"]])
+    with pytest.raises(ValueError):
+        encoder.encode(data)
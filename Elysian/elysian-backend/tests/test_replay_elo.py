@@ -0,0 +1,118 @@
+"""
+The streamed replay must match elo.expected_score applied one comparison at a
+time, read_log must handle repeated CSV headers in older shared logs, and the
+replayed values are only applied once the Elo buffers are drained.
+"""
+
+import sys
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from comparison_log import LOG_HEADER, ComparisonLog
+from elo import GLOBAL_DAMPING, K_FACTOR
+from local_firestore import LocalFirestore
+from replay_elo import CityIndex, apply_to_firestore, build_report, read_log, replay, replay_reference
+
+GLOBAL_K = K_FACTOR * GLOBAL_DAMPING
+CITY_IDS = [f"c{i:03d}" for i in range(25)]
+
+
+def random_comparisons(n, seed=0):
+    rng = np.random.default_rng(seed)
+    winners = rng.integers(len(CITY_IDS), size=n)
+    losers = (winners + rng.integers(1, len(CITY_IDS), size=n)) % len(CITY_IDS)
+    return winners, losers
+
+
+def test_replay_matches_reference(tmp_path):
+    winners, losers = random_comparisons(5000)
+    names = np.array(CITY_IDS, dtype=object)
+    path = tmp_path / "comparisons.csv"
+    pd.DataFrame({"winner_id": names[winners], "loser_id": names[losers]}).to_csv(path, index=False)
+
+    ratings, counts, total = replay(read_log(str(path), chunk_size=700), CityIndex(CITY_IDS), global_k=GLOBAL_K)
+    reference = replay_reference(winners, losers, len(CITY_IDS), GLOBAL_K)
+
+    assert total == 5000
+    assert counts.sum() == 2 * 5000
+    assert np.abs(ratings - reference).max() < 1e-9
+
+
+def test_replay_reads_the_comparison_log(tmp_path):
+    path = str(tmp_path / "log.csv")
+    for _ in range(2):
+        ComparisonLog(path).append([["c000", "c001"], ["c002", "c000"]])
+    # Logs written before the header was created once may repeat it
+    with open(path, "a") as f:
+        f.write(LOG_HEADER)
+    ComparisonLog(path).append([["c001", "c002"]])
+
+    index = CityIndex()
+    ratings, counts, total = replay(read_log(path), index)
+    assert total == 5
+    assert dict(zip(index.ids, counts.tolist())) == {"c000": 4, "c001": 3, "c002": 3}
+
+
+def test_workers_sharing_a_log_write_the_header_once(tmp_path):
+    path = str(tmp_path / "log.csv")
+    logs = [ComparisonLog(path) for _ in range(8)]
+    start = threading.Barrier(len(logs))
+
+    def append(log):
+        start.wait()
+        for _ in range(20):
+            log.append([["c000", "c001"]])
+
+    threads = [threading.Thread(target=append, args=(log,)) for log in logs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path) as f:
+        lines = f.readlines()
+    assert lines[0] == LOG_HEADER and lines.count(LOG_HEADER) == 1
+    assert len(lines) == 1 + 8 * 20
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["log.csv"]
+
+
+@pytest.fixture
+def replayed(monkeypatch):
+    # A replay of one comparison, and the Firestore it would be applied to
+    client = LocalFirestore({"allCities": {"a": {"global_Elo": 1000.0, "comparison_count": 0}}})
+    monkeypatch.setitem(sys.modules, "firebase_config", type(sys)("firebase_config"))
+    sys.modules["firebase_config"].db = client
+    index = CityIndex(["a", "b"])
+    ratings, counts, _ = replay([(np.array(["a"], dtype=object), np.array(["b"], dtype=object))], index)
+    return build_report(index, ratings, counts, None), client
+
+
+def test_apply_refuses_while_deltas_are_buffered(replayed):
+    report, client = replayed
+    with pytest.raises(RuntimeError):
+        apply_to_firestore(report)
+    with pytest.raises(RuntimeError):
+        apply_to_firestore(report, [{"pendingCities": 0}, {"pendingCities": 3}])
+    assert client.data["allCities"] == {"a": {"global_Elo": 1000.0, "comparison_count": 0}}
+
+
+@pytest.mark.parametrize("drained", [{"buffer_stats": [{"pendingCities": 0}] * 2}, {"servers_stopped": True}])
+def test_apply_writes_once_the_buffers_are_drained(replayed, drained):
+    report, client = replayed
+    apply_to_firestore(report, **drained)
+    cities = client.data["allCities"]
+    assert cities["a"]["comparison_count"] == 1 and cities["b"]["comparison_count"] == 1
+    assert cities["a"]["global_Elo"] > 1000.0 > cities["b"]["global_Elo"]
+
+
+def test_cities_new_to_the_log_start_from_the_snapshot():
+    index = CityIndex()
+    ratings, counts, _ = replay(
+        [(np.array(["a"], dtype=object), np.array(["b"], dtype=object))],
+        index,
+        initial={"a": (1200.0, 4)},
+        global_k=GLOBAL_K
+    )
+    assert counts.tolist() == [5, 1]
+    assert ratings[0] > 1200.0 and ratings[1] < 1000.0
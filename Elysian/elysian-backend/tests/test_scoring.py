@@ -0,0 +1,60 @@
+"""
+ScoringEngine must give the same scores as the original per-city loop
+(bench_scoring.loop_scores), and the ANN decomposition must be exact.
+"""
+
+import numpy as np
+import pytest
+from bench_scoring import ALPHA, BETA, GAMMA, loop_scores
+from scoring import ScoringEngine, ann_vectors, top_k
+
+
+@pytest.fixture
+def city_vectors():
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(40, 8)).astype(np.float32)
+    vectors[3] = 0   # A zero row keeps a cosine of 0
+    return vectors
+
+
+@pytest.fixture
+def engine(city_vectors):
+    return ScoringEngine(city_vectors, alpha=ALPHA, beta=BETA, gamma=GAMMA)
+
+
+@pytest.mark.parametrize("liked_idx, disliked_idx", [
+    ([], []),
+    ([1, 5, 9], []),
+    ([], [2, 3]),
+    ([0, 4, 8, 12], [1, 3, 30])
+])
+def test_scores_match_loop(city_vectors, engine, liked_idx, disliked_idx):
+    user_vec = np.random.default_rng(1).normal(size=city_vectors.shape[1]).astype(np.float32)
+    expected = loop_scores(city_vectors, user_vec, liked_idx, disliked_idx)
+    actual = engine.scores(user_vec, liked_idx, disliked_idx)
+    # The loop adds 1e-8 to the norms, so allow for that
+    np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+
+def test_precomputed_normed_is_used_as_is(city_vectors, engine):
+    other = ScoringEngine(city_vectors, normed=engine.normed)
+    assert other.normed is engine.normed
+
+
+def test_query_vector_and_scores_at_are_exact(city_vectors, engine):
+    user_vec = np.random.default_rng(2).normal(size=city_vectors.shape[1]).astype(np.float32)
+    for liked, disliked in [([1, 2], [5]), ([], [5]), ([1], []), ([], [])]:
+        liked_mean, disliked_mean = engine.group_mean(liked), engine.group_mean(disliked)
+        full = engine.scores_from_means(user_vec, liked_mean, disliked_mean)
+        query = engine.query_vector(user_vec, liked_mean, disliked_mean)
+        np.testing.assert_allclose(ann_vectors(city_vectors, engine.normed) @ query, full, atol=1e-4)
+        idx = np.array([0, 7, 39])
+        np.testing.assert_allclose(engine.scores_at(idx, user_vec, liked_mean, disliked_mean), full[idx], atol=1e-5)
+
+
+def test_top_k_skips_excluded_and_sorts():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+    assert top_k(scores, 3) == [1, 3, 2]
+    assert top_k(scores, 3, exclude_idx=[1]) == [3, 2, 4]
+    assert top_k(scores, 10, exclude_idx=[0, 1, 2]) == [3, 4]
+    assert top_k(scores, 2, exclude_idx=[0, 1, 2, 3, 4]) == []
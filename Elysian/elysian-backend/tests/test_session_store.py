@@ -0,0 +1,39 @@
+"""
+Both session stores keep sessions and finished ratings with the same behavior.
+"""
+
+import time
+import pytest
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(timeout=0.2, result_timeout=0.3)
+    return SQLiteSessionStore(timeout=0.2, path=str(tmp_path / "sessions.db"), result_timeout=0.3)
+
+
+def test_sessions_expire(store):
+    store.put("u1", {"city_id": "c1", "lastActivity": 0})
+    assert store.get("u1")["city_id"] == "c1"
+    time.sleep(0.25)
+    assert store.get("u1") is None
+    store.cleanup()
+    assert len(store) == 0
+
+
+def test_result_is_claimed_once(store):
+    store.put_result("r1", "u1", {"globalDeltas": {"c1": 1.5}})
+    assert store.claim_result("r1", "u2") == (None, False)
+    assert store.claim_result("r1", "u1") == ({"globalDeltas": {"c1": 1.5}}, True)
+    assert store.claim_result("r1", "u1") == ({"globalDeltas": {"c1": 1.5}}, False)
+    assert store.claim_result("r2", "u1") == (None, False)
+
+
+def test_results_expire(store):
+    store.put_result("r1", "u1", {})
+    time.sleep(0.35)
+    assert store.claim_result("r1", "u1") == (None, False)
+    store.cleanup()
+    assert store.claim_result("r1", "u1") == (None, False)
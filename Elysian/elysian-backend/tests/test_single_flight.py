@@ -0,0 +1,141 @@
+"""
+SingleFlight and AsyncSingleFlight run one call per key, share its result, and
+never hand a waiter the leader's cancellation.
+"""
+
+import asyncio
+import threading
+import time
+import pytest
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_interrupted_leader_releases_the_key():
+    flight = SingleFlight()
+    started = threading.Event()
+    results = []
+
+    def interrupted():
+        started.set()
+        time.sleep(0.02)
+        raise KeyboardInterrupt
+
+    def waiter():
+        started.wait()
+        try:
+            flight.do("k", lambda: "unused")
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    with pytest.raises(KeyboardInterrupt):
+        flight.do("k", interrupted)
+    thread.join(1)
+    assert not thread.is_alive()
+    assert isinstance(results[0], RuntimeError)
+    # The key is free again
+    assert flight.do("k", lambda: "value") == "value"
+
+
+def test_started_call_streams_to_readers_at_their_own_pace():
+    flight = SingleFlight()
+    reader_done = threading.Event()
+
+    def produce(call):
+        for i in range(3):
+            call.publish(i)
+        return [0, 1, 2]
+
+    call, leader = flight.start("k", produce)
+    assert leader
+    # Nobody reads yet, but the call still finishes and frees the key
+    call.done.wait(1)
+    assert flight.do("k", lambda: "next") == "next"
+
+    def read():
+        assert list(call.stream()) == [0, 1, 2]
+        reader_done.set()
+
+    threading.Thread(target=read).start()
+    assert reader_done.wait(1)
+    assert call.wait() == [0, 1, 2]
+
+
+def test_async_calls_are_shared():
+    flight = AsyncSingleFlight()
+    started = []
+
+    async def load():
+        started.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", load) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(started) == 1
+    assert flight.stats() == {"calls": 1, "shared": 4}
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    flight = AsyncSingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == "value"
+
+
+def test_errors_reach_every_waiter():
+    flight = AsyncSingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", load) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+
+
+def test_stream_is_decoupled_from_slow_readers():
+    flight = AsyncSingleFlight()
+
+    async def produce(call):
+        for i in range(3):
+            call.publish(i)
+            await asyncio.sleep(0)
+        return [0, 1, 2]
+
+    async def read(delay):
+        call, _ = flight.join("k", produce)
+        items = []
+        async for item in call.stream():
+            items.append(item)
+            await asyncio.sleep(delay)
+        return items, await call.wait()
+
+    async def main():
+        slow = asyncio.create_task(read(0.02))
+        fast = asyncio.create_task(read(0))
+        await fast
+        # The call finished (and left the flight) while the slow reader was still reading
+        assert not flight._calls
+        return await slow, await fast
+
+    slow, fast = asyncio.run(main())
+    assert slow == fast == ([0, 1, 2], [0, 1, 2])
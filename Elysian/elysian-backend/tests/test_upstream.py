@@ -0,0 +1,131 @@
+"""
+Deadlines, the circuit breaker and the bulkhead, against a local HTTP server
+whose delay and status code the tests change while it runs.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from upstream import CLOSED, HALF_OPEN, OPEN, BulkheadFull, CircuitOpen, Upstream
+
+
+@pytest.fixture
+def server():
+    fault = {"delay": 0.0, "status": 200}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(fault["delay"])
+            body = json.dumps({"ok": fault["status"] == 200}).encode()
+            self.send_response(fault["status"])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/"
+
+    def get(timeout):
+        r = requests.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    yield get, fault
+    httpd.shutdown()
+
+
+def fail(upstream, get, times):
+    for _ in range(times):
+        with pytest.raises(requests.HTTPError):
+            upstream.call(get)
+
+
+def test_failures_open_the_circuit(server):
+    get, fault = server
+    upstream = Upstream("fake", timeout=0.2, max_concurrent=4, failure_threshold=3, reset_timeout=0.3)
+    assert upstream.call(get) == {"ok": True}
+
+    fault["status"] = 503
+    fail(upstream, get, 3)
+    assert upstream.state == OPEN
+
+    # Open: fails fast without reaching the server
+    started = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        upstream.call(get)
+    assert time.monotonic() - started < 0.01
+    assert upstream.counters["circuitRejected"] == 1
+
+
+def test_probe_reopens_or_closes(server):
+    get, fault = server
+    upstream = Upstream("fake", timeout=0.2, max_concurrent=4, failure_threshold=1, reset_timeout=0.2)
+    fault["status"] = 503
+    fail(upstream, get, 1)
+
+    # A failed probe re-opens the circuit, a good one closes it
+    time.sleep(0.25)
+    fail(upstream, get, 1)
+    assert upstream.state == OPEN
+    fault["status"] = 200
+    time.sleep(0.25)
+    assert upstream.call(get) == {"ok": True}
+    assert upstream.state == CLOSED
+
+
+def test_one_probe_at_a_time():
+    upstream = Upstream("fake", timeout=1, max_concurrent=4, failure_threshold=1, reset_timeout=0)
+    upstream.end(upstream.begin(), RuntimeError("down"))
+    probe = upstream.begin()
+    assert upstream.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        upstream.begin()
+    upstream.end(probe)
+    assert upstream.state == CLOSED
+
+
+def test_late_success_does_not_close_an_open_circuit():
+    upstream = Upstream("fake", timeout=1, max_concurrent=4, failure_threshold=1, reset_timeout=60)
+    slow = upstream.begin()
+    upstream.end(upstream.begin(), RuntimeError("down"))
+    assert upstream.state == OPEN
+    upstream.end(slow)
+    assert upstream.state == OPEN
+
+
+def test_deadline(server):
+    get, fault = server
+    upstream = Upstream("fake", timeout=0.2, max_concurrent=4)
+    fault["delay"] = 1.0
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        upstream.call(get)
+    assert time.monotonic() - started < 0.5
+    assert upstream.counters["timeouts"] == 1
+
+
+def test_bulkhead_rejects_extra_calls(server):
+    get, fault = server
+    fault["delay"] = 0.3
+    upstream = Upstream("fake", timeout=1, max_concurrent=4, failure_threshold=100)
+
+    def attempt(_):
+        try:
+            upstream.call(get)
+            return "ok"
+        except BulkheadFull:
+            return "rejected"
+
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(attempt, range(12)))
+    assert results.count("ok") == 4
+    assert results.count("rejected") == 8
+    assert upstream.stats()["active"] == 0
@@ -0,0 +1,99 @@
+"""
+File: ttl_cache.py
+Function: Small thread-safe in-process cache with LRU eviction and a TTL.
+
+Entries older than the TTL (or their own TTL, if set() was given one) are
+treated as misses, and once the cache is full the least recently used entry is
+evicted. Expired entries stay until they are replaced or evicted, so get_stale()
+can still serve them while the source of the values is down (see upstream.py).
+The cache counts hits, misses and evictions so they can be reported on /metrics.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    '''
+    Class for a bounded key -> value cache.
+    `maxsize` is the most entries kept, `ttl` is how long (seconds) an entry is fresh
+    unless set() is given a TTL for that entry.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        '''
+        Function that returns the cached value for key, or default if it is missing or expired.
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now > entry[1]:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_stale(self, key, default=None):
+        '''
+        Function that returns the cached value for key even if it has expired.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        '''
+        Function that stores a value and evicts the least recently used entries if full.
+        `ttl` overrides the cache's TTL for this entry.
+        '''
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        '''
+        Function that removes a single key (no-op if missing).
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        '''
+        Function that drops every entry (e.g. after the model behind the values changes).
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        '''
+        Function that returns size and hit/miss counters.
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -6,31 +6,75 @@ This helper service searches Unsplash for a landscape image based on a
 city query and returns image details for use in the app. It safely handles
 missing API keys and failed requests by returning None when an image
 cannot be found.
+
+Results are cached in two levels, keyed on the normalized "city country" query:
+an in-process LRU and a SQLite file shared by all workers that survives restarts.
+Found images are kept for IMAGE_CACHE_TTL and "no image found" for the shorter
+IMAGE_NEGATIVE_TTL. Concurrent requests for the same uncached query share one
+Unsplash call, and every call goes over one pooled keep-alive requests.Session.
+The *_async versions do the same over an httpx.AsyncClient for asgi_app.py.
+
+Calls go through upstream.unsplash (deadline, bulkhead, circuit breaker). While
+Unsplash is failing or the circuit is open, the last cached image is served even
+if it has expired.
 """
 
+import asyncio
 import os
+import time
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from ttl_cache import LRUTTLCache
+from disk_cache import DiskCache
+from single_flight import AsyncSingleFlight, SingleFlight
+import upstream
+from upstream import UpstreamError
 
 # Read the Unsplash API key from environment variables.
 # Keeps the key secure instead of hardcoding it.
 UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY", "")
 
-def fetch_city_image(query: str):
-    # If no API key is set, stop early and return None to avoid unnecessary API calls.
-    if not UNSPLASH_ACCESS_KEY:
-        return None
+# Search endpoint (can point at a local stand-in server for testing)
+UNSPLASH_API_URL = os.getenv("UNSPLASH_API_URL", "https://api.unsplash.com/search/photos")
+REQUEST_TIMEOUT = upstream.unsplash.timeout   # Seconds; requests from the app use upstream.IMAGE_REQUEST_TIMEOUT
+
+# Cache settings
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))   # Found images: 7 days
+IMAGE_NEGATIVE_TTL = int(os.getenv("IMAGE_NEGATIVE_TTL", "3600"))   # "No image found": 1 hour
+IMAGE_MEMORY_CACHE_SIZE = int(os.getenv("IMAGE_MEMORY_CACHE_SIZE", "2048"))
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", "image_cache.db")
+
+# One pooled session so repeated calls reuse the TLS connection to Unsplash
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Each memory entry expires with its disk entry: found images after IMAGE_CACHE_TTL,
+# a cached miss after IMAGE_NEGATIVE_TTL.
+memory_cache = LRUTTLCache(maxsize=IMAGE_MEMORY_CACHE_SIZE, ttl=IMAGE_CACHE_TTL)
+disk_cache = DiskCache(IMAGE_CACHE_PATH)
+in_flight = SingleFlight()
+async_in_flight = AsyncSingleFlight()
+upstream_calls = 0
+
+_MISSING = object()   # Tells a cache miss apart from a cached None
+
+
+def normalize_query(query: str):
+    # "  Paris   France " and "paris france" share one cache entry
+    return " ".join(query.lower().split())
+
+
+def unsplash_request(query: str):
     # Construct the API request to search for photos matching the city query.
-    url = "https://api.unsplash.com/search/photos"
     params = {"query": query, "per_page": 1, "orientation": "landscape"}
     headers = {"Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"}
+    return params, headers
 
-    # Make the API request and handle potential errors gracefully.
-    r = requests.get(url, params=params, headers=headers, timeout=10)
-    # If the request fails (e.g., network issues, invalid API key), return None to indicate no image found.
-    if r.status_code != 200:
-        return None
-    # Parse the JSON response and extract the first photo's details if available.
-    data = r.json()
+
+def parse_unsplash(data):
+    # Extract the first photo's details if available.
     results = data.get("results", [])
     # If no photos are found for the query, return None to indicate no image available.
     if not results:
@@ -44,3 +88,141 @@ def fetch_city_image(query: str):
         "photographer": photo["user"]["name"],
         "sourceUrl": photo["links"]["html"],
     }
+
+
+def search_unsplash(query: str, timeout=REQUEST_TIMEOUT):
+    '''
+    Function that asks Unsplash for the first landscape photo of the query.
+    Returns the image details, None if Unsplash has no photo for it, or raises
+    requests.RequestException if the call failed (so failures are not cached).
+    '''
+    global upstream_calls
+    upstream_calls += 1
+
+    params, headers = unsplash_request(query)
+    # Make the API request over the pooled session.
+    r = session.get(UNSPLASH_API_URL, params=params, headers=headers, timeout=timeout)
+    # If the request fails (e.g., rate limit, invalid API key), raise so the miss isn't cached.
+    r.raise_for_status()
+    return parse_unsplash(r.json())
+
+
+async def search_unsplash_async(query: str, client, timeout=REQUEST_TIMEOUT):
+    '''
+    Function for search_unsplash over an httpx.AsyncClient (raises httpx.HTTPError on failure).
+    '''
+    global upstream_calls
+    upstream_calls += 1
+
+    params, headers = unsplash_request(query)
+    r = await client.get(UNSPLASH_API_URL, params=params, headers=headers, timeout=timeout)
+    r.raise_for_status()
+    return parse_unsplash(r.json())
+
+
+def _store(key, image):
+    ttl = IMAGE_CACHE_TTL if image else IMAGE_NEGATIVE_TTL
+    disk_cache.set(key, image, ttl)
+    memory_cache.set(key, image, ttl=ttl)
+
+
+def _load(key):
+    # Runs once per key at a time (see SingleFlight): disk cache first, then Unsplash.
+    found, image, expires_at = disk_cache.get_entry(key)
+    if not found:
+        image = upstream.unsplash.call(search_unsplash, key, timeout=upstream.IMAGE_REQUEST_TIMEOUT)
+        _store(key, image)
+    else:
+        memory_cache.set(key, image, ttl=expires_at - time.time())
+    return image
+
+
+def refresh_city_image(query: str):
+    '''
+    Function that asks Unsplash again and replaces the cached result (used by prewarm.py).
+    Raises requests.RequestException if the call fails, leaving the cached entry as it was.
+    '''
+    if not UNSPLASH_ACCESS_KEY:
+        raise RuntimeError("UNSPLASH_ACCESS_KEY not set")
+    key = normalize_query(query)
+    image = in_flight.do(key, lambda: upstream.unsplash.call(search_unsplash, key))
+    _store(key, image)
+    return image
+
+
+def image_expires_at(query: str):
+    '''
+    Function that returns when the cached result for the query expires (None if not cached).
+    '''
+    return disk_cache.expires_at(normalize_query(query))
+
+
+def fetch_city_image(query: str):
+    # If no API key is set, stop early and return None to avoid unnecessary API calls.
+    if not UNSPLASH_ACCESS_KEY:
+        return None
+
+    key = normalize_query(query)
+    image = memory_cache.get(key, _MISSING)
+    if image is not _MISSING:
+        return image
+
+    try:
+        return in_flight.do(key, lambda: _load(key))
+    except (requests.RequestException, ValueError, UpstreamError):
+        # Network error, non-200 status, invalid JSON or the circuit is open: serve the last
+        # cached image if there is one, and retry on the next request
+        return _stale(key)
+
+
+def _stale(key):
+    found, image = disk_cache.get_stale(key)
+    if found and image:
+        upstream.unsplash.record_fallback()
+        return image
+    return None
+
+
+async def _load_async(key, client):
+    # SQLite reads and writes block, so they run in a thread instead of on the event loop.
+    found, image, expires_at = await asyncio.to_thread(disk_cache.get_entry, key)
+    if not found:
+        image = await upstream.unsplash.call_async(
+            search_unsplash_async, key, client, timeout=upstream.IMAGE_REQUEST_TIMEOUT
+        )
+        await asyncio.to_thread(_store, key, image)
+    else:
+        memory_cache.set(key, image, ttl=expires_at - time.time())
+    return image
+
+
+async def fetch_city_image_async(query: str, client):
+    '''
+    Function for fetch_city_image that calls Unsplash with an httpx.AsyncClient (asgi_app.py).
+    Shares the memory and disk caches with the sync version.
+    '''
+    if not UNSPLASH_ACCESS_KEY:
+        return None
+
+    key = normalize_query(query)
+    image = memory_cache.get(key, _MISSING)
+    if image is not _MISSING:
+        return image
+
+    try:
+        return await async_in_flight.do(key, lambda: _load_async(key, client))
+    except (httpx.HTTPError, ValueError, UpstreamError, TimeoutError):
+        return await asyncio.to_thread(_stale, key)
+
+
+def stats():
+    '''
+    Function that returns cache and upstream counters for /metrics.
+    '''
+    return {
+        "memoryCache": memory_cache.stats(),
+        "diskCache": disk_cache.stats(),
+        "singleFlight": in_flight.stats(),
+        "asyncSingleFlight": async_in_flight.stats(),
+        "upstreamCalls": upstream_calls
+    }
@@ -0,0 +1,252 @@
+"""
+File: upstream.py
+Function: Deadlines, bulkheads and circuit breakers for calls to Unsplash, Gemini and Firestore.
+
+Every call to an outside dependency goes through that dependency's Upstream:
+
+- Deadline: each call gets a timeout (the dependency's default, or a shorter one
+  for interactive endpoints), passed to the client and, for async calls,
+  enforced with asyncio.wait_for.
+- Bulkhead: at most `max_concurrent` calls to the dependency at once. Extra calls
+  are rejected right away instead of queueing, so a slow dependency can only tie
+  up its own share of the worker threads.
+- Circuit breaker: after `failure_threshold` failures in a row the circuit opens
+  and calls fail fast (CircuitOpen) for `reset_timeout` seconds. Then one probe
+  call is let through (half-open); if it succeeds the circuit closes again.
+
+Read paths catch UpstreamError (and the client's own errors) and fall back to the
+last cached value, even if it has expired (see unsplash_service.py,
+activities_service.py and feedback_store.py). Write paths (ratings, swipes,
+global Elo flushes) never use a fallback: they fail, and the routes answer
+UNAVAILABLE_ERRORS with 503.
+Latency and error counters of every dependency are reported on /metrics.
+
+tests/test_upstream.py checks the breaker and bulkhead against a local fake
+server that injects delay and failures.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+import httpx
+import requests
+from google.api_core import exceptions as google_exceptions
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+LATENCY_WINDOW = 1000   # Latest calls kept for the latency percentiles
+
+# Errors that mean the call ran into its deadline
+TIMEOUT_ERRORS = (
+    TimeoutError,
+    requests.Timeout,
+    httpx.TimeoutException,
+    google_exceptions.DeadlineExceeded
+)
+
+
+class UpstreamError(Exception):
+    '''
+    Base class for calls rejected without reaching the dependency.
+    '''
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+class BulkheadFull(UpstreamError):
+    pass
+
+
+# Errors that mean a dependency could not be used (rejected, timed out or failed)
+UNAVAILABLE_ERRORS = (UpstreamError, google_exceptions.GoogleAPIError) + TIMEOUT_ERRORS
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, str(default)))
+
+
+class Upstream:
+    '''
+    Class that guards the calls to one dependency (see the module docstring).
+    '''
+
+    def __init__(self, name, timeout, max_concurrent, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self._failures = 0   # Failures in a row
+        self._opened_at = 0.0
+        self._probing = False
+        self._active = 0
+        self._lock = threading.Lock()
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0, "timeouts": 0,
+            "circuitRejected": 0, "bulkheadRejected": 0, "fallbacks": 0
+        }
+
+    def begin(self):
+        '''
+        Function that admits one call or raises CircuitOpen / BulkheadFull.
+        Returns a token (start time, whether the call is the half-open probe)
+        that must be passed to end() when the call is over.
+        '''
+        probe = False
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.counters["circuitRejected"] += 1
+                    raise CircuitOpen(f"{self.name} circuit is open")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                # Only one probe at a time while half-open
+                if self._probing:
+                    self.counters["circuitRejected"] += 1
+                    raise CircuitOpen(f"{self.name} circuit is half-open")
+                self._probing = probe = True
+            if self._active >= self.max_concurrent:
+                if probe:
+                    self._probing = False
+                self.counters["bulkheadRejected"] += 1
+                raise BulkheadFull(f"{self.name} has {self._active} calls in flight")
+            self._active += 1
+            self.counters["calls"] += 1
+        return time.monotonic(), probe
+
+    def end(self, token, error=None):
+        '''
+        Function that records the result of a call admitted by begin().
+        '''
+        started, probe = token
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._active -= 1
+            self._latencies.append(elapsed)
+            if probe:
+                self._probing = False
+
+            if error is None:
+                self.counters["successes"] += 1
+                # A slow call admitted before the circuit opened doesn't close it; only the probe does
+                if probe or self.state == CLOSED:
+                    self._failures = 0
+                    self.state = CLOSED
+                return
+
+            self.counters["failures"] += 1
+            if isinstance(error, TIMEOUT_ERRORS):
+                self.counters["timeouts"] += 1
+            self._failures += 1
+            if probe or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        '''
+        Function that runs fn(*args, timeout=..., **kwargs) through the breaker and bulkhead.
+        '''
+        timeout = timeout or self.timeout
+        token = self.begin()
+        try:
+            result = fn(*args, timeout=timeout, **kwargs)
+        except Exception as e:
+            self.end(token, e)
+            raise
+        self.end(token)
+        return result
+
+    async def call_async(self, fn, *args, timeout=None, **kwargs):
+        '''
+        Function for call() with a coroutine function; the deadline is also enforced with wait_for.
+        '''
+        timeout = timeout or self.timeout
+        token = self.begin()
+        try:
+            result = await asyncio.wait_for(fn(*args, timeout=timeout, **kwargs), timeout)
+        except asyncio.CancelledError:
+            # The caller went away; this says nothing about the dependency's health.
+            self.release(token)
+            raise
+        except Exception as e:
+            self.end(token, e)
+            raise
+        self.end(token)
+        return result
+
+    def release(self, token):
+        '''
+        Function that ends an admitted call without counting it as a success or failure.
+        '''
+        with self._lock:
+            self._active -= 1
+            if token[1]:
+                self._probing = False
+
+    def record_fallback(self):
+        with self._lock:
+            self.counters["fallbacks"] += 1
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self.counters)
+            stats.update({
+                "state": self.state,
+                "active": self._active,
+                "maxConcurrent": self.max_concurrent,
+                "timeoutSeconds": self.timeout
+            })
+        if latencies:
+            stats["latencyMs"] = {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p99": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1)
+            }
+        return stats
+
+
+# One Upstream per dependency, shared by every module that calls it
+unsplash = Upstream(
+    "unsplash",
+    timeout=_env_float("UNSPLASH_TIMEOUT", 10),
+    max_concurrent=int(os.environ.get("UNSPLASH_MAX_CONCURRENT", "16")),
+    failure_threshold=int(os.environ.get("UNSPLASH_FAILURE_THRESHOLD", "5")),
+    reset_timeout=_env_float("UNSPLASH_RESET_TIMEOUT", 30)
+)
+gemini = Upstream(
+    "gemini",
+    timeout=_env_float("GEMINI_TIMEOUT", 60),
+    max_concurrent=int(os.environ.get("GEMINI_MAX_CONCURRENT", "8")),
+    failure_threshold=int(os.environ.get("GEMINI_FAILURE_THRESHOLD", "3")),
+    reset_timeout=_env_float("GEMINI_RESET_TIMEOUT", 60)
+)
+firestore = Upstream(
+    "firestore",
+    timeout=_env_float("FIRESTORE_TIMEOUT", 5),
+    max_concurrent=int(os.environ.get("FIRESTORE_MAX_CONCURRENT", "64")),
+    failure_threshold=int(os.environ.get("FIRESTORE_FAILURE_THRESHOLD", "5")),
+    reset_timeout=_env_float("FIRESTORE_RESET_TIMEOUT", 10)
+)
+
+# Shorter deadlines for calls a user is waiting on (prewarm and the CLI use the defaults above)
+IMAGE_REQUEST_TIMEOUT = _env_float("IMAGE_REQUEST_TIMEOUT", 3)
+ACTIVITY_REQUEST_TIMEOUT = _env_float("ACTIVITY_REQUEST_TIMEOUT", 30)
+FEEDBACK_READ_TIMEOUT = _env_float("FEEDBACK_READ_TIMEOUT", 2)
+
+
+def stats():
+    '''
+    Function that returns every dependency's counters for /metrics.
+    '''
+    return {upstream.name: upstream.stats() for upstream in (unsplash, gemini, firestore)}